@@ -0,0 +1,3 @@
+"""
+离线基准测试：合成工具库、本地向量化替身和各阶段耗时统计
+"""
@@ -0,0 +1,91 @@
+"""
+合成工具库生成器
+"""
+import random
+import uuid
+from typing import List, Dict, Any, Iterator
+
+# 用于拼接工具名和描述的词表，中英文混合以贴近真实工具库
+_VERBS = ["get", "search", "create", "update", "delete", "list", "send", "query", "translate", "calculate"]
+_NOUNS = ["stock", "weather", "news", "email", "calendar", "order", "user", "file", "invoice", "flight",
+          "hotel", "payment", "report", "ticket", "map", "music", "video", "contact", "task", "price"]
+_CN_NOUNS = ["股票", "天气", "新闻", "邮件", "日程", "订单", "用户", "文件", "发票", "航班",
+             "酒店", "支付", "报表", "工单", "地图", "音乐", "视频", "联系人", "任务", "价格"]
+_CN_VERBS = ["查询", "搜索", "创建", "更新", "删除", "列出", "发送", "获取", "翻译", "计算"]
+_ARG_NAMES = ["id", "name", "city", "symbol", "date", "query", "limit", "offset", "language", "amount",
+              "currency", "email", "title", "content", "start_time", "end_time", "status", "type"]
+
+
+def generate_tool(rng: random.Random, index: int, max_args: int = 5) -> Dict[str, Any]:
+    """
+    生成一个合成工具
+
+    Args:
+        rng: 随机数生成器
+        index: 工具序号，用于保证工具名唯一
+        max_args: 最大参数数量
+
+    Returns:
+        工具数据，包含固定的uuid
+    """
+    verb = rng.randrange(len(_VERBS))
+    noun = rng.randrange(len(_NOUNS))
+    num_args = rng.randint(1, max_args)
+    arg_names = rng.sample(_ARG_NAMES, num_args)
+
+    return {
+        "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+        "ToolName": f"{_VERBS[verb]}_{_NOUNS[noun]}_{index}",
+        "ToolDescription": f"{_CN_VERBS[verb]}指定的{_CN_NOUNS[noun]}信息，编号{index}。",
+        "Args": [
+            {"ArgName": arg_name, "ArgDescription": f"{_CN_NOUNS[noun]}的{arg_name}参数"}
+            for arg_name in arg_names
+        ]
+    }
+
+
+def iter_catalog(num_slices: int, seed: int = 0, max_args: int = 5) -> Iterator[Dict[str, Any]]:
+    """
+    逐个生成合成工具，直到切片总数达到num_slices
+
+    每个工具的切片数为 1（概览）+ 参数个数。
+
+    Args:
+        num_slices: 目标切片数量，可从10^3扩展到10^6
+        seed: 随机种子，相同种子生成相同的工具库
+        max_args: 每个工具的最大参数数量
+
+    Yields:
+        工具数据
+    """
+    rng = random.Random(seed)
+    produced = 0
+    index = 0
+    while produced < num_slices:
+        tool = generate_tool(rng, index, max_args)
+        produced += 1 + len(tool["Args"])
+        index += 1
+        yield tool
+
+
+def generate_catalog(num_slices: int, seed: int = 0, max_args: int = 5) -> List[Dict[str, Any]]:
+    """生成切片总数约为num_slices的合成工具库"""
+    return list(iter_catalog(num_slices, seed, max_args))
+
+
+def generate_queries(num_queries: int, seed: int = 1) -> List[str]:
+    """
+    生成合成查询
+
+    Args:
+        num_queries: 查询数量
+        seed: 随机种子
+
+    Returns:
+        查询列表
+    """
+    rng = random.Random(seed)
+    return [
+        f"{rng.choice(_CN_VERBS)}{rng.choice(_CN_NOUNS)}的{rng.choice(_ARG_NAMES)}"
+        for _ in range(num_queries)
+    ]
@@ -0,0 +1,103 @@
+"""
+基准测试用的本地替身：确定性向量化服务、本地Redis和轻量精排
+"""
+import hashlib
+import re
+import time
+from typing import List, Dict, Tuple, Optional
+
+import numpy as np
+import redis
+
+from src.embedding_service import EmbeddingService
+from src.reranker import RerankerService
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]")
+
+
+def tokenize(text: str) -> List[str]:
+    """英文按单词、中文按单字及相邻二元组切分"""
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    bigrams = [a + b for a, b in zip(tokens, tokens[1:]) if len(a) == 1 and len(b) == 1]
+    return tokens + bigrams
+
+
+class LocalEmbeddingService(EmbeddingService):
+    """
+    确定性的本地向量化服务
+
+    每个词元映射到一个由哈希决定的随机向量，文本向量为其词元向量之和。
+    共享词元的文本相似度更高，足以让检索结果具有可比性；不发起任何网络请求。
+    缓存、分批和并发逻辑沿用EmbeddingService。
+    """
+
+    def __init__(self, dimensions: int = 1024, latency_ms: float = 0.0, **kwargs):
+        """
+        初始化本地向量化服务
+
+        Args:
+            dimensions: 向量维度
+            latency_ms: 每次“请求”模拟的网络延迟（毫秒）
+            **kwargs: 透传给EmbeddingService，例如cache、max_concurrency
+        """
+        super().__init__(**kwargs)
+        self.model = "local-hash"
+        self.dimensions = dimensions
+        self.latency_ms = latency_ms
+        self._token_vectors: Dict[str, np.ndarray] = {}
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimensions, dtype=np.float32)
+            self._token_vectors[token] = vector
+        return vector
+
+    def _request_embeddings(self, texts: List[str]) -> np.ndarray:
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+
+        embeddings = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in tokenize(text):
+                embeddings[i] += self._token_vector(token)
+
+        with self._stats_lock:
+            self.api_calls += 1
+            self.api_texts += len(texts)
+        return embeddings
+
+
+class LexicalReranker(RerankerService):
+    """按词元重叠打分的轻量精排替身，不加载交叉编码器模型"""
+
+    def score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        scores = []
+        for query, document in pairs:
+            query_tokens = set(tokenize(query))
+            document_tokens = set(tokenize(document))
+            union = query_tokens | document_tokens
+            scores.append(len(query_tokens & document_tokens) / len(union) if union else 0.0)
+        return scores
+
+
+def make_connection_pool(redis_url: Optional[str] = None) -> redis.ConnectionPool:
+    """
+    创建基准测试使用的Redis连接池
+
+    Args:
+        redis_url: 测试Redis实例地址；为空时使用fakeredis进程内替身（需安装fakeredis）
+
+    Returns:
+        Redis连接池
+    """
+    if redis_url:
+        return redis.ConnectionPool.from_url(redis_url)
+
+    try:
+        import fakeredis
+    except ImportError as e:
+        raise ImportError("未指定测试Redis地址时需要安装fakeredis：uv sync --extra bench") from e
+
+    return redis.ConnectionPool(connection_class=fakeredis.FakeConnection, server=fakeredis.FakeServer())
@@ -0,0 +1,403 @@
+"""
+索引与检索各阶段的离线基准测试
+
+用法：
+    uv run python -m benchmarks.run --slices 1000 10000 100000 --queries 200 --output bench.json
+
+默认使用本地向量化替身、fakeredis和词元重叠精排替身，不需要网络和模型；
+结果写为JSON，可在不同提交之间对比。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import time
+from typing import List, Dict, Any, Callable, Optional, TypeVar
+
+import numpy as np
+
+from src.embedding_cache import EmbeddingCache
+from src.models import DEFAULT_NAMESPACE, Tool
+from src.rag_system import RAGSystem
+from src.redis_service import RedisService
+from src.reranker import RerankerService, DOCUMENT_FORMATS
+from src.result_cache import QueryResultCache
+
+from .catalog import generate_catalog, generate_queries
+from .fakes import LocalEmbeddingService, LexicalReranker, make_connection_pool
+
+T = TypeVar("T")
+
+# 近似的子词切分：连续的字母数字为一段，每个标点单独一段，用于比较不同文档格式的长度
+_APPROX_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    """计算耗时分位数（毫秒）"""
+    if not samples_ms:
+        return {}
+    values = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "count": int(values.size),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max())
+    }
+
+
+def timed(samples: List[float], func: Callable[..., T], *args, **kwargs) -> T:
+    """执行函数并把耗时（毫秒）追加到samples"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    samples.append((time.perf_counter() - start) * 1000.0)
+    return result
+
+
+def build_system(args: argparse.Namespace) -> RAGSystem:
+    """组装使用本地替身的RAG系统"""
+    pool = make_connection_pool(args.redis_url)
+    redis_service = RedisService(connection_pool=pool, precision=args.precision)
+    redis_service.vector_dims = args.dims
+
+    embedding_service = LocalEmbeddingService(
+        dimensions=args.dims,
+        latency_ms=args.embedding_latency_ms,
+        cache=EmbeddingCache()
+    )
+    reranker = RerankerService(top_n=args.top_m) if args.real_reranker else LexicalReranker(top_n=args.top_m)
+
+    system = RAGSystem(
+        rerank_top_n=args.top_m,
+        embedding_service=embedding_service,
+        redis_service=redis_service,
+        reranker=reranker,
+        # 各阶段耗时测量的是完整检索路径，查询结果缓存单独由bench_result_cache测量
+        result_cache=QueryResultCache(max_entries=0)
+    )
+    if args.redis_url:
+        # 使用真实测试实例时先清空，保证每轮数据一致
+        with contextlib.redirect_stdout(io.StringIO()):
+            system.clear_all_data()
+    return system
+
+
+def bench_indexing(system: RAGSystem, tools_data: List[Dict[str, Any]], batch_size: int) -> Dict[str, Any]:
+    """测量索引吞吐"""
+    num_slices = sum(1 + len(tool["Args"]) for tool in tools_data)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(0, len(tools_data), batch_size):
+            system.upsert_tools(tools_data[i:i + batch_size])
+    elapsed = time.perf_counter() - start
+
+    return {
+        "tools": len(tools_data),
+        "slices": num_slices,
+        "seconds": elapsed,
+        "tools_per_second": len(tools_data) / elapsed if elapsed > 0 else 0.0,
+        "slices_per_second": num_slices / elapsed if elapsed > 0 else 0.0,
+        "embedding": system.embedding_service.get_cache_stats()
+    }
+
+
+def bench_documents(tools_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """比较各精排文档格式的平均字符数和近似token数；交叉编码器的耗时大致与token数成正比"""
+    tools = [Tool.from_dict(tool_data) for tool_data in tools_data]
+    result = {}
+    for document_format in DOCUMENT_FORMATS:
+        reranker = RerankerService(document_format=document_format)
+        documents = [reranker.document_for(tool)[0] for tool in tools]
+        result[document_format] = {
+            "chars": float(np.mean([len(document) for document in documents])) if documents else 0.0,
+            "tokens": float(np.mean([len(_APPROX_TOKEN_PATTERN.findall(document)) for document in documents]))
+            if documents else 0.0
+        }
+    return result
+
+
+def bench_load(system: RAGSystem) -> Dict[str, Any]:
+    """测量新进程从Redis加载切片向量矩阵的耗时"""
+    fresh = RedisService(
+        connection_pool=system.redis_service.connection_pool,
+        precision=system.redis_service.precision
+    )
+    fresh.vector_dims = system.redis_service.vector_dims
+
+    start = time.perf_counter()
+    store = fresh.get_slice_store()
+    return {
+        "slices": len(store),
+        "seconds": time.perf_counter() - start,
+        "precision": store.precision,
+        "memory_bytes": store.nbytes
+    }
+
+
+def bench_search(system: RAGSystem, queries: List[str], top_n: int, top_m: int, top_k: int) -> Dict[str, Any]:
+    """测量检索各阶段的耗时分位数"""
+    stages: Dict[str, List[float]] = {
+        "embedding": [], "vector_search": [], "coarse_rank": [],
+        "fetch_tools": [], "rerank": [], "total": []
+    }
+
+    # 预先加载切片向量矩阵和词法索引，避免首个查询计入加载时间
+    system.redis_service.get_slice_store()
+    system.lexical_index
+
+    for query in queries:
+        start = time.perf_counter()
+        query_embedding = timed(stages["embedding"], system.embedding_service.get_single_embedding, query)
+        store, rows, scores = timed(stages["vector_search"], system.redis_service.search_slice_rows,
+                                    query_embedding, top_n)
+
+        def coarse():
+            coarse_results, _ = system.coarse_ranker.rank_store_hits(store, rows, scores, None, top_n, top_m)
+            return system.coarse_ranker.get_top_candidates(coarse_results, top_m)
+
+        candidate_uuids = timed(stages["coarse_rank"], coarse)
+        candidate_tools = timed(stages["fetch_tools"], system.redis_service.get_tools_by_uuids, candidate_uuids)
+
+        def rerank():
+            rerank_results = system.reranker.rerank_tools(query, candidate_tools)
+            return system.reranker.get_top_k_tools(rerank_results, top_k)
+
+        timed(stages["rerank"], rerank)
+        stages["total"].append((time.perf_counter() - start) * 1000.0)
+
+    return {name: summarize(samples) for name, samples in stages.items()}
+
+
+def bench_adaptive(system: RAGSystem, queries: List[str], top_n: int, top_m: int, top_k: int,
+                   latency_budget_ms: Optional[float]) -> Dict[str, Any]:
+    """
+    测量自适应级联检索的耗时、各路径占比，以及与完整精排结果相比的
+    Top K一致率（Top K列表及顺序完全相同的查询占比）和recall@K（完整精排Top K中被返回的占比）
+    """
+    samples: List[float] = []
+    paths: Dict[str, int] = {}
+    agreement = 0
+    recall = 0.0
+    for query in queries:
+        result = timed(samples, system.search_tools_adaptive, query, top_n, top_m, top_k, latency_budget_ms)
+        paths[result.path] = paths.get(result.path, 0) + 1
+        adaptive_uuids = [tool.uuid for tool in result.tools]
+        full_uuids = [tool.uuid for tool in system.search_tools(query, top_n, top_m, top_k)]
+        agreement += adaptive_uuids == full_uuids
+        if full_uuids:
+            recall += len(set(adaptive_uuids) & set(full_uuids)) / len(full_uuids)
+
+    return {
+        "latency": summarize(samples),
+        "paths": paths,
+        "top_k_agreement": agreement / len(queries) if queries else 0.0,
+        "top_k_recall": recall / len(queries) if queries else 0.0
+    }
+
+
+def bench_batch(system: RAGSystem, queries: List[str], top_n: int, top_m: int, top_k: int) -> Dict[str, Any]:
+    """比较整批调用search_tools_batch与逐条调用search_tools的总耗时"""
+    start = time.perf_counter()
+    for query in queries:
+        system.search_tools(query, top_n, top_m, top_k)
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    system.search_tools_batch(queries, top_n, top_m, top_k)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        "queries": len(queries),
+        "loop_seconds": loop_seconds,
+        "batch_seconds": batch_seconds,
+        "speedup": loop_seconds / batch_seconds if batch_seconds > 0 else 0.0
+    }
+
+
+def bench_result_cache(system: RAGSystem, queries: List[str], top_n: int, top_m: int, top_k: int,
+                       similarity_threshold: float) -> Dict[str, Any]:
+    """
+    测量查询结果缓存：原始查询首次检索后，依次检索只有空白/大小写不同的查询（精确层）
+    和多了标点的查询（规范化文本不同，精确层未命中，由语义层命中），记录各轮耗时和命中率
+    """
+    uncached = system.result_cache
+    system.result_cache = QueryResultCache(similarity_threshold=similarity_threshold or None)
+    rounds = {
+        "cold": queries,
+        "normalized": [f"  {query.upper()} " for query in queries],
+        "punctuated": [f"{query}？" for query in queries]
+    }
+    try:
+        latency = {}
+        for name, round_queries in rounds.items():
+            samples: List[float] = []
+            for query in round_queries:
+                timed(samples, system.search_tools, query, top_n, top_m, top_k)
+            latency[name] = summarize(samples)
+        stats = system.result_cache.stats()
+    finally:
+        system.result_cache = uncached
+    return {"latency": latency, "stats": stats}
+
+
+def bench_ivf(system: RAGSystem, queries: List[str], top_n: int, num_lists: int,
+              nprobes: List[int]) -> Dict[str, Any]:
+    """
+    在默认命名空间分区上训练IVF，对每个nprobe测量向量检索的耗时分位数，以及相对精确检索的recall@top_n：
+    IVF结果中得分不低于精确检索第N名得分的占比。合成工具库中有大量相同的切片向量，
+    按得分而不是按切片key比较，并列得分的切片都算命中
+
+    训练会重排分区的行，应在其他基准测试之后调用
+    """
+    store = system.redis_service.get_slice_store().partition(DEFAULT_NAMESPACE)
+    embeddings = [system.embedding_service.get_single_embedding(query) for query in queries]
+
+    exact_samples: List[float] = []
+    exact = [timed(exact_samples, store.search_rows, embedding, top_n)[1] for embedding in embeddings]
+
+    num_lists = num_lists or max(int(np.sqrt(len(store))), 1)
+    start = time.perf_counter()
+    store.train_ivf(num_lists)
+    train_seconds = time.perf_counter() - start
+
+    sweep = []
+    for nprobe in nprobes:
+        if nprobe > store.ivf_lists:
+            break
+        samples: List[float] = []
+        hits = 0
+        for embedding, expected in zip(embeddings, exact):
+            _, scores = timed(samples, store.search_rows, embedding, top_n, nprobe=nprobe)
+            if len(expected):
+                hits += int(np.count_nonzero(scores >= expected[-1] - 1e-6))
+        sweep.append({
+            "nprobe": nprobe,
+            "recall": hits / max(sum(len(expected) for expected in exact), 1),
+            "latency": summarize(samples)
+        })
+
+    return {
+        "lists": store.ivf_lists,
+        "train_seconds": train_seconds,
+        "exact": summarize(exact_samples),
+        "sweep": sweep
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="RAG4Tools 离线基准测试")
+    parser.add_argument("--slices", type=int, nargs="+", default=[1000, 10000],
+                        help="合成工具库的切片规模，可指定多个（10^3 ~ 10^6）")
+    parser.add_argument("--queries", type=int, default=200, help="每个规模执行的查询数")
+    parser.add_argument("--dims", type=int, default=1024, help="向量维度")
+    parser.add_argument("--top-n", type=int, default=100)
+    parser.add_argument("--top-m", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--precision", choices=["float32", "float16", "int8"], default="float32",
+                        help="进程内切片向量的存储精度")
+    parser.add_argument("--index-batch", type=int, default=1000, help="每次upsert_tools的工具数")
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0,
+                        help="本地向量化替身模拟的单次请求延迟")
+    parser.add_argument("--redis-url", default=os.getenv("BENCH_REDIS_URL"),
+                        help="测试Redis实例地址（会被清空！），默认使用fakeredis")
+    parser.add_argument("--real-reranker", action="store_true", help="使用真实的bge-reranker-large模型")
+    parser.add_argument("--latency-budget-ms", type=float, default=None, help="自适应检索的单次延迟预算")
+    parser.add_argument("--min-adaptive-agreement", type=float, default=0.9,
+                        help="自适应检索与完整精排的Top K一致率下限，任一规模低于该值时以非零状态退出")
+    parser.add_argument("--query-cache-similarity", type=float, default=0.95,
+                        help="查询结果缓存语义层的相似度阈值，0为不启用语义层")
+    parser.add_argument("--ivf-lists", type=int, default=0, help="IVF簇的数量，0为切片数的平方根")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64],
+                        help="IVF检索扫描的簇数量，可指定多个")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json", help="结果JSON路径")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    queries = generate_queries(args.queries, seed=args.seed + 1)
+
+    runs = []
+    for num_slices in args.slices:
+        print(f"=== 规模: {num_slices} 个切片 ===")
+        system = build_system(args)
+        tools_data = generate_catalog(num_slices, seed=args.seed)
+
+        indexing = bench_indexing(system, tools_data, args.index_batch)
+        print(f"索引: {indexing['slices_per_second']:.0f} 切片/秒")
+
+        documents = bench_documents(tools_data)
+        print("精排文档: " + ", ".join(f"{name} 平均 {stats['chars']:.0f} 字符/{stats['tokens']:.0f} 近似token"
+                                    for name, stats in documents.items()))
+
+        load = bench_load(system)
+        print(f"加载切片矩阵: {load['seconds']:.3f} 秒, {load['memory_bytes'] / 2 ** 20:.1f} MiB ({load['precision']})")
+
+        search = bench_search(system, queries, args.top_n, args.top_m, args.top_k)
+        for stage, stats in search.items():
+            print(f"  {stage:>14}: p50={stats['p50']:.3f}ms p99={stats['p99']:.3f}ms")
+
+        adaptive = bench_adaptive(system, queries, args.top_n, args.top_m, args.top_k, args.latency_budget_ms)
+        print(f"  {'adaptive':>14}: p50={adaptive['latency']['p50']:.3f}ms p99={adaptive['latency']['p99']:.3f}ms "
+              f"paths={adaptive['paths']} top_k一致率={adaptive['top_k_agreement']:.2%} "
+              f"recall@{args.top_k}={adaptive['top_k_recall']:.2%}")
+
+        batch = bench_batch(system, queries, args.top_n, args.top_m, args.top_k)
+        print(f"  {'batch':>14}: 逐条 {batch['loop_seconds']:.3f}s, 批量 {batch['batch_seconds']:.3f}s "
+              f"({batch['speedup']:.1f}x)")
+
+        result_cache = bench_result_cache(system, queries, args.top_n, args.top_m, args.top_k,
+                                          args.query_cache_similarity)
+        latency = result_cache["latency"]
+        print(f"  {'result_cache':>14}: 首次 p50={latency['cold']['p50']:.3f}ms, "
+              f"规范化 p50={latency['normalized']['p50']:.3f}ms, 加标点 p50={latency['punctuated']['p50']:.3f}ms, "
+              f"命中率={result_cache['stats']['hit_rate']:.2%}")
+
+        ivf = bench_ivf(system, queries, args.top_n, args.ivf_lists, args.nprobe)
+        print(f"  {'ivf':>14}: {ivf['lists']} 个簇, 训练 {ivf['train_seconds']:.3f}s, "
+              f"精确 p50={ivf['exact']['p50']:.3f}ms p99={ivf['exact']['p99']:.3f}ms")
+        for point in ivf["sweep"]:
+            print(f"  {'nprobe=' + str(point['nprobe']):>14}: recall@{args.top_n}={point['recall']:.3f} "
+                  f"p50={point['latency']['p50']:.3f}ms p99={point['latency']['p99']:.3f}ms")
+
+        runs.append({"slices": num_slices, "indexing": indexing, "documents": documents, "load": load,
+                     "search": search, "adaptive": adaptive, "batch": batch, "result_cache": result_cache, "ivf": ivf})
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "redis": "external" if args.redis_url else "fakeredis",
+            "reranker": "bge-reranker-large" if args.real_reranker else "lexical",
+            "config": {key: value for key, value in vars(args).items() if key != "redis_url"}
+        },
+        "runs": runs
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    # 级联阈值跳过了本应改变排序的精排时一致率下降，结果写出后再判定，便于查看各路径占比
+    failed = [run["slices"] for run in runs if run["adaptive"]["top_k_agreement"] < args.min_adaptive_agreement]
+    if failed:
+        raise SystemExit(f"自适应检索与完整精排的Top K一致率低于 {args.min_adaptive_agreement:.0%}：规模 {failed}")
+
+
+if __name__ == "__main__":
+    main()
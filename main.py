@@ -2,10 +2,12 @@
 RAG4Tools 演示脚本
 """
 import json
+import logging
 from src.rag_system import RAGSystem, create_sample_tools
 
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     print("=== RAG4Tools 演示 ===")
 
     # 初始化RAG系统
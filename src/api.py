@@ -0,0 +1,235 @@
+"""
+检索HTTP服务
+"""
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Tuple
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from .async_rag_system import AsyncRAGSystem
+from .models import SearchFilter, DEFAULT_NAMESPACE
+from .serving import ProcessSearchService
+from .telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SearchRequest(BaseModel):
+    """检索请求"""
+    query: str
+    top_n: int = 100
+    top_m: int = 20
+    top_k: int = 5
+    retrieval_mode: str = "hybrid"
+    namespace: str = DEFAULT_NAMESPACE
+    tags: Optional[List[str]] = None  # 工具带有其中任一标签
+    slice_types: Optional[List[str]] = None  # 切片类型属于其中之一
+    nprobe: Optional[int] = None  # IVF检索扫描的簇数量，None表示精确检索
+
+    @property
+    def search_filter(self) -> SearchFilter:
+        """请求的过滤条件"""
+        return SearchFilter(namespace=self.namespace, tags=self.tags, slice_types=self.slice_types)
+
+
+class QueryBatcher:
+    """
+    查询微批处理器
+
+    把短时间窗口内到达的并发查询合并成一组，整组共用一次向量化请求和一次交叉编码器打分。
+    窗口在达到max_batch_size条查询或等待超过window_ms毫秒时关闭。
+    """
+
+    def __init__(self, system: AsyncRAGSystem, window_ms: float = 5.0, max_batch_size: int = 10):
+        """
+        初始化微批处理器
+
+        Args:
+            system: 异步检索服务
+            window_ms: 收集查询的最长等待时间（毫秒）
+            max_batch_size: 每个窗口的最大查询数，默认与向量化接口单次上限一致
+        """
+        self.system = system
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue: "asyncio.Queue[Tuple[SearchRequest, asyncio.Future]]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        """启动后台批处理任务"""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台批处理任务"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, request: SearchRequest) -> List[Dict[str, Any]]:
+        """
+        提交查询并等待所在窗口处理完成
+
+        Args:
+            request: 检索请求
+
+        Returns:
+            Top K工具列表
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[SearchRequest, asyncio.Future]]:
+        """阻塞等待第一条查询，然后在窗口期内继续收集"""
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+
+            # 检索参数和过滤条件相同的查询才能合并到一组
+            groups: Dict[Tuple[int, int, int, str, SearchFilter, Optional[int]],
+                         List[Tuple[SearchRequest, asyncio.Future]]] = {}
+            for request, future in batch:
+                params = (request.top_n, request.top_m, request.top_k, request.retrieval_mode, request.search_filter,
+                          request.nprobe)
+                groups.setdefault(params, []).append((request, future))
+
+            await asyncio.gather(*(self._process(params, items) for params, items in groups.items()))
+
+    async def _process(self, params: Tuple[int, int, int, str, SearchFilter, Optional[int]],
+                       items: List[Tuple[SearchRequest, asyncio.Future]]):
+        top_n, top_m, top_k, retrieval_mode, search_filter, nprobe = params
+        try:
+            results = await self.system.search_tools_many(
+                [request.query for request, _ in items], top_n, top_m, top_k, retrieval_mode, search_filter, nprobe
+            )
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), tools in zip(items, results):
+            if not future.done():
+                future.set_result([{**tool.to_dict(), "uuid": tool.uuid} for tool in tools])
+
+
+async def watch_slice_snapshot(system: AsyncRAGSystem, interval: float):
+    """
+    定期检查切片快照的新版本
+
+    Args:
+        system: 异步检索服务
+        interval: 检查间隔（秒）
+    """
+    redis_service = system.rag_system.redis_service
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(redis_service.refresh_slice_store)
+        except Exception:
+            logger.exception("切换切片快照失败")
+
+
+async def watch_shared_index(system: ProcessSearchService, interval: float):
+    """
+    定期检查工具库版本号，工具库变化时替换多进程检索服务的共享索引，新索引尽量不在请求中创建
+
+    Args:
+        system: 多进程检索服务
+        interval: 检查间隔（秒）
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await system.refresh_index()
+        except Exception:
+            logger.exception("切换共享索引失败")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if int(os.getenv("SEARCH_WORKERS", 0)) > 0:
+        # 多进程模式：切片矩阵和工具放入共享内存，检索和精排分别由进程池处理
+        system = ProcessSearchService()
+        await asyncio.to_thread(system.start)
+    else:
+        system = AsyncRAGSystem()
+        # 开始接收请求前预热：加载切片向量矩阵和精排模型
+        await asyncio.to_thread(system.rag_system.warmup)
+    batcher = QueryBatcher(
+        system,
+        window_ms=float(os.getenv("SEARCH_BATCH_WINDOW_MS", 5)),
+        max_batch_size=int(os.getenv("SEARCH_MAX_BATCH_SIZE", 10))
+    )
+    batcher.start()
+    app.state.system = system
+    app.state.batcher = batcher
+
+    # 使用切片快照时定期检查新版本，索引进程写出新快照后自动切换；
+    # 多进程模式的共享索引按TOOL_CACHE_CHECK_SECONDS检查工具库版本号，变化后重建
+    snapshot_watcher = None
+    if isinstance(system, ProcessSearchService):
+        snapshot_watcher = asyncio.create_task(
+            watch_shared_index(system, float(os.getenv("TOOL_CACHE_CHECK_SECONDS", 1.0)))
+        )
+    elif system.rag_system.redis_service.snapshot is not None:
+        snapshot_watcher = asyncio.create_task(
+            watch_slice_snapshot(system, float(os.getenv("SLICE_SNAPSHOT_POLL_SECONDS", 30)))
+        )
+
+    yield
+
+    if snapshot_watcher is not None:
+        snapshot_watcher.cancel()
+    await batcher.stop()
+    await system.close()
+
+
+app = FastAPI(title="RAG4Tools", lifespan=lifespan)
+
+
+@app.post("/search")
+async def search(request: SearchRequest) -> Dict[str, Any]:
+    """检索工具"""
+    tools = await app.state.batcher.submit(request)
+    return {"query": request.query, "tools": tools}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics() -> PlainTextResponse:
+    """Prometheus指标"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health")
+async def health() -> Dict[str, str]:
+    """健康检查"""
+    return {"status": "ok"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("API_HOST", "0.0.0.0"), port=int(os.getenv("API_PORT", 8000)))
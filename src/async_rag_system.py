@@ -0,0 +1,197 @@
+"""
+异步RAG检索服务
+"""
+import asyncio
+import json
+from typing import List, Optional
+
+import redis.asyncio as aioredis
+
+from .models import Tool, SearchFilter
+from .embedding_service import AsyncEmbeddingService
+from .rag_system import RAGSystem
+from .lexical_index import run_lexical_stage
+from .tool_cache import CATALOG_VERSION_KEY
+from .telemetry import tracer, CANDIDATES_FETCHED
+
+
+class AsyncRAGSystem:
+    """
+    异步检索服务
+
+    向量化使用AsyncOpenAI，工具详情通过redis.asyncio读取；
+    向量检索和交叉编码器打分是CPU密集操作，放到线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, rag_system: Optional[RAGSystem] = None):
+        """
+        初始化异步检索服务
+
+        Args:
+            rag_system: 同步RAG系统，复用其切片向量存储、粗排和精排模型
+        """
+        self.rag_system = rag_system or RAGSystem()
+        redis_service = self.rag_system.redis_service
+
+        self.embedding_service = AsyncEmbeddingService.from_service(self.rag_system.embedding_service)
+        # 与同步服务共用已解析工具缓存
+        self.tool_cache = redis_service.tool_cache
+        self.redis_client = aioredis.Redis(
+            connection_pool=aioredis.ConnectionPool(
+                host=redis_service.redis_host,
+                port=redis_service.redis_port,
+                password=redis_service.redis_password,
+                decode_responses=False
+            )
+        )
+
+    async def get_tools_by_uuids(self, uuids: List[str]) -> List[Tool]:
+        """
+        批量获取工具，工具缓存未命中的部分一次MGET读取
+
+        Args:
+            uuids: UUID列表
+
+        Returns:
+            工具列表，顺序与输入一致，不存在的工具被跳过
+        """
+        if not uuids:
+            return []
+        cache = self.tool_cache
+        if cache.needs_version_check():
+            cache.sync_version(await self.redis_client.get(CATALOG_VERSION_KEY))
+        generation = cache.generation
+        found = cache.get_many(uuids)
+
+        missing = list(dict.fromkeys(uuid for uuid in uuids if uuid not in found))
+        if missing:
+            tool_jsons = await self.redis_client.mget([f"tool:{uuid}" for uuid in missing])
+            fetched = [
+                Tool.from_dict(json.loads(tool_json), uuid)
+                for uuid, tool_json in zip(missing, tool_jsons) if tool_json
+            ]
+            cache.put_many(fetched, generation)
+            found.update((tool.uuid, tool) for tool in fetched)
+
+        tools = [found[uuid] for uuid in uuids if uuid in found]
+        CANDIDATES_FETCHED.inc(len(tools))
+        return tools
+
+    async def search_tools(self, query: str, top_n: int = 100, top_m: int = 20, top_k: int = 5,
+                           retrieval_mode: str = "hybrid", search_filter: Optional[SearchFilter] = None,
+                           nprobe: Optional[int] = None) -> List[Tool]:
+        """
+        异步搜索单个查询
+
+        Args:
+            query: 用户查询
+            top_n: 粗排阶段检索的切片数量
+            top_m: 粗排后保留的候选工具数量
+            top_k: 最终返回的工具数量
+            retrieval_mode: 切片检索方式，见RAGSystem.search_tools
+            search_filter: 过滤条件，见RAGSystem.search_tools
+            nprobe: IVF检索扫描的簇数量，None表示精确检索
+
+        Returns:
+            Top K工具列表
+        """
+        results = await self.search_tools_many([query], top_n, top_m, top_k, retrieval_mode, search_filter, nprobe)
+        return results[0]
+
+    async def search_tools_many(self, queries: List[str], top_n: int = 100, top_m: int = 20,
+                                top_k: int = 5, retrieval_mode: str = "hybrid",
+                                search_filter: Optional[SearchFilter] = None,
+                                nprobe: Optional[int] = None) -> List[List[Tool]]:
+        """
+        一次处理一组查询：一次向量化请求、一次候选工具读取、一次交叉编码器打分；
+        命中查询结果缓存（与同步服务共用）的查询直接返回缓存结果
+
+        Args:
+            queries: 查询列表
+            top_n: 粗排阶段检索的切片数量
+            top_m: 粗排后保留的候选工具数量
+            top_k: 最终返回的工具数量
+            retrieval_mode: 切片检索方式，见RAGSystem.search_tools
+            search_filter: 所有查询共用的过滤条件，见RAGSystem.search_tools
+            nprobe: IVF检索每个查询扫描的簇数量，None表示精确检索
+
+        Returns:
+            每个查询的Top K工具列表，与输入顺序一致
+        """
+        if not queries:
+            return []
+
+        rag = self.rag_system
+        cache = rag.result_cache
+        search_filter = search_filter or SearchFilter()
+        # 与RAGSystem.search_tools的缓存key一致，同步和异步检索共用缓存结果
+        search_method = "brute_force" if nprobe is None else "ivf"
+        params = (top_n, top_m, top_k, search_method, None, nprobe, retrieval_mode, search_filter)
+        results: List[Optional[List[Tool]]] = [None] * len(queries)
+
+        with tracer.span("search_tools_many", queries=len(queries), retrieval_mode=retrieval_mode):
+            # 0. 工具库版本变化时先更新切片存储和词法索引，再清空结果缓存；然后查找精确层
+            if rag.redis_service.needs_catalog_check():
+                await asyncio.to_thread(rag.sync_catalog)
+            generation = cache.generation
+            for i, query in enumerate(queries):
+                results[i] = cache.get(query, params)
+            pending = [i for i, result in enumerate(results) if result is None]
+
+            # 1. 词法检索，只有仍需向量检索的查询参与向量化
+            with tracer.span("lexical_search"):
+                lexical_index = rag.get_lexical_index(retrieval_mode)
+                lexical_stages = {
+                    i: run_lexical_stage(lexical_index, queries[i], top_n, retrieval_mode, rag.lexical_confidence,
+                                         search_filter)
+                    for i in pending
+                }
+            embed_positions = [i for i in pending if lexical_stages[i][1]]
+
+            query_embeddings = {}
+            if embed_positions:
+                with tracer.span("embed_query"):
+                    embeddings = await self.embedding_service.get_embeddings([queries[i] for i in embed_positions])
+                query_embeddings = dict(zip(embed_positions, embeddings))
+
+            # 查询结果缓存的语义层，只使用本来就要计算的查询向量
+            for i, embedding in list(query_embeddings.items()):
+                results[i] = cache.get_similar(embedding, params)
+                if results[i] is not None:
+                    del query_embeddings[i]
+            pending = [i for i in pending if results[i] is None]
+            for _ in pending:
+                cache.record_miss()
+
+            if pending:
+                # 2. 向量检索（一次矩阵-矩阵乘法）、融合和粗排
+                candidate_uuid_lists = await asyncio.to_thread(
+                    rag.coarse_rank_many, [lexical_stages[i] for i in pending],
+                    {position: query_embeddings[i] for position, i in enumerate(pending) if i in query_embeddings},
+                    top_n, top_m, search_filter, nprobe
+                )
+
+                # 3. 所有查询候选工具的并集只读取一次
+                with tracer.span("fetch_tools"):
+                    union_uuids = list(dict.fromkeys(uuid for uuids in candidate_uuid_lists for uuid in uuids))
+                    tools_by_uuid = {tool.uuid: tool for tool in await self.get_tools_by_uuids(union_uuids)}
+                    candidate_lists = [
+                        [tools_by_uuid[uuid] for uuid in uuids if uuid in tools_by_uuid]
+                        for uuids in candidate_uuid_lists
+                    ]
+
+                # 4. 所有 (查询, 工具) 对一次精排
+                with tracer.span("rerank", candidates=sum(len(tools) for tools in candidate_lists)):
+                    rerank_results = await asyncio.to_thread(
+                        rag.reranker.rerank_many, [queries[i] for i in pending], candidate_lists
+                    )
+
+                for i, reranked in zip(pending, rerank_results):
+                    results[i] = rag.reranker.get_top_k_tools(reranked, top_k)
+                    cache.put(queries[i], params, results[i], generation, query_embeddings.get(i))
+
+        return results
+
+    async def close(self):
+        """关闭异步Redis连接"""
+        await self.redis_client.aclose()
@@ -0,0 +1,99 @@
+"""
+自适应精排级联策略
+"""
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .models import CoarseRankResult
+
+# 级联路径
+SKIP_RERANK = "skip_rerank"      # 直接按粗排结果返回
+SHRINK_RERANK = "shrink_rerank"  # 只精排粗排靠前的少量候选
+FULL_RERANK = "full_rerank"      # 精排全部top_m个候选
+
+
+@dataclass
+class CascadePolicy:
+    """
+    根据粗排结果决定精排多少候选
+
+    粗排得分的尺度随聚合方式变化：RRF融合后的得分只由排名决定，相邻名次之间本来就有固定的差距
+    （例如1/2与1/3的相对差距已是33%），直接比较得分差距无法区分“明显领先”和“只是排在前面”。
+    因此先按全部候选得分的标准差把第一、二名的差距标准化，再与阈值比较。
+    第一名领先幅度达到skip_margin个标准差或最相似切片的余弦相似度足够高时跳过精排；
+    达到shrink_margin个标准差时只精排前shrink_candidates个候选；否则精排全部候选。
+    给定延迟预算时，再按精排的单对耗时估计把候选数截断到预算之内。
+    """
+    skip_margin: float = 3.5  # 第一名领先的标准差倍数达到该值时跳过精排
+    skip_similarity: float = 0.92  # 最相似切片的余弦相似度达到该值时跳过精排
+    shrink_margin: float = 3.0  # 第一名领先的标准差倍数达到该值时缩减精排候选
+    shrink_candidates: int = 5  # 缩减后精排的候选数量
+    min_rerank_candidates: int = 2  # 预算内可精排的候选少于该值时跳过精排
+
+    @staticmethod
+    def coarse_margin(coarse_results: List[CoarseRankResult], top_m: Optional[int] = None) -> float:
+        """
+        粗排第一、二名的得分差距，以前top_m个候选得分的标准差为单位
+
+        n个候选时该值至多为 n / sqrt(n - 1)（第一名之外的候选得分全部相同），
+        候选较少时标准差估计不可靠，差距达不到默认阈值，总是完整精排，此时精排本身的开销也小。
+
+        Args:
+            coarse_results: 粗排结果，按得分降序排列
+            top_m: 参与统计的候选数量，None表示全部
+
+        Returns:
+            (第一名得分 - 第二名得分) / 候选得分的标准差；只有一个候选时为inf，得分全部相同时为0
+        """
+        if not coarse_results:
+            return 0.0
+        if len(coarse_results) == 1:
+            return float("inf")
+        scores = np.array([result.score for result in coarse_results[:top_m]], dtype=np.float64)
+        spread = scores.std()
+        if not np.isfinite(spread) or spread <= 0:
+            return 0.0
+        return float((scores[0] - scores[1]) / spread)
+
+    def plan(self, coarse_results: List[CoarseRankResult], top_m: int, top_similarity: Optional[float] = None,
+             remaining_budget_ms: Optional[float] = None,
+             pair_latency_ms: Optional[float] = None) -> Tuple[str, int, bool]:
+        """
+        决定级联路径和送入交叉编码器的候选数量
+
+        Args:
+            coarse_results: 粗排结果，按得分降序排列
+            top_m: 最多精排的候选数量
+            top_similarity: 最相似切片的余弦相似度，没有向量检索结果时为None
+            remaining_budget_ms: 剩余的延迟预算（毫秒），None表示不限
+            pair_latency_ms: 精排每个 (查询, 工具) 对的估计耗时（毫秒）
+
+        Returns:
+            (级联路径, 精排候选数量, 是否因预算缩减了候选)
+        """
+        num_candidates = min(top_m, len(coarse_results))
+        if num_candidates <= 1:
+            return SKIP_RERANK, 0, False
+
+        margin = self.coarse_margin(coarse_results, top_m)
+        if margin >= self.skip_margin or (top_similarity is not None and top_similarity >= self.skip_similarity):
+            return SKIP_RERANK, 0, False
+
+        path = FULL_RERANK
+        if margin >= self.shrink_margin:
+            path = SHRINK_RERANK
+            num_candidates = min(num_candidates, self.shrink_candidates)
+
+        budget_limited = False
+        if remaining_budget_ms is not None and pair_latency_ms:
+            affordable = int(max(remaining_budget_ms, 0.0) // pair_latency_ms)
+            if affordable < num_candidates:
+                budget_limited = True
+                num_candidates = affordable
+                if num_candidates < self.min_rerank_candidates:
+                    return SKIP_RERANK, 0, True
+                path = SHRINK_RERANK
+
+        return path, num_candidates, budget_limited
@@ -0,0 +1,62 @@
+"""
+进程内共享的客户端
+"""
+import os
+import threading
+from typing import Optional
+
+import redis
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+_lock = threading.RLock()
+_connection_pool: Optional[redis.ConnectionPool] = None
+_embedding_service = None
+
+
+def get_connection_pool() -> redis.ConnectionPool:
+    """
+    获取进程内共享的Redis连接池，首次调用时按环境变量创建
+
+    连接池不做解码：切片向量以float32字节存储，文本字段在读取处自行解码。
+    """
+    global _connection_pool
+    if _connection_pool is None:
+        with _lock:
+            if _connection_pool is None:
+                _connection_pool = redis.ConnectionPool(
+                    host=os.getenv("REDIS_HOST"),
+                    port=int(os.getenv("REDIS_PORT", 6379)),
+                    password=os.getenv("REDIS_PASSWORD"),
+                    decode_responses=False
+                )
+    return _connection_pool
+
+
+def get_embedding_service():
+    """
+    获取进程内共享的向量化服务
+
+    默认使用EmbeddingService自己的缓存（进程内LRU，设置EMBEDDING_CACHE_PATH时附加本地文件）；
+    设置EMBEDDING_CACHE_REDIS=1时，切片向量改为持久化到共享连接池对应的Redis，
+    每条缓存EMBEDDING_CACHE_TTL_SECONDS秒后过期。查询向量始终只保存在进程内LRU。
+
+    Returns:
+        EmbeddingService
+    """
+    global _embedding_service
+    if _embedding_service is None:
+        from .embedding_cache import EmbeddingCache, RedisEmbeddingBackend
+        from .embedding_service import EmbeddingService
+
+        with _lock:
+            if _embedding_service is None:
+                cache = None
+                if os.getenv("EMBEDDING_CACHE_REDIS", "0").lower() in ("1", "true", "yes"):
+                    redis_client = redis.Redis(connection_pool=get_connection_pool())
+                    ttl_seconds = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+                    cache = EmbeddingCache(RedisEmbeddingBackend(redis_client, ttl_seconds=ttl_seconds or None))
+                _embedding_service = EmbeddingService(cache=cache)
+    return _embedding_service
@@ -1,57 +1,264 @@
 """
 粗排服务
 """
-from typing import List, Dict, Any
-from collections import defaultdict
+from typing import List, Dict, Any, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
 from .models import CoarseRankResult
+from .slice_store import SliceStore
+
+
+class ReciprocalRankAggregation:
+    """按排名聚合：工具得分 = sum(1 / (rank + 1))，rank从1开始"""
+
+    def __call__(self, groups: np.ndarray, num_groups: int, scores: np.ndarray, type_codes: np.ndarray,
+                 type_names: Sequence[Optional[str]]) -> np.ndarray:
+        ranks = np.arange(1, len(groups) + 1, dtype=np.float64)
+        return np.bincount(groups, weights=1.0 / (ranks + 1), minlength=num_groups)
+
+
+class MaxScoreAggregation:
+    """取工具所有命中切片中的最高得分"""
+
+    def __call__(self, groups: np.ndarray, num_groups: int, scores: np.ndarray, type_codes: np.ndarray,
+                 type_names: Sequence[Optional[str]]) -> np.ndarray:
+        aggregated = np.full(num_groups, -np.inf)
+        np.maximum.at(aggregated, groups, scores)
+        return aggregated
+
+
+class WeightedSumAggregation:
+    """按切片类型加权求和命中切片的得分，例如概览切片的权重高于参数切片"""
+
+    def __init__(self, weights: Optional[Dict[Optional[str], float]] = None, default_weight: float = 1.0):
+        """
+        初始化加权求和
+
+        Args:
+            weights: 切片类型 -> 权重，默认概览1.0、参数0.5
+            default_weight: 未配置的切片类型的权重
+        """
+        self.weights = weights if weights is not None else {"overview": 1.0, "parameter": 0.5}
+        self.default_weight = default_weight
+
+    def __call__(self, groups: np.ndarray, num_groups: int, scores: np.ndarray, type_codes: np.ndarray,
+                 type_names: Sequence[Optional[str]]) -> np.ndarray:
+        # 权重表按类型编码展开，每个切片只做一次下标取值
+        weight_of_code = np.array([self.weights.get(name, self.default_weight) for name in type_names])
+        return np.bincount(groups, weights=scores * weight_of_code[type_codes], minlength=num_groups)
+
+
+# 可用的工具得分聚合方式
+AGGREGATIONS = {
+    "reciprocal_rank": ReciprocalRankAggregation,
+    "max": MaxScoreAggregation,
+    "weighted_sum": WeightedSumAggregation
+}
 
 
 class CoarseRanker:
-    """粗排服务"""
-    
-    def rank_tools(self, search_results: List[Dict[str, Any]]) -> List[CoarseRankResult]:
+    """
+    粗排服务
+
+    切片结果按工具聚合时全部在numpy数组上完成：工具ID压缩为连续下标后用bincount/ufunc.at累加，
+    再用argpartition取Top M，不为每个切片创建字典或对象。
+    聚合方式可插拔，见AGGREGATIONS；可调用对象的签名为
+    (groups, num_groups, scores, type_codes, type_names) -> 每组得分。
+    """
+
+    def __init__(self, aggregation: Union[str, Any] = "reciprocal_rank"):
+        """
+        初始化粗排服务
+
+        Args:
+            aggregation: AGGREGATIONS中的名称，或自定义的聚合可调用对象
+        """
+        if isinstance(aggregation, str):
+            if aggregation not in AGGREGATIONS:
+                raise ValueError(f"不支持的聚合方式: {aggregation}")
+            aggregation = AGGREGATIONS[aggregation]()
+        self.aggregation = aggregation
+
+    def rank_arrays(self, tool_ids: np.ndarray, scores: np.ndarray, type_codes: np.ndarray,
+                    type_names: Sequence[Optional[str]],
+                    top_m: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按工具聚合已排序的切片命中
+
+        Args:
+            tool_ids: 每个命中切片的整数工具ID，按切片排名排列
+            scores: 每个命中切片的得分
+            type_codes: 每个命中切片的类型编码
+            type_names: 类型编码 -> 切片类型
+            top_m: 只返回得分最高的top_m个工具，None表示全部
+
+        Returns:
+            (工具ID数组, 工具得分数组)，按得分降序排列，同分时先出现的工具在前
+        """
+        if len(tool_ids) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        # 只对命中的工具编号，数组长度与命中数相同而不是工具总数
+        unique_ids, first_seen, groups = np.unique(tool_ids, return_index=True, return_inverse=True)
+        groups = groups.reshape(-1)
+        group_scores = self.aggregation(groups, len(unique_ids), scores, type_codes, type_names)
+
+        candidates = np.arange(len(unique_ids))
+        if top_m is not None and top_m < len(unique_ids):
+            if top_m <= 0:
+                return np.zeros(0, dtype=np.int64), np.zeros(0)
+            # 保留所有不低于第top_m名得分的工具，保证同分时仍按出现顺序取舍
+            kth = np.partition(-group_scores, top_m - 1)[top_m - 1]
+            candidates = np.flatnonzero(-group_scores <= kth)
+
+        order = candidates[np.lexsort((first_seen[candidates], -group_scores[candidates]))]
+        if top_m is not None:
+            order = order[:top_m]
+        return unique_ids[order], group_scores[order]
+
+    def rank_tools(self, search_results: List[Dict[str, Any]], top_m: Optional[int] = None) -> List[CoarseRankResult]:
         """
         对搜索结果进行粗排
-        
+
         Args:
             search_results: 向量搜索结果列表
-            
+            top_m: 只返回得分最高的top_m个工具，None表示全部
+
         Returns:
             粗排结果列表，按得分降序排列
         """
-        # 按UUID分组统计
-        uuid_ranks = defaultdict(list)
-        
-        for rank, result in enumerate(search_results):
-            uuid = result.get('uuid')
-            if uuid:
-                uuid_ranks[uuid].append(rank + 1)  # rank从1开始
-        
-        # 计算每个工具的粗排得分
-        coarse_results = []
-        for uuid, ranks in uuid_ranks.items():
-            # 使用公式: 得分 = sum(1 / (rank + 1))
-            score = sum(1.0 / (rank + 1) for rank in ranks)
-
-            coarse_result = CoarseRankResult(
-                uuid=uuid,
-                score=score
-            )
-            coarse_results.append(coarse_result)
-        
-        # 按得分降序排列
-        coarse_results.sort(key=lambda x: x.score, reverse=True)
-        
-        return coarse_results
-    
+        hits = [result for result in search_results if result.get('uuid')]
+        if not hits:
+            return []
+
+        uuids = np.array([result['uuid'] for result in hits])
+        scores = np.array([result.get('score', 0.0) for result in hits], dtype=np.float64)
+        type_names: List[Optional[str]] = [None]
+        type_code_of: Dict[Optional[str], int] = {None: 0}
+        for result in hits:
+            slice_type = result.get('slice_type') or None
+            if slice_type not in type_code_of:
+                type_code_of[slice_type] = len(type_names)
+                type_names.append(slice_type)
+        type_codes = np.array([type_code_of[result.get('slice_type') or None] for result in hits], dtype=np.int64)
+
+        # 字符串UUID先编码为整数再走与切片存储相同的数组路径
+        unique_uuids, tool_ids = np.unique(uuids, return_inverse=True)
+        ranked_ids, ranked_scores = self.rank_arrays(tool_ids.reshape(-1), scores, type_codes, type_names, top_m)
+        return [
+            CoarseRankResult(uuid=str(unique_uuids[tool_id]), score=float(score))
+            for tool_id, score in zip(ranked_ids, ranked_scores)
+        ]
+
+    @staticmethod
+    def fuse_rows(row_lists: List[np.ndarray], num_results: int, k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        在行号数组上做倒数排名融合，与fuse_results的结果一致
+
+        Args:
+            row_lists: 各路检索结果的行号，各自按排名排列
+            num_results: 融合后保留的切片数量
+            k: RRF平滑参数
+
+        Returns:
+            (行号数组, 融合得分数组)，按融合得分降序排列
+        """
+        rows = np.concatenate(row_lists)
+        contributions = np.concatenate([1.0 / (k + np.arange(1, len(row_list) + 1)) for row_list in row_lists])
+        unique_rows, first_seen, groups = np.unique(rows, return_index=True, return_inverse=True)
+        fused = np.bincount(groups.reshape(-1), weights=contributions, minlength=len(unique_rows))
+        order = np.lexsort((first_seen, -fused))[:num_results]
+        return unique_rows[order], fused[order]
+
+    def rank_store_hits(self, store: SliceStore, vector_rows: Optional[np.ndarray],
+                        vector_scores: Optional[np.ndarray], lexical_results: Optional[List[Dict[str, Any]]],
+                        num_results: int, top_m: Optional[int] = None) -> Tuple[List[CoarseRankResult], int]:
+        """
+        融合进程内向量检索的行号结果与词法检索结果，并按工具粗排
+
+        从相似度到候选工具的整条路径都在行号数组上完成；
+        只有词法结果中出现了切片存储里没有的切片时，才退回到字典路径。
+
+        Args:
+            store: 产生vector_rows的切片存储
+            vector_rows: 向量检索的行号，未执行向量检索时为None
+            vector_scores: 向量检索的得分
+            lexical_results: 词法检索结果，未执行时为None
+            num_results: 融合后保留的切片数量
+            top_m: 只返回得分最高的top_m个工具，None表示全部
+
+        Returns:
+            (粗排结果列表, 参与粗排的切片数量)
+        """
+        row_lists, score_lists = [], []
+        if vector_rows is not None:
+            row_lists.append(vector_rows)
+            score_lists.append(vector_scores)
+        if lexical_results is not None:
+            lexical_rows = store.rows_for_keys([result['key'] for result in lexical_results])
+            if (lexical_rows < 0).any():
+                vector_results = store.results_for_rows(vector_rows, vector_scores) if vector_rows is not None else None
+                search_results = self.fuse_results([vector_results, lexical_results], num_results)
+                return self.rank_tools(search_results, top_m), len(search_results)
+            row_lists.append(lexical_rows)
+            score_lists.append(np.array([result['score'] for result in lexical_results], dtype=np.float64))
+
+        if not row_lists:
+            return [], 0
+        if len(row_lists) == 1:
+            rows, scores = row_lists[0][:num_results], score_lists[0][:num_results]
+        else:
+            rows, scores = self.fuse_rows(row_lists, num_results)
+
+        tool_ids, type_codes = store.row_ids(rows)
+        ranked_ids, ranked_scores = self.rank_arrays(tool_ids, scores, type_codes, store.slice_type_names, top_m)
+        tool_uuids = store.tool_uuids
+        coarse_results = [
+            CoarseRankResult(uuid=tool_uuids[tool_id], score=float(score))
+            for tool_id, score in zip(ranked_ids, ranked_scores)
+        ]
+        return coarse_results, len(rows)
+
+    def fuse_results(self, result_lists: List[Optional[List[Dict[str, Any]]]], num_results: int,
+                     k: int = 60) -> List[Dict[str, Any]]:
+        """
+        用倒数排名融合（RRF）合并多路切片检索结果，例如向量检索和BM25检索
+
+        同一切片（按key识别）在各路结果中的得分为 sum(1 / (k + rank))，
+        融合后的排名再交给rank_tools计算工具得分。
+
+        Args:
+            result_lists: 各路检索结果，None表示该路未执行
+            num_results: 融合后保留的切片数量
+            k: RRF平滑参数
+
+        Returns:
+            融合后的搜索结果列表，按融合得分降序排列
+        """
+        result_lists = [results for results in result_lists if results is not None]
+        if len(result_lists) == 1:
+            return result_lists[0][:num_results]
+
+        fused: Dict[Any, Dict[str, Any]] = {}
+        for results in result_lists:
+            for rank, result in enumerate(results):
+                identity = result.get('key') or (result.get('uuid'), result.get('slice_type'), rank)
+                entry = fused.get(identity)
+                if entry is None:
+                    entry = fused[identity] = {**result, 'score': 0.0}
+                entry['score'] += 1.0 / (k + rank + 1)
+
+        return sorted(fused.values(), key=lambda x: x['score'], reverse=True)[:num_results]
+
     def get_top_candidates(self, coarse_results: List[CoarseRankResult], top_m: int) -> List[str]:
         """
         获取Top M个候选工具的UUID列表
-        
+
         Args:
             coarse_results: 粗排结果列表
             top_m: 返回的候选数量
-            
+
         Returns:
             UUID列表
         """
@@ -0,0 +1,210 @@
+"""
+向量缓存
+"""
+import dbm
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Sequence
+
+import numpy as np
+
+from .telemetry import CACHE_HITS, CACHE_MISSES
+
+
+class RedisEmbeddingBackend:
+    """
+    基于Redis的持久化向量缓存，每个向量一个带过期时间的key，value为float32字节
+
+    每次写入都会重置过期时间，长期不再出现的文本（例如已删除工具的切片）到期后自动从Redis中清除。
+    """
+
+    def __init__(self, redis_client, key_prefix: str = "embedding_cache:",
+                 ttl_seconds: Optional[float] = 30 * 24 * 3600, batch_size: int = 500):
+        """
+        初始化Redis缓存后端
+
+        Args:
+            redis_client: 不做解码的Redis客户端
+            key_prefix: 缓存key的前缀
+            ttl_seconds: 每个向量的过期时间（秒），None表示不过期
+            batch_size: 每次MGET或SET流水线的key数量
+        """
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+        self.ttl_ms = int(ttl_seconds * 1000) if ttl_seconds else None
+        self.batch_size = batch_size
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        values = []
+        for start in range(0, len(keys), self.batch_size):
+            batch = keys[start:start + self.batch_size]
+            values.extend(self.redis_client.mget([self.key_prefix + key for key in batch]))
+        return values
+
+    def put_many(self, items: Dict[str, bytes]):
+        keys = list(items)
+        for start in range(0, len(keys), self.batch_size):
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in keys[start:start + self.batch_size]:
+                pipe.set(self.key_prefix + key, items[key], px=self.ttl_ms)
+            pipe.execute()
+
+
+class FileEmbeddingBackend:
+    """基于本地dbm文件的持久化向量缓存，value为float32字节"""
+
+    def __init__(self, path: str):
+        """
+        初始化文件缓存后端
+
+        Args:
+            path: dbm文件路径
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._db = dbm.open(path, "c")
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        with self._lock:
+            return [self._db.get(key) for key in keys]
+
+    def put_many(self, items: Dict[str, bytes]):
+        with self._lock:
+            for key, value in items.items():
+                self._db[key] = value
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class EmbeddingCache:
+    """
+    向量缓存：进程内LRU + 可选的持久化后端
+
+    缓存key为 (模型, 维度, 文本) 的哈希，内容不变的文本无需再次调用向量化接口。
+    """
+
+    def __init__(self, backend=None, max_memory_bytes: int = 64 * 1024 * 1024):
+        """
+        初始化向量缓存
+
+        Args:
+            backend: 持久化后端（RedisEmbeddingBackend或FileEmbeddingBackend），为None时只使用内存缓存
+            max_memory_bytes: 进程内LRU占用的最大字节数，超出后淘汰最久未使用的向量
+        """
+        self.backend = backend
+        self.max_memory_bytes = max_memory_bytes
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+        # 命中统计
+        self.memory_hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, dimensions: int, text: str) -> str:
+        """
+        计算缓存key
+
+        Args:
+            model: 向量化模型名称
+            dimensions: 向量维度
+            text: 文本内容
+
+        Returns:
+            缓存key
+        """
+        raw = f"{model}\x00{dimensions}\x00{text}".encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """写入进程内LRU，并按字节数淘汰"""
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= old.nbytes
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes
+
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def get_many(self, keys: Sequence[str], persistent: bool = True) -> List[Optional[np.ndarray]]:
+        """
+        批量查询缓存
+
+        Args:
+            keys: 缓存key列表
+            persistent: 进程内未命中时是否查询持久化后端
+
+        Returns:
+            向量列表，未命中的位置为None
+        """
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        backend_positions = []
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                    self.memory_hits += 1
+                else:
+                    backend_positions.append(i)
+
+        if backend_positions and persistent and self.backend is not None:
+            values = self.backend.get_many([keys[i] for i in backend_positions])
+            with self._lock:
+                for i, value in zip(backend_positions, values):
+                    if value is None:
+                        continue
+                    vector = np.frombuffer(value, dtype=np.float32)
+                    results[i] = vector
+                    self._remember(keys[i], vector)
+                    self.backend_hits += 1
+
+        missed = sum(1 for vector in results if vector is None)
+        with self._lock:
+            self.misses += missed
+        CACHE_HITS.inc(len(keys) - missed, cache="embedding")
+        CACHE_MISSES.inc(missed, cache="embedding")
+
+        return results
+
+    def put_many(self, keys: Sequence[str], vectors: Sequence[Sequence[float]], persistent: bool = True):
+        """
+        批量写入缓存
+
+        Args:
+            keys: 缓存key列表
+            vectors: 对应的向量
+            persistent: 是否同时写入持久化后端；查询向量只保存在进程内LRU，避免持久化层随不同查询无限增长
+        """
+        arrays = [np.asarray(vector, dtype=np.float32) for vector in vectors]
+        with self._lock:
+            for key, vector in zip(keys, arrays):
+                self._remember(key, vector)
+
+        if persistent and self.backend is not None:
+            self.backend.put_many({key: vector.tobytes() for key, vector in zip(keys, arrays)})
+
+    def stats(self) -> Dict[str, int]:
+        """获取缓存命中统计"""
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "backend_hits": self.backend_hits,
+                "hits": self.memory_hits + self.backend_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes
+            }
@@ -1,86 +1,388 @@
 """
 向量化服务
 """
+import asyncio
 import os
-from typing import List, Dict, Any
-from openai import OpenAI
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+import numpy as np
 from dotenv import load_dotenv
 
+from .embedding_cache import EmbeddingCache, FileEmbeddingBackend
+from .telemetry import EMBEDDING_API_CALLS, EMBEDDING_API_TEXTS
+
 # 加载环境变量
 load_dotenv()
 
 
+class RateLimiter:
+    """简单的请求速率限制器，保证相邻两次请求的发起间隔不小于 1 / 每秒请求数"""
+
+    def __init__(self, requests_per_second: float):
+        """
+        初始化速率限制器
+
+        Args:
+            requests_per_second: 每秒最多发起的请求数，小于等于0表示不限速
+        """
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """预约下一次请求的发起时间，返回需要等待的秒数"""
+        if self.interval <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        return wait
+
+    def acquire(self):
+        """阻塞直到允许发起下一次请求"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """等待直到允许发起下一次请求，不阻塞事件循环；与acquire共用同一个发起时间表"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def retry_delay(attempt: int, retry_backoff: float) -> float:
+    """第attempt次重试前的等待秒数：指数退避，附加随机抖动避免并发请求同时重试"""
+    delay = retry_backoff * (2 ** attempt)
+    return delay + random.uniform(0, delay)
+
+
 class EmbeddingService:
     """向量化服务"""
-    
-    def __init__(self):
-        self.client = OpenAI(
-            api_key=os.getenv("EMBEDDING_API_KEY"),
-            base_url=os.getenv("EMBEDDING_BASE_URL")
-        )
+
+    def __init__(self, cache: Optional[EmbeddingCache] = None,
+                 max_concurrency: Optional[int] = None,
+                 requests_per_second: Optional[float] = None,
+                 max_retries: int = 3,
+                 retry_backoff: float = 0.5):
+        """
+        初始化向量化服务
+
+        Args:
+            cache: 向量缓存，默认使用进程内LRU；设置环境变量EMBEDDING_CACHE_PATH时附加本地文件持久化。
+                持久化后端只保存切片等索引时的向量（persist=True），查询向量只保存在进程内LRU
+            max_concurrency: 并发请求数上限，默认读取环境变量EMBEDDING_MAX_CONCURRENCY（默认4）
+            requests_per_second: 每秒请求数上限，默认读取环境变量EMBEDDING_RPS（默认不限速）
+            max_retries: 单个请求失败后的最大重试次数
+            retry_backoff: 重试的初始等待秒数，每次重试翻倍
+        """
+        # OpenAI客户端在首次请求时创建，避免导入openai拖慢启动
+        self._client = None
         self.model = os.getenv("EMBEDDING_MODEL")
         self.dimensions = 1024
-    
+
+        if cache is None:
+            cache_path = os.getenv("EMBEDDING_CACHE_PATH")
+            cache = EmbeddingCache(FileEmbeddingBackend(cache_path) if cache_path else None)
+        self.cache = cache
+
+        # 并发、限速与重试配置
+        self.max_concurrency = max_concurrency or int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4))
+        if requests_per_second is None:
+            requests_per_second = float(os.getenv("EMBEDDING_RPS", 0))
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        # 实际发往向量化接口的请求次数和文本条数
+        self.api_calls = 0
+        self.api_texts = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """OpenAI客户端，首次访问时创建"""
+        if self._client is None:
+            from openai import OpenAI
+
+            self._client = OpenAI(
+                api_key=os.getenv("EMBEDDING_API_KEY"),
+                base_url=os.getenv("EMBEDDING_BASE_URL")
+            )
+        return self._client
+
+    def _request_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        调用向量化接口，不经过缓存；受速率限制，失败时按指数退避重试
+
+        Args:
+            texts: 文本列表，最多支持10条
+
+        Returns:
+            float32向量矩阵，形状为 (len(texts), dimensions)
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = self.client.embeddings.create(
+                    model=self.model,
+                    input=texts,
+                    dimensions=self.dimensions,
+                    encoding_format="float"
+                )
+                with self._stats_lock:
+                    self.api_calls += 1
+                    self.api_texts += len(texts)
+                EMBEDDING_API_CALLS.inc()
+                EMBEDDING_API_TEXTS.inc(len(texts))
+
+                # 提取向量数据，按index排序保证与输入顺序一致；
+                # 立即转为float32矩阵，响应中的浮点数列表随本批次一起释放
+                return np.asarray(
+                    [data.embedding for data in sorted(response.data, key=lambda item: item.index)],
+                    dtype=np.float32
+                )
+
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise Exception(f"向量化失败: {str(e)}")
+                time.sleep(retry_delay(attempt, self.retry_backoff))
+                attempt += 1
+
+    def _embed_with_cache(self, texts: List[str], batch_size: int, persist: bool) -> np.ndarray:
+        """
+        先查缓存，只把未命中的去重文本按批次发往向量化接口
+
+        Args:
+            texts: 文本列表
+            batch_size: 每次请求的文本数量
+            persist: 是否使用缓存的持久化后端
+
+        Returns:
+            float32向量矩阵，行顺序与输入一致
+        """
+        keys = [EmbeddingCache.make_key(self.model, self.dimensions, text) for text in texts]
+        cached = self.cache.get_many(keys, persistent=persist)
+
+        # 命中缓存的向量直接写入结果矩阵，未命中的文本去重后再请求
+        embeddings = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        missing: Dict[str, str] = {}
+        missing_rows: Dict[str, List[int]] = {}
+        for i, (key, text, vector) in enumerate(zip(keys, texts, cached)):
+            if vector is None:
+                missing.setdefault(key, text)
+                missing_rows.setdefault(key, []).append(i)
+            else:
+                embeddings[i] = vector
+
+        # 未命中的文本按批次打包，多个批次通过有界线程池并发请求
+        missing_keys = list(missing)
+        batches = [missing_keys[i:i + batch_size] for i in range(0, len(missing_keys), batch_size)]
+
+        def embed_batch(batch_keys: List[str]):
+            batch_embeddings = np.asarray(
+                self._request_embeddings([missing[key] for key in batch_keys]), dtype=np.float32
+            )
+            self.cache.put_many(batch_keys, batch_embeddings, persistent=persist)
+            # 各批次写入结果矩阵的不同行，可以并发写入
+            for key, vector in zip(batch_keys, batch_embeddings):
+                embeddings[missing_rows[key]] = vector
+
+        if len(batches) > 1 and self.max_concurrency > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                list(executor.map(embed_batch, batches))
+        else:
+            for batch_keys in batches:
+                embed_batch(batch_keys)
+
+        return embeddings
+
     def get_embeddings(self, texts: List[str]) -> List[List[float]]:
         """
-        获取文本的向量表示
-        
+        获取文本（例如查询）的向量表示，只使用进程内缓存
+
         Args:
             texts: 文本列表，最多支持10条
-            
+
         Returns:
             向量列表
         """
         if len(texts) > 10:
             raise ValueError("最多支持10条文本同时向量化")
-        
-        try:
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=texts,
-                dimensions=self.dimensions,
-                encoding_format="float"
-            )
-            
-            # 提取向量数据
-            embeddings = []
-            for data in response.data:
-                embeddings.append(data.embedding)
-            
-            return embeddings
-            
-        except Exception as e:
-            raise Exception(f"向量化失败: {str(e)}")
-    
+
+        return self._embed_with_cache(texts, batch_size=10, persist=False).tolist()
+
     def get_single_embedding(self, text: str) -> List[float]:
         """
         获取单个文本的向量表示
-        
+
         Args:
             text: 文本内容
-            
+
         Returns:
             向量
         """
         embeddings = self.get_embeddings([text])
         return embeddings[0]
-    
-    def batch_embed_texts(self, texts: List[str], batch_size: int = 10) -> List[List[float]]:
+
+    def batch_embed_texts(self, texts: List[str], batch_size: int = 10, persist: bool = True) -> List[List[float]]:
         """
-        批量向量化文本，自动分批处理
-        
+        批量向量化文本，自动分批并发处理；命中缓存的文本不会发起请求
+
         Args:
             texts: 文本列表
             batch_size: 批次大小，默认10
-            
+            persist: 是否使用缓存的持久化后端，批量查询应传False
+
         Returns:
             向量列表
         """
-        all_embeddings = []
-        
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i + batch_size]
-            batch_embeddings = self.get_embeddings(batch_texts)
-            all_embeddings.extend(batch_embeddings)
-        
-        return all_embeddings
+        return self._embed_with_cache(texts, batch_size, persist).tolist()
+
+    def embed_matrix(self, texts: List[str], batch_size: int = 10, persist: bool = False) -> np.ndarray:
+        """
+        批量向量化文本，结果为一个float32矩阵，不为每个浮点数创建Python对象
+
+        Args:
+            texts: 文本列表
+            batch_size: 批次大小，默认10
+            persist: 是否使用缓存的持久化后端，切片等索引时的文本传True，查询保持默认
+
+        Returns:
+            形状为 (len(texts), dimensions) 的float32矩阵
+        """
+        return self._embed_with_cache(texts, batch_size, persist)
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取缓存命中和接口调用统计"""
+        stats = self.cache.stats()
+        stats["api_calls"] = self.api_calls
+        stats["api_texts"] = self.api_texts
+        return stats
+
+
+class AsyncEmbeddingService:
+    """异步向量化服务，供在线检索使用"""
+
+    def __init__(self, cache: Optional[EmbeddingCache] = None,
+                 max_concurrency: Optional[int] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 max_retries: int = 3,
+                 retry_backoff: float = 0.5):
+        """
+        初始化异步向量化服务
+
+        并发、限速和重试与EmbeddingService一致，见from_service。
+
+        Args:
+            cache: 向量缓存，可与同步向量化服务共用
+            max_concurrency: 同时进行的请求数上限，默认读取环境变量EMBEDDING_MAX_CONCURRENCY（默认4）
+            rate_limiter: 速率限制器，与同步向量化服务共用时两者的请求合计不超过限速；
+                默认按环境变量EMBEDDING_RPS新建
+            max_retries: 单个请求失败后的最大重试次数
+            retry_backoff: 重试的初始等待秒数，每次重试翻倍
+        """
+        self._client = None
+        self.model = os.getenv("EMBEDDING_MODEL")
+        self.dimensions = 1024
+        self.cache = cache or EmbeddingCache()
+        self.max_concurrency = max_concurrency or int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.rate_limiter = rate_limiter or RateLimiter(float(os.getenv("EMBEDDING_RPS", 0)))
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.api_calls = 0
+
+    @classmethod
+    def from_service(cls, service: EmbeddingService) -> "AsyncEmbeddingService":
+        """
+        创建与同步向量化服务共用缓存和速率限制器、并发和重试配置相同的异步服务
+
+        Args:
+            service: 同步向量化服务
+
+        Returns:
+            异步向量化服务
+        """
+        return cls(cache=service.cache, max_concurrency=service.max_concurrency,
+                   rate_limiter=service.rate_limiter, max_retries=service.max_retries,
+                   retry_backoff=service.retry_backoff)
+
+    @property
+    def client(self):
+        """AsyncOpenAI客户端，首次访问时创建"""
+        if self._client is None:
+            from openai import AsyncOpenAI
+
+            self._client = AsyncOpenAI(
+                api_key=os.getenv("EMBEDDING_API_KEY"),
+                base_url=os.getenv("EMBEDDING_BASE_URL")
+            )
+        return self._client
+
+    async def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """调用向量化接口，受并发上限和速率限制，失败时按指数退避重试"""
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire_async()
+            try:
+                response = await self.client.embeddings.create(
+                    model=self.model,
+                    input=texts,
+                    dimensions=self.dimensions,
+                    encoding_format="float"
+                )
+                self.api_calls += 1
+                EMBEDDING_API_CALLS.inc()
+                EMBEDDING_API_TEXTS.inc(len(texts))
+                return [data.embedding for data in sorted(response.data, key=lambda item: item.index)]
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise Exception(f"向量化失败: {str(e)}")
+                await asyncio.sleep(retry_delay(attempt, self.retry_backoff))
+                attempt += 1
+
+    async def get_embeddings(self, texts: List[str], batch_size: int = 10) -> List[List[float]]:
+        """
+        获取文本的向量表示，未命中缓存的文本按批次并发请求，同时进行的请求不超过max_concurrency
+
+        Args:
+            texts: 文本列表
+            batch_size: 每次请求的文本数量
+
+        Returns:
+            向量列表，与输入顺序一致
+        """
+        keys = [EmbeddingCache.make_key(self.model, self.dimensions, text) for text in texts]
+        # 查询向量只使用进程内缓存，不读写持久化后端
+        cached = self.cache.get_many(keys, persistent=False)
+
+        missing: Dict[str, str] = {}
+        for key, text, vector in zip(keys, texts, cached):
+            if vector is None:
+                missing.setdefault(key, text)
+
+        missing_keys = list(missing)
+        batches = [missing_keys[i:i + batch_size] for i in range(0, len(missing_keys), batch_size)]
+
+        async def embed_batch(batch_keys: List[str]) -> List[List[float]]:
+            async with self._semaphore:
+                return await self._request_embeddings([missing[key] for key in batch_keys])
+
+        batch_results = await asyncio.gather(*(embed_batch(batch_keys) for batch_keys in batches))
+
+        fetched: Dict[str, List[float]] = {}
+        for batch_keys, batch_embeddings in zip(batches, batch_results):
+            fetched.update(zip(batch_keys, batch_embeddings))
+        if fetched:
+            self.cache.put_many(list(fetched), list(fetched.values()), persistent=False)
+
+        return [
+            vector.tolist() if vector is not None else fetched[key]
+            for key, vector in zip(keys, cached)
+        ]
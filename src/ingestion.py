@@ -0,0 +1,117 @@
+"""
+工具库流式导入
+"""
+import json
+import os
+import tempfile
+import uuid
+from typing import Iterator, Dict, Any, Optional, Tuple
+
+from .models import IngestProgress
+
+# 没有uuid字段的记录按 (数据源, 记录序号) 生成确定的UUID，中断后重跑同一批次不会产生重复工具
+_RECORD_NAMESPACE = uuid.UUID("7190cb51-1d9a-41d5-bbb6-f78c5f5bc60c")
+
+
+def record_uuid(source: str, record_number: int) -> str:
+    """
+    为没有uuid字段的记录生成确定的UUID
+
+    Args:
+        source: 数据源标识
+        record_number: 记录在数据源中的序号，从0开始
+
+    Returns:
+        UUID字符串
+    """
+    return str(uuid.uuid5(_RECORD_NAMESPACE, f"{source}#{record_number}"))
+
+
+def iter_jsonl(path: str, offset: int = 0) -> Iterator[Tuple[Dict[str, Any], int]]:
+    """
+    逐行读取JSONL文件，同一时刻只持有一行
+
+    Args:
+        path: JSONL文件路径
+        offset: 开始读取的字节偏移，必须位于行首
+
+    Yields:
+        (记录, 该行结束处的字节偏移)，空行跳过
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        position = offset
+        for line in f:
+            line_start = position
+            position += len(line)
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path} 偏移 {line_start} 处的记录不是合法JSON: {e}") from e
+            yield record, position
+
+
+class IngestCheckpoint:
+    """
+    流式导入的检查点
+
+    每个批次写入Redis后保存导入进度和数据源位置（JSONL为字节偏移，迭代器为记录数）。
+    先写临时文件再os.replace，进程在任意时刻中断都不会留下写了一半的检查点。
+    """
+
+    def __init__(self, path: str):
+        """
+        初始化检查点
+
+        Args:
+            path: 检查点文件路径
+        """
+        self.path = path
+
+    def load(self) -> Optional[Tuple[IngestProgress, int]]:
+        """
+        读取检查点
+
+        Returns:
+            (导入进度, 数据源位置)，检查点不存在时返回None
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return IngestProgress(**data["progress"]), int(data["position"])
+
+    def save(self, progress: IngestProgress, position: int):
+        """
+        原子地保存检查点
+
+        Args:
+            progress: 导入进度
+            position: 已处理到的数据源位置
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        progress_data = progress.to_dict()
+        progress_data.pop("tools_per_second")
+
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"progress": progress_data, "position": position}, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def clear(self):
+        """删除检查点，下次导入从头开始"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,267 @@
+"""
+BM25词法索引
+"""
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+
+from .models import Tool, SearchFilter
+
+# 检索方式：纯向量、纯词法、向量与词法融合、词法置信度足够高时跳过向量化
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid", "auto")
+
+# camelCase边界，例如 getWeather -> get_Weather，HTTPServer -> HTTP_Server
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+# 英文/数字标识符（可含_-.连接）或连续的中日韩字符
+_CJK_CHARS = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"[a-z0-9]+(?:[_\-.][a-z0-9]+)*|[{_CJK_CHARS}]+")
+_SPLIT_RE = re.compile(r"[_\-.]")
+_CJK_RE = re.compile(rf"[{_CJK_CHARS}]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    分词：英文标识符保留整体并拆出各部分，中文按相邻二字切分（单独的汉字保留为单字）
+
+    例如 "get_weather" -> get_weather, get, weather；"getWeather"同样归一为get_weather；
+    "查询天气" -> 查询, 询天, 天气。
+
+    Args:
+        text: 文本
+
+    Returns:
+        词元列表
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(_CAMEL_RE.sub("_", text).lower()):
+        token = match.group()
+        if _CJK_RE.match(token):
+            # 单字在中文里区分度很低，倒排链过长，只有孤立的汉字才作为词元
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+            continue
+
+        tokens.append(token)
+        parts = [part for part in _SPLIT_RE.split(token) if part]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    进程内倒排索引，按切片粒度做BM25打分
+
+    每个工具与向量切片一一对应：位置0为概览（ToolName + ToolDescription），
+    之后依次为各参数（ArgName + ArgDescription）。名称中的词元权重加倍。
+    检索结果的格式与向量检索一致，可直接与向量结果融合后交给CoarseRanker。
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, name_weight: int = 2):
+        """
+        初始化词法索引
+
+        Args:
+            k1: BM25词频饱和参数
+            b: BM25文档长度归一化参数
+            name_weight: 工具名和参数名中词元的重复次数
+        """
+        self.k1 = k1
+        self.b = b
+        self.name_weight = name_weight
+
+        self._postings: Dict[str, Dict[int, int]] = {}  # 词元 -> {文档ID: 词频}
+        self._doc_terms: Dict[int, Counter] = {}
+        self._doc_length: Dict[int, int] = {}
+        self._doc_info: Dict[int, Tuple[str, str, str]] = {}  # 文档ID -> (切片key, 工具UUID, 切片类型)
+        self._doc_meta: Dict[int, Tuple[str, Tuple[str, ...]]] = {}  # 文档ID -> (命名空间, 标签)
+        self._namespace_docs: Counter = Counter()  # 命名空间 -> 文档数
+        self._docs_of_uuid: Dict[str, List[int]] = {}
+        self._total_length = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_info)
+
+    def _build_documents(self, tool: Tool) -> List[Tuple[str, Counter]]:
+        """生成工具各切片的 (切片类型, 词频)"""
+        documents = []
+        fields = [("overview", tool.ToolName, tool.ToolDescription)]
+        fields.extend(("parameter", arg.ArgName, arg.ArgDescription) for arg in tool.Args)
+        for slice_type, name, description in fields:
+            terms = Counter(tokenize(description))
+            for token in tokenize(name):
+                terms[token] += self.name_weight
+            documents.append((slice_type, terms))
+        return documents
+
+    def _remove_uuid(self, uuid: str):
+        """删除工具的全部切片，调用方持有锁"""
+        for doc_id in self._docs_of_uuid.pop(uuid, []):
+            terms = self._doc_terms.pop(doc_id)
+            self._doc_info.pop(doc_id)
+            namespace, _ = self._doc_meta.pop(doc_id)
+            self._namespace_docs[namespace] -= 1
+            if not self._namespace_docs[namespace]:
+                del self._namespace_docs[namespace]
+            self._total_length -= self._doc_length.pop(doc_id)
+            for term in terms:
+                postings = self._postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+
+    def add_tools(self, tools: Iterable[Tool]):
+        """
+        写入或覆盖工具
+
+        Args:
+            tools: 工具列表，已有的工具会先删除旧切片
+        """
+        prepared = [(tool.uuid, (tool.namespace, tuple(tool.tags)), self._build_documents(tool)) for tool in tools]
+        with self._lock:
+            for uuid, meta, documents in prepared:
+                self._remove_uuid(uuid)
+                doc_ids = []
+                for position, (slice_type, terms) in enumerate(documents):
+                    doc_id = self._next_id
+                    self._next_id += 1
+                    self._doc_terms[doc_id] = terms
+                    self._doc_length[doc_id] = sum(terms.values())
+                    self._doc_info[doc_id] = (f"tool_slices:{uuid}:{position}", uuid, slice_type)
+                    self._doc_meta[doc_id] = meta
+                    self._namespace_docs[meta[0]] += 1
+                    self._total_length += self._doc_length[doc_id]
+                    for term, frequency in terms.items():
+                        self._postings.setdefault(term, {})[doc_id] = frequency
+                    doc_ids.append(doc_id)
+                self._docs_of_uuid[uuid] = doc_ids
+
+    def remove_tools(self, uuids: Iterable[str]):
+        """
+        删除工具
+
+        Args:
+            uuids: 工具UUID列表
+        """
+        with self._lock:
+            for uuid in uuids:
+                self._remove_uuid(uuid)
+
+    def clear(self):
+        """清空索引"""
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_length.clear()
+            self._doc_info.clear()
+            self._doc_meta.clear()
+            self._namespace_docs.clear()
+            self._docs_of_uuid.clear()
+            self._total_length = 0
+
+    def _idf(self, term: str, num_docs: int) -> float:
+        document_frequency = len(self._postings.get(term, ()))
+        return math.log(1.0 + (num_docs - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def _allowed(self, search_filter: Optional[SearchFilter]):
+        """
+        返回判断文档是否满足过滤条件的函数，调用方持有锁
+
+        Returns:
+            None表示全部文档都满足，无需逐个判断
+        """
+        search_filter = search_filter or SearchFilter()
+        if not search_filter.restricts_slices and self._namespace_docs.get(search_filter.namespace) == len(self._doc_info):
+            return None
+        doc_meta, doc_info = self._doc_meta, self._doc_info
+        return lambda doc_id: search_filter.matches(doc_meta[doc_id][0], doc_meta[doc_id][1], doc_info[doc_id][2])
+
+    def search(self, query: str, num_results: int = 100,
+               search_filter: Optional[SearchFilter] = None) -> Tuple[List[Dict[str, Any]], float]:
+        """
+        BM25检索
+
+        IDF和平均文档长度按整个索引统计，过滤条件只决定哪些切片参与打分。
+
+        Args:
+            query: 查询文本
+            num_results: 返回结果数量
+            search_filter: 过滤条件，默认只检索默认命名空间
+
+        Returns:
+            (搜索结果列表, 置信度)。结果按BM25得分降序排列；
+            置信度为得分最高的切片覆盖的查询词元IDF占比，取值0~1
+        """
+        query_terms = set(tokenize(query))
+        with self._lock:
+            num_docs = len(self._doc_info)
+            if not query_terms or num_docs == 0 or num_results <= 0:
+                return [], 0.0
+
+            average_length = self._total_length / num_docs
+            idf = {term: self._idf(term, num_docs) for term in query_terms}
+            allowed = self._allowed(search_filter)
+
+            scores: Dict[int, float] = {}
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                term_idf = idf[term]
+                for doc_id, frequency in postings.items():
+                    if allowed is not None and not allowed(doc_id):
+                        continue
+                    norm = self.k1 * (1.0 - self.b + self.b * self._doc_length[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + term_idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+            if not scores:
+                return [], 0.0
+
+            top = heapq.nlargest(num_results, scores.items(), key=lambda item: item[1])
+            results = []
+            for doc_id, score in top:
+                key, uuid, slice_type = self._doc_info[doc_id]
+                results.append({'uuid': uuid, 'score': score, 'slice_type': slice_type, 'key': key})
+
+            best_terms = self._doc_terms[top[0][0]]
+            matched = sum(weight for term, weight in idf.items() if term in best_terms)
+            confidence = matched / sum(idf.values())
+
+        return results, confidence
+
+
+def run_lexical_stage(index: Optional[LexicalIndex], query: str, num_results: int, mode: str,
+                      confidence_threshold: float,
+                      search_filter: Optional[SearchFilter] = None) -> Tuple[Optional[List[Dict[str, Any]]], bool]:
+    """
+    按检索方式执行词法检索，并判断是否还需要向量检索
+
+    Args:
+        index: 词法索引，mode为'vector'时可为None
+        query: 查询文本
+        num_results: 返回结果数量
+        mode: 检索方式，见RETRIEVAL_MODES
+        confidence_threshold: 'auto'模式下跳过向量检索所需的最低置信度
+        search_filter: 过滤条件，默认只检索默认命名空间
+
+    Returns:
+        (词法检索结果，'vector'模式为None；是否需要向量检索)
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"不支持的检索方式: {mode}")
+    if mode == "vector":
+        return None, True
+
+    results, confidence = index.search(query, num_results, search_filter)
+    if mode == "lexical":
+        return results, False
+    if mode == "auto" and results and confidence >= confidence_threshold:
+        return results, False
+    return results, True
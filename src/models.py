@@ -1,13 +1,18 @@
 """
 数据模型定义
 """
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Iterator, Iterable, Tuple
+from dataclasses import dataclass, field
 import json
 import uuid
 
+import numpy as np
 
-@dataclass
+# 未指定命名空间的工具和检索都属于默认命名空间
+DEFAULT_NAMESPACE = "default"
+
+
+@dataclass(slots=True)
 class ToolArg:
     """工具参数模型"""
     ArgName: str
@@ -20,24 +25,37 @@ class ToolArg:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class Tool:
     """工具模型"""
     ToolName: str
     ToolDescription: str
     Args: List[ToolArg]
     uuid: Optional[str] = None
+    namespace: str = DEFAULT_NAMESPACE  # 所属命名空间（例如租户），检索只扫描同一命名空间的切片
+    tags: List[str] = field(default_factory=list)  # 标签（例如工具类别），可作为检索过滤条件
+    # 精排服务渲染的文档缓存 (文档格式, 文档, 文档哈希)，随缓存中的工具对象复用，不参与序列化和比较
+    rendered: Optional[Tuple[str, str, str]] = field(default=None, init=False, repr=False, compare=False)
     
     def __post_init__(self):
         if self.uuid is None:
             self.uuid = str(uuid.uuid4())
+        # 标签在Redis中以逗号分隔存储
+        if any("," in tag for tag in self.tags):
+            raise ValueError(f"标签不能包含逗号: {self.tags}")
     
     def to_dict(self) -> Dict[str, Any]:
-        return {
+        data = {
             "ToolName": self.ToolName,
             "ToolDescription": self.ToolDescription,
             "Args": [arg.to_dict() for arg in self.Args]
         }
+        # 默认命名空间和空标签不写出，未使用这些字段的工具JSON保持不变
+        if self.namespace != DEFAULT_NAMESPACE:
+            data["Namespace"] = self.namespace
+        if self.tags:
+            data["Tags"] = list(self.tags)
+        return data
     
     def to_json(self) -> str:
         return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
@@ -49,26 +67,191 @@ class Tool:
             ToolName=data['ToolName'],
             ToolDescription=data['ToolDescription'],
             Args=args,
-            uuid=tool_uuid
+            uuid=tool_uuid,
+            namespace=data.get('Namespace') or DEFAULT_NAMESPACE,
+            tags=cls._parse_tags(data.get('Tags'))
         )
 
+    @staticmethod
+    def _parse_tags(tags: Any) -> List[str]:
+        """Tags字段：标签列表，单个字符串视为一个标签，缺省为空"""
+        if tags is None:
+            return []
+        if isinstance(tags, str):
+            return [tags]
+        if not isinstance(tags, (list, tuple)) or not all(isinstance(tag, str) for tag in tags):
+            raise ValueError(f"Tags应为字符串列表: {tags!r}")
+        return list(tags)
 
-@dataclass
+
+@dataclass(slots=True)
 class ToolSlice:
     """工具切片模型"""
     uuid: str     # 对应工具的UUID
-    embedding: List[float]  # 切片的向量表示
+    embedding: Any  # 切片的向量表示，float32数组或浮点数列表
     slice_type: Optional[str] = None  # 切片类型：'overview' 或 'parameter'（可选）
+    position: int = 0  # 切片在工具内的位置，0为概览，参数切片依次递增
+    content_hash: Optional[str] = None  # 切片内容的哈希，用于增量更新时判断内容是否变化
+    content: Optional[str] = None  # 切片文本，写入向量索引的content字段
+    namespace: str = DEFAULT_NAMESPACE  # 所属工具的命名空间
+    tags: List[str] = field(default_factory=list)  # 所属工具的标签
+
+    @property
+    def key(self) -> str:
+        """切片在Redis中的key，由工具UUID和切片位置决定"""
+        return f"tool_slices:{self.uuid}:{self.position}"
 
     def to_dict(self) -> Dict[str, Any]:
         return {
             "uuid": self.uuid,
-            "embedding": self.embedding,
-            "slice_type": self.slice_type
+            "embedding": self.embedding.tolist() if isinstance(self.embedding, np.ndarray) else self.embedding,
+            "slice_type": self.slice_type,
+            "position": self.position,
+            "content_hash": self.content_hash,
+            "content": self.content,
+            "namespace": self.namespace,
+            "tags": list(self.tags)
+        }
+
+
+@dataclass(slots=True)
+class SliceBatch:
+    """
+    一批切片的列式表示
+
+    所有向量保存在一个C连续的float32二维数组中，其余字段为并行列表，
+    不为每个浮点数创建Python对象；每行的字节视图可直接写入Redis而不复制。
+    """
+    embeddings: np.ndarray  # 形状为 (n, dimensions) 的float32数组
+    uuids: List[str]  # 每个切片对应的工具UUID
+    positions: List[int]  # 切片在工具内的位置
+    slice_types: List[Optional[str]]  # 切片类型
+    content_hashes: List[Optional[str]] = field(default_factory=list)  # 切片内容哈希，可为空列表
+    contents: List[Optional[str]] = field(default_factory=list)  # 切片文本，可为空列表
+    namespaces: List[str] = field(default_factory=list)  # 所属工具的命名空间，为空列表时均为默认命名空间
+    tags: List[List[str]] = field(default_factory=list)  # 所属工具的标签，可为空列表
+
+    def __post_init__(self):
+        self.embeddings = np.ascontiguousarray(self.embeddings, dtype=np.float32)
+        if self.embeddings.ndim != 2:
+            self.embeddings = self.embeddings.reshape(len(self.uuids), -1)
+        if not self.content_hashes:
+            self.content_hashes = [None] * len(self.uuids)
+        if not self.contents:
+            self.contents = [None] * len(self.uuids)
+        if not self.namespaces:
+            self.namespaces = [DEFAULT_NAMESPACE] * len(self.uuids)
+        if not self.tags:
+            self.tags = [[] for _ in self.uuids]
+
+    def __len__(self) -> int:
+        return len(self.uuids)
+
+    @property
+    def keys(self) -> List[str]:
+        """每个切片在Redis中的key"""
+        return [f"tool_slices:{uuid}:{position}" for uuid, position in zip(self.uuids, self.positions)]
+
+    def embedding_bytes(self, index: int) -> memoryview:
+        """第index个切片向量的float32字节视图，不复制数据"""
+        return memoryview(self.embeddings[index]).cast("B")
+
+    def __getitem__(self, index: int) -> ToolSlice:
+        """取单个切片，向量为矩阵行的视图"""
+        return ToolSlice(
+            uuid=self.uuids[index],
+            embedding=self.embeddings[index],
+            slice_type=self.slice_types[index],
+            position=self.positions[index],
+            content_hash=self.content_hashes[index],
+            content=self.contents[index],
+            namespace=self.namespaces[index],
+            tags=self.tags[index]
+        )
+
+    def __iter__(self) -> Iterator[ToolSlice]:
+        return (self[i] for i in range(len(self)))
+
+    @classmethod
+    def from_slices(cls, slices: List[ToolSlice], dimensions: int = 1024) -> "SliceBatch":
+        """
+        由ToolSlice列表构建
+
+        Args:
+            slices: 切片列表
+            dimensions: 切片列表为空时使用的向量维度
+
+        Returns:
+            切片批次
+        """
+        embeddings = np.empty((len(slices), dimensions), dtype=np.float32)
+        if slices:
+            embeddings = np.asarray([slice_obj.embedding for slice_obj in slices], dtype=np.float32)
+        return cls(
+            embeddings=embeddings,
+            uuids=[slice_obj.uuid for slice_obj in slices],
+            positions=[slice_obj.position for slice_obj in slices],
+            slice_types=[slice_obj.slice_type for slice_obj in slices],
+            content_hashes=[slice_obj.content_hash for slice_obj in slices],
+            contents=[slice_obj.content for slice_obj in slices],
+            namespaces=[slice_obj.namespace for slice_obj in slices],
+            tags=[slice_obj.tags for slice_obj in slices]
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class SearchFilter:
+    """
+    检索过滤条件
+
+    命名空间决定扫描哪个分区；标签和切片类型在计算相似度之前筛选切片。
+    不可变且可哈希，可以直接作为查询结果缓存key的一部分。
+    """
+    namespace: str = DEFAULT_NAMESPACE
+    tags: Optional[Tuple[str, ...]] = None  # 工具带有其中任一标签，None表示不限
+    slice_types: Optional[Tuple[str, ...]] = None  # 切片类型属于其中之一，None表示不限
+
+    def __post_init__(self):
+        # 允许传入列表，统一转换为元组以保持可哈希
+        if self.tags is not None:
+            object.__setattr__(self, "tags", tuple(self.tags))
+        if self.slice_types is not None:
+            object.__setattr__(self, "slice_types", tuple(self.slice_types))
+
+    @property
+    def restricts_slices(self) -> bool:
+        """是否在命名空间之内进一步筛选切片"""
+        return self.tags is not None or self.slice_types is not None
+
+    def matches(self, namespace: str, tags: Iterable[str], slice_type: Optional[str]) -> bool:
+        """
+        判断切片是否满足过滤条件
+
+        Args:
+            namespace: 切片所属命名空间
+            tags: 所属工具的标签
+            slice_type: 切片类型
+
+        Returns:
+            是否满足
+        """
+        if namespace != self.namespace:
+            return False
+        if self.slice_types is not None and slice_type not in self.slice_types:
+            return False
+        if self.tags is not None and not any(tag in self.tags for tag in tags):
+            return False
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "namespace": self.namespace,
+            "tags": list(self.tags) if self.tags is not None else None,
+            "slice_types": list(self.slice_types) if self.slice_types is not None else None
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class SearchResult:
     """搜索结果模型"""
     tool: Tool
@@ -83,7 +266,7 @@ class SearchResult:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class CoarseRankResult:
     """粗排结果模型"""
     uuid: str
@@ -94,3 +277,51 @@ class CoarseRankResult:
             "uuid": self.uuid,
             "score": self.score
         }
+
+
+@dataclass(slots=True)
+class CascadeResult:
+    """自适应检索结果"""
+    tools: List[Tool]
+    path: str  # 级联路径：'skip_rerank'、'shrink_rerank' 或 'full_rerank'
+    reranked: int  # 送入交叉编码器的候选数量
+    budget_limited: bool = False  # 是否因延迟预算缩减了候选
+    elapsed_ms: float = 0.0  # 总耗时（毫秒）
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tools": [tool.to_dict() for tool in self.tools],
+            "path": self.path,
+            "reranked": self.reranked,
+            "budget_limited": self.budget_limited,
+            "elapsed_ms": self.elapsed_ms
+        }
+
+
+@dataclass(slots=True)
+class IngestProgress:
+    """流式导入进度"""
+    source: str  # 数据源标识，例如JSONL文件路径
+    records: int = 0  # 已处理的记录数（含之前中断的运行）
+    tools: int = 0  # 已写入的工具数
+    slices_embedded: int = 0  # 重新向量化的切片数
+    slices_removed: int = 0  # 删除的过期切片数
+    elapsed_seconds: float = 0.0  # 累计耗时（秒）
+    completed: bool = False  # 数据源是否已全部导入
+
+    @property
+    def tools_per_second(self) -> float:
+        """平均导入吞吐"""
+        return self.tools / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "records": self.records,
+            "tools": self.tools,
+            "slices_embedded": self.slices_embedded,
+            "slices_removed": self.slices_removed,
+            "elapsed_seconds": self.elapsed_seconds,
+            "tools_per_second": self.tools_per_second,
+            "completed": self.completed
+        }
@@ -1,67 +1,428 @@
 """
 RAG系统主服务
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, Callable
+import itertools
 import json
+import logging
+import os
+import threading
+import time
 
-from .models import Tool, ToolArg
+from .models import Tool, ToolArg, CascadeResult, CoarseRankResult, IngestProgress, SearchFilter
 from .slicer import ToolSlicer
 from .embedding_service import EmbeddingService
+from .clients import get_embedding_service
 from .redis_service import RedisService
 from .coarse_ranker import CoarseRanker
 from .reranker import RerankerService
+from .lexical_index import LexicalIndex, run_lexical_stage
+from .cascade import CascadePolicy, SKIP_RERANK
+from .ingestion import IngestCheckpoint, iter_jsonl, record_uuid
+from .result_cache import QueryResultCache
+from .telemetry import tracer, metrics
+
+logger = logging.getLogger(__name__)
 
 
 class RAGSystem:
     """RAG系统主服务类"""
     
-    def __init__(self, rerank_top_n: int = 10):
+    def __init__(self, rerank_top_n: int = 10,
+                 embedding_service: Optional[EmbeddingService] = None,
+                 redis_service: Optional[RedisService] = None,
+                 reranker: Optional[RerankerService] = None,
+                 lexical_confidence: float = 0.9,
+                 cascade_policy: Optional[CascadePolicy] = None,
+                 coarse_ranker: Optional[CoarseRanker] = None,
+                 result_cache: Optional[QueryResultCache] = None):
         """
         初始化RAG系统
+
+        各阶段组件在首次使用时才创建：只做索引的进程不会加载精排模型，
+        构造本身也不会连接Redis或向量化接口。
         
         Args:
             rerank_top_n: 精排返回的最大结果数量
+            embedding_service: 向量化服务，默认使用进程内共享的向量化服务
+            redis_service: Redis存储服务，默认使用共享连接池新建
+            reranker: 精排服务，默认按rerank_top_n新建
+            lexical_confidence: 'auto'检索方式下直接采用词法结果、跳过查询向量化所需的最低置信度
+            cascade_policy: 自适应检索的精排级联策略，默认使用CascadePolicy的默认阈值
+            coarse_ranker: 粗排服务，可指定工具得分的聚合方式，默认按排名倒数聚合
+            result_cache: 查询结果缓存，默认按环境变量QUERY_CACHE_SIZE、QUERY_CACHE_TTL_SECONDS、
+                QUERY_CACHE_SIMILARITY（默认为0，不启用语义层）和TOOL_CACHE_CHECK_SECONDS创建
+        """
+        self.rerank_top_n = rerank_top_n
+        self.lexical_confidence = lexical_confidence
+        self.cascade_policy = cascade_policy or CascadePolicy()
+        self.coarse_ranker = coarse_ranker or CoarseRanker()
+        if result_cache is None:
+            similarity = float(os.getenv("QUERY_CACHE_SIMILARITY", 0))
+            result_cache = QueryResultCache(
+                max_entries=int(os.getenv("QUERY_CACHE_SIZE", 1000)),
+                ttl_seconds=float(os.getenv("QUERY_CACHE_TTL_SECONDS", 300)),
+                similarity_threshold=similarity if similarity > 0 else None,
+                version_check_interval=float(os.getenv("TOOL_CACHE_CHECK_SECONDS", 1.0))
+            )
+        self.result_cache = result_cache
+        self._embedding_service = embedding_service
+        self._redis_service = redis_service
+        self._slicer: Optional[ToolSlicer] = None
+        self._reranker = reranker
+        self._lexical_index: Optional[LexicalIndex] = None
+        # 构建词法索引前读取的工具库版本号，见sync_catalog
+        self._lexical_version: Optional[int] = None
+        self._sync_lock = threading.Lock()
+
+    @property
+    def embedding_service(self) -> EmbeddingService:
+        """向量化服务，切片和查询共用"""
+        if self._embedding_service is None:
+            self._embedding_service = get_embedding_service()
+        return self._embedding_service
+
+    @property
+    def redis_service(self) -> RedisService:
+        """Redis存储服务，使用进程内共享的连接池"""
+        if self._redis_service is None:
+            self._redis_service = RedisService()
+        return self._redis_service
+
+    @property
+    def slicer(self) -> ToolSlicer:
+        """工具切片处理器"""
+        if self._slicer is None:
+            self._slicer = ToolSlicer(self.embedding_service)
+        return self._slicer
+
+    @property
+    def reranker(self) -> RerankerService:
+        """精排服务，模型在首次打分时加载"""
+        if self._reranker is None:
+            self._reranker = RerankerService(top_n=self.rerank_top_n)
+        return self._reranker
+
+    @property
+    def lexical_index(self) -> LexicalIndex:
+        """BM25词法索引，首次访问时从Redis中的全部工具构建"""
+        if self._lexical_index is None:
+            self._lexical_index = self._build_lexical_index()
+        return self._lexical_index
+
+    def _build_lexical_index(self) -> LexicalIndex:
+        """从Redis中的全部工具构建词法索引，并记录构建前的工具库版本号"""
+        version = self.redis_service.read_catalog_version()
+        index = LexicalIndex()
+        index.add_tools(
+            Tool.from_dict(json.loads(tool_json), uuid)
+            for uuid, tool_json in self.redis_service.get_all_tool_jsons().items()
+        )
+        self._lexical_version = version
+        return index
+
+    def sync_catalog(self) -> bool:
         """
-        self.slicer = ToolSlicer()
-        self.embedding_service = EmbeddingService()
-        self.redis_service = RedisService()
-        self.coarse_ranker = CoarseRanker()
-        self.reranker = RerankerService(top_n=rerank_top_n)
+        按TOOL_CACHE_CHECK_SECONDS的间隔检查工具库版本号：其他进程写入或删除了工具、切片时，
+        重新加载切片向量存储、重建词法索引，最后清空查询结果缓存
+
+        结果缓存在派生数据更新之后才清空，此前开始的检索算出的旧结果因代数变化不会写入缓存。
+        另一个线程正在检查时直接返回，本次检索继续使用当前数据。
+
+        Returns:
+            是否重新加载了切片存储或词法索引
+        """
+        redis_service = self.redis_service
+        if not redis_service.needs_catalog_check() or not self._sync_lock.acquire(blocking=False):
+            return False
+        try:
+            version = redis_service.read_catalog_version()
+            reloaded = redis_service.sync_slice_store(version)
+            if self._lexical_index is not None:
+                if redis_service.catalog_changed(self._lexical_version, version):
+                    self._lexical_index = self._build_lexical_index()
+                    reloaded = True
+                else:
+                    self._lexical_version = version
+            redis_service.forget_catalog_writes(version)
+            self.result_cache.sync_version(version)
+            return reloaded
+        finally:
+            self._sync_lock.release()
+
+    def warmup(self):
+        """
+        预热在线检索需要的全部组件：建立Redis连接、检查向量索引、加载切片向量矩阵、
+        创建向量化客户端并加载精排模型。服务进程应在开始接收请求前调用。
+        """
+        self.redis_service.redis_client.ping()
+        self.redis_service.index
+        self.redis_service.get_slice_store()
+        self.lexical_index
+        self.embedding_service.client
+        self.reranker.warmup()
     
     def index_tools(self, tools_data: List[Dict[str, Any]]):
         """
         索引工具数据（第一阶段：数据预处理）
+
+        配置了切片快照目录时，索引完成后写出新的快照版本，供检索进程切换。
         
         Args:
             tools_data: 工具数据列表
         """
-        print("开始索引工具数据...")
-        
-        # 1. 解析工具数据
-        tools = []
-        for tool_data in tools_data:
-            tool = Tool.from_dict(tool_data)
-            tools.append(tool)
-        
-        print(f"解析了 {len(tools)} 个工具")
-        
-        # 2. 存储完整工具信息到Redis
-        for tool in tools:
-            self.redis_service.store_tool(tool)
-        
-        print("完整工具信息已存储到Redis")
-        
-        # 3. 切片处理（包含向量化）
-        all_slices = self.slicer.slice_tools(tools)
-        print(f"生成了 {len(all_slices)} 个切片并完成向量化")
+        logger.info("开始索引工具数据...")
+        with tracer.span("index_tools", tools=len(tools_data)):
+            self.upsert_tools(tools_data)
+            if self.redis_service.snapshot is not None:
+                with tracer.span("write_snapshot"):
+                    self.redis_service.write_slice_snapshot()
+        logger.info("工具索引完成！")
 
-        # 4. 存储切片到向量数据库
-        self.redis_service.store_tool_slices(all_slices)
-        print("切片已存储到向量数据库")
-        
-        print("工具索引完成！")
+    def ingest_jsonl(self, path: str, chunk_size: int = 500, checkpoint_path: Optional[str] = None,
+                     progress_callback: Optional[Callable[[IngestProgress], None]] = None) -> IngestProgress:
+        """
+        从JSONL文件流式导入工具库，每行一个工具
+
+        文件逐行读取，每chunk_size个工具走一遍 解析 -> 切片 -> 向量化 -> 写入，
+        峰值内存只取决于chunk_size而与文件大小无关。
+        指定checkpoint_path时每个批次写入后记录已处理到的字节偏移，中断后再次调用会从该位置继续。
+
+        Args:
+            path: JSONL文件路径
+            chunk_size: 每批处理的工具数量
+            checkpoint_path: 检查点文件路径，None表示不支持断点续传
+            progress_callback: 每个批次完成后调用，参数为当前导入进度
+
+        Returns:
+            导入进度
+        """
+        source = os.path.abspath(path)
+        checkpoint = IngestCheckpoint(checkpoint_path) if checkpoint_path else None
+        progress, offset = self._resume_ingest(checkpoint, source)
+        if progress.completed:
+            return progress
+        return self._ingest_records(iter_jsonl(path, offset), progress, chunk_size, checkpoint, progress_callback)
+
+    def ingest_stream(self, records: Iterable[Dict[str, Any]], source: str = "stream", chunk_size: int = 500,
+                      checkpoint_path: Optional[str] = None,
+                      progress_callback: Optional[Callable[[IngestProgress], None]] = None) -> IngestProgress:
+        """
+        从任意可迭代对象流式导入工具库
+
+        断点续传时跳过检查点记录的记录数，因此同一source的数据源每次迭代的顺序必须一致。
+
+        Args:
+            records: 工具数据的可迭代对象
+            source: 数据源标识，用于校验检查点和生成缺省的工具UUID
+            chunk_size: 每批处理的工具数量
+            checkpoint_path: 检查点文件路径，None表示不支持断点续传
+            progress_callback: 每个批次完成后调用，参数为当前导入进度
+
+        Returns:
+            导入进度
+        """
+        checkpoint = IngestCheckpoint(checkpoint_path) if checkpoint_path else None
+        progress, skip = self._resume_ingest(checkpoint, source)
+        if progress.completed:
+            return progress
+        numbered = ((record, number) for number, record in enumerate(records, start=1))
+        return self._ingest_records(
+            itertools.islice(numbered, skip, None), progress, chunk_size, checkpoint, progress_callback
+        )
+
+    @staticmethod
+    def _resume_ingest(checkpoint: Optional[IngestCheckpoint], source: str) -> Tuple[IngestProgress, int]:
+        """读取检查点，返回 (导入进度, 数据源位置)；没有检查点时从头开始"""
+        saved = checkpoint.load() if checkpoint is not None else None
+        if saved is None:
+            return IngestProgress(source=source), 0
+
+        progress, position = saved
+        if progress.source != source:
+            raise ValueError(f"检查点 {checkpoint.path} 属于数据源 {progress.source}，不能用于 {source}")
+        if progress.completed:
+            logger.info("数据源 %s 已导入完成（%d 个工具），跳过", source, progress.tools)
+        else:
+            logger.info("从检查点继续导入 %s：已处理 %d 条记录", source, progress.records)
+        return progress, position
+
+    def _ingest_records(self, records: Iterator[Tuple[Dict[str, Any], int]], progress: IngestProgress,
+                        chunk_size: int, checkpoint: Optional[IngestCheckpoint],
+                        progress_callback: Optional[Callable[[IngestProgress], None]]) -> IngestProgress:
+        """
+        按批次导入 (记录, 数据源位置) 流，每批写入后更新进度和检查点
+
+        Returns:
+            导入进度
+        """
+        chunk_size = max(int(chunk_size), 1)
+        start = time.perf_counter()
+        base_elapsed = progress.elapsed_seconds
+        position = None
+
+        def flush(chunk: List[Dict[str, Any]]):
+            _, embedded, removed = self._upsert(chunk)
+            progress.records += len(chunk)
+            progress.tools += len(chunk)
+            progress.slices_embedded += embedded
+            progress.slices_removed += removed
+            progress.elapsed_seconds = base_elapsed + time.perf_counter() - start
+            if checkpoint is not None:
+                checkpoint.save(progress, position)
+            logger.info("已导入 %d 个工具，%d 个切片，%.1f 工具/秒",
+                        progress.tools, progress.slices_embedded, progress.tools_per_second)
+            if progress_callback is not None:
+                progress_callback(progress)
+
+        with tracer.span("ingest", source=progress.source):
+            chunk: List[Dict[str, Any]] = []
+            for record, position in records:
+                if not record.get("uuid"):
+                    record = {**record, "uuid": record_uuid(progress.source, progress.records + len(chunk))}
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    flush(chunk)
+                    chunk = []
+            if chunk:
+                flush(chunk)
+
+            progress.completed = True
+            progress.elapsed_seconds = base_elapsed + time.perf_counter() - start
+            if checkpoint is not None:
+                checkpoint.save(progress, position if position is not None else 0)
+            if self.redis_service.snapshot is not None:
+                with tracer.span("write_snapshot"):
+                    self.redis_service.write_slice_snapshot()
+
+        logger.info("数据源 %s 导入完成：%d 个工具，耗时 %.1f 秒", progress.source, progress.tools,
+                    progress.elapsed_seconds)
+        return progress
+
+    def upsert_tools(self, tools_data: List[Dict[str, Any]]) -> List[str]:
+        """
+        增量写入工具：新工具全部切片入库，已有工具只重新向量化内容变化的切片
+
+        Args:
+            tools_data: 工具数据列表，可携带"uuid"字段指定已有工具，否则分配新的UUID
+
+        Returns:
+            工具UUID列表，与输入顺序一致
+        """
+        return self._upsert(tools_data)[0]
+
+    def _upsert(self, tools_data: List[Dict[str, Any]]) -> Tuple[List[str], int, int]:
+        """
+        upsert_tools的实现
+
+        Returns:
+            (工具UUID列表, 重新向量化的切片数, 删除的过期切片数)
+        """
+        with tracer.span("upsert_tools", tools=len(tools_data)) as span:
+            # 1. 解析工具数据
+            with tracer.span("parse"):
+                tools = []
+                for tool_data in tools_data:
+                    tool = Tool.from_dict(tool_data, tool_data.get("uuid"))
+                    tools.append(tool)
+
+            logger.info("解析了 %d 个工具", len(tools))
+
+            # 命名空间或标签变化的工具，切片内容不变也要重写切片，使向量存储和HNSW索引中的过滤字段跟着变化
+            with tracer.span("fetch_previous"):
+                previous = {
+                    tool.uuid: (tool.namespace, tuple(tool.tags))
+                    for tool in self.redis_service.read_tools([tool.uuid for tool in tools])
+                }
+
+            # 2. 存储完整工具信息到Redis
+            with tracer.span("store_tools"):
+                self.redis_service.store_tools(tools)
+                # 词法索引未加载时由首次检索统一构建
+                if self._lexical_index is not None:
+                    self._lexical_index.add_tools(tools)
+                # 已加载精排模型的进程（例如在线服务写入工具）顺便完成新文档的分词
+                if self._reranker is not None:
+                    self._reranker.prepare_documents(tools)
+
+            logger.info("完整工具信息已存储到Redis")
+
+            # 3. 逐个工具比对切片内容，只处理变化部分
+            with tracer.span("diff_slices"):
+                hashes_by_uuid = self.redis_service.get_slice_hashes_many([tool.uuid for tool in tools])
+                changed_tools = []
+                changed_by_uuid = {}
+                orphans_by_uuid = {}
+                for tool in tools:
+                    contents = self.slicer.build_slice_contents(tool)
+                    stored_hashes = hashes_by_uuid[tool.uuid]
+                    metadata_changed = previous.get(tool.uuid, (tool.namespace, tuple(tool.tags))) != \
+                        (tool.namespace, tuple(tool.tags))
+
+                    # 内容哈希变化或新增的切片需要重新向量化；元数据变化时全部重写，向量一般可由向量化缓存命中
+                    changed_positions = [
+                        position for position, (_, content) in enumerate(contents)
+                        if metadata_changed or stored_hashes.get(position) != self.slicer.hash_content(content)
+                    ]
+                    # 参数减少后多出来的切片需要删除
+                    orphan_positions = [position for position in stored_hashes if position >= len(contents)]
+
+                    if changed_positions:
+                        changed_tools.append(tool)
+                        changed_by_uuid[tool.uuid] = changed_positions
+
+                    if orphan_positions:
+                        orphans_by_uuid[tool.uuid] = orphan_positions
+
+            # 4. 跨工具打包向量化变化的切片，批量写入并删除过期切片
+            with tracer.span("embed_slices"):
+                changed_slices = self.slicer.slice_tools(changed_tools, changed_by_uuid)
+            with tracer.span("store_slices", slices=len(changed_slices)):
+                self.redis_service.store_tool_slices(changed_slices)
+            with tracer.span("delete_slices"):
+                self.redis_service.delete_slices(orphans_by_uuid)
+
+            removed_count = sum(len(positions) for positions in orphans_by_uuid.values())
+            self.invalidate_results()
+            span.set_attribute("slices_embedded", len(changed_slices))
+            span.set_attribute("slices_removed", removed_count)
+            logger.info("重新向量化了 %d 个切片，删除了 %d 个过期切片", len(changed_slices), removed_count)
+
+        return [tool.uuid for tool in tools], len(changed_slices), removed_count
+
+    def update_tool(self, tool_uuid: str, tool_data: Dict[str, Any]):
+        """
+        更新已有工具
+
+        Args:
+            tool_uuid: 工具UUID
+            tool_data: 新的工具数据
+        """
+        if not self.redis_service.tool_exists(tool_uuid):
+            raise ValueError(f"工具不存在: {tool_uuid}")
+        self.upsert_tools([{**tool_data, "uuid": tool_uuid}])
+
+    def delete_tools(self, tool_uuids: List[str]) -> int:
+        """
+        删除工具及其全部切片
+
+        Args:
+            tool_uuids: 工具UUID列表
+
+        Returns:
+            实际删除的工具数量
+        """
+        deleted = self.redis_service.delete_tools(tool_uuids)
+        if self._lexical_index is not None:
+            self._lexical_index.remove_tools(tool_uuids)
+        self.invalidate_results()
+        logger.info("删除了 %d 个工具", deleted)
+        return deleted
     
-    def search_tools(self, query: str, top_n: int = 100, top_m: int = 20, top_k: int = 5) -> List[Tool]:
+    def search_tools(self, query: str, top_n: int = 100, top_m: int = 20, top_k: int = 5,
+                     search_method: str = "brute_force", ef_runtime: Optional[int] = None,
+                     retrieval_mode: str = "hybrid", search_filter: Optional[SearchFilter] = None,
+                     nprobe: Optional[int] = None) -> List[Tool]:
         """
         搜索工具（第二阶段：粗排 + 第三阶段：精排）
         
@@ -70,51 +431,342 @@ class RAGSystem:
             top_n: 粗排阶段检索的切片数量
             top_m: 粗排后保留的候选工具数量
             top_k: 最终返回的工具数量
+            search_method: 向量检索方式，'brute_force'（精确）、'ivf'（进程内IVF近似检索）或'hnsw'（Redis近似检索）
+            ef_runtime: HNSW检索时的候选列表大小，仅在search_method为'hnsw'时生效
+            retrieval_mode: 切片检索方式：'vector'仅向量检索；'lexical'仅BM25检索，不调用向量化接口；
+                'hybrid'两路结果融合；'auto'词法置信度达到lexical_confidence时只用词法结果，否则同hybrid
+            search_filter: 过滤条件：只检索该命名空间，并可按工具标签和切片类型筛选；默认只检索默认命名空间
+            nprobe: IVF检索扫描的簇数量，仅在search_method为'ivf'时生效，默认为RedisService.ivf_nprobe
             
         Returns:
             Top K工具列表
         """
-        print(f"开始搜索: {query}")
-        
-        # 1. 查询向量化
-        query_embedding = self.embedding_service.get_single_embedding(query)
-        print("查询向量化完成")
-        
-        # 2. 粗排：向量检索
-        search_results = self.redis_service.search_similar_slices(query_embedding, top_n)
-        print(f"检索到 {len(search_results)} 个相似切片")
-        
-        # 3. 粗排：去重和排序
-        coarse_results = self.coarse_ranker.rank_tools(search_results)
-        candidate_uuids = self.coarse_ranker.get_top_candidates(coarse_results, top_m)
-        print(f"粗排后得到 {len(candidate_uuids)} 个候选工具")
-        
-        # 4. 获取候选工具的完整信息
-        candidate_tools = self.redis_service.get_tools_by_uuids(candidate_uuids)
-        print(f"获取到 {len(candidate_tools)} 个候选工具的完整信息")
-        
-        # 5. 精排
-        rerank_results = self.reranker.rerank_tools(query, candidate_tools)
-        final_tools = self.reranker.get_top_k_tools(rerank_results, top_k)
-        
-        print(f"精排完成，返回 {len(final_tools)} 个工具")
-        
+        with tracer.span("search_tools", search_method=search_method, retrieval_mode=retrieval_mode) as span:
+            logger.debug("开始搜索: %s", query)
+
+            # 0. 查询结果缓存：先按规范化查询精确匹配，再按查询向量的相似度匹配
+            cache = self.result_cache
+            search_filter = search_filter or SearchFilter()
+            nprobe = self._resolve_nprobe(search_method, nprobe)
+            params = (top_n, top_m, top_k, search_method, ef_runtime, nprobe, retrieval_mode, search_filter)
+            self.sync_catalog()
+            generation = cache.generation
+            cached = cache.get(query, params)
+            if cached is not None:
+                span.set_attribute("result_cache", "exact")
+                return cached
+
+            query_embedding = None
+            # 'auto'和'lexical'可能不需要查询向量，不为语义层额外调用向量化接口
+            if cache.semantic_enabled and retrieval_mode in ("vector", "hybrid"):
+                with tracer.span("embed_query"):
+                    query_embedding = self.embedding_service.get_single_embedding(query)
+                cached = cache.get_similar(query_embedding, params)
+                if cached is not None:
+                    span.set_attribute("result_cache", "semantic")
+                    return cached
+            cache.record_miss()
+
+            # 1~4. 词法/向量检索、融合和粗排
+            num_slices, _, coarse_results = self._retrieve(
+                query, top_n, top_m, search_method, ef_runtime, retrieval_mode, span, query_embedding, search_filter,
+                nprobe
+            )
+            candidate_uuids = self.coarse_ranker.get_top_candidates(coarse_results, top_m)
+
+            # 5. 获取候选工具的完整信息
+            with tracer.span("fetch_tools"):
+                candidate_tools = self.redis_service.get_tools_by_uuids(candidate_uuids)
+
+            # 6. 精排
+            with tracer.span("rerank", candidates=len(candidate_tools)):
+                rerank_results = self.reranker.rerank_tools(query, candidate_tools)
+                final_tools = self.reranker.get_top_k_tools(rerank_results, top_k)
+
+            cache.put(query, params, final_tools, generation, query_embedding)
+
+            span.set_attribute("slices_retrieved", num_slices)
+            span.set_attribute("candidates", len(candidate_tools))
+            logger.debug("检索到 %d 个相似切片，粗排后 %d 个候选工具，精排返回 %d 个工具",
+                         num_slices, len(candidate_tools), len(final_tools))
+
         return final_tools
+
+    def _retrieve(self, query: str, top_n: int, top_m: int, search_method: str, ef_runtime: Optional[int],
+                  retrieval_mode: str, span, query_embedding: Optional[List[float]] = None,
+                  search_filter: Optional[SearchFilter] = None,
+                  nprobe: Optional[int] = None) -> Tuple[int, Optional[float], List[CoarseRankResult]]:
+        """
+        切片检索和粗排
+
+        Args:
+            query_embedding: 已计算的查询向量，提供时不再重复向量化
+            search_filter: 过滤条件，词法检索和向量检索都只在满足条件的切片上进行
+            nprobe: IVF检索扫描的簇数量，见search_tools
+
+        Returns:
+            (参与粗排的切片数量, 最相似切片的余弦相似度（未执行向量检索时为None）, 前top_m个粗排结果)
+        """
+        # 1. 词法检索，置信度足够高时不再向量化
+        with tracer.span("lexical_search"):
+            lexical_results, needs_vector = run_lexical_stage(
+                self.get_lexical_index(retrieval_mode), query, top_n, retrieval_mode, self.lexical_confidence,
+                search_filter
+            )
+
+        if not needs_vector:
+            query_embedding = None
+        elif query_embedding is None:
+            # 2. 查询向量化
+            with tracer.span("embed_query"):
+                query_embedding = self.embedding_service.get_single_embedding(query)
+        span.set_attribute("embedded", needs_vector)
+
+        if search_method in ("brute_force", "ivf") and query_embedding is not None:
+            # 3. 粗排：进程内向量检索，只取行号和得分
+            with tracer.span("vector_search"):
+                store, rows, scores = self.redis_service.search_slice_rows(
+                    query_embedding, top_n, search_filter, self._resolve_nprobe(search_method, nprobe)
+                )
+
+            # 4. 粗排：在行号数组上融合并按工具聚合
+            with tracer.span("coarse_rank"):
+                coarse_results, num_slices = self.coarse_ranker.rank_store_hits(
+                    store, rows, scores, lexical_results, top_n, top_m
+                )
+            return num_slices, (float(scores[0]) if len(scores) else None), coarse_results
+
+        vector_results = None
+        if query_embedding is not None:
+            # 3. 粗排：Redis HNSW检索
+            with tracer.span("vector_search"):
+                vector_results = self.redis_service.search_similar_slices(
+                    query_embedding, top_n, method=search_method, ef_runtime=ef_runtime, search_filter=search_filter
+                )
+        search_results = self.coarse_ranker.fuse_results([vector_results, lexical_results], top_n)
+
+        # 4. 粗排：去重和排序
+        with tracer.span("coarse_rank"):
+            coarse_results = self.coarse_ranker.rank_tools(search_results, top_m)
+
+        top_similarity = vector_results[0]['score'] if vector_results else None
+        return len(search_results), top_similarity, coarse_results
+
+    def search_tools_adaptive(self, query: str, top_n: int = 100, top_m: int = 20, top_k: int = 5,
+                              latency_budget_ms: Optional[float] = None, search_method: str = "brute_force",
+                              ef_runtime: Optional[int] = None, retrieval_mode: str = "hybrid",
+                              search_filter: Optional[SearchFilter] = None,
+                              nprobe: Optional[int] = None) -> CascadeResult:
+        """
+        自适应检索：粗排结果足够明确时跳过或缩减精排，并按延迟预算截断精排候选
+
+        精排候选少于top_k时，未精排的候选按粗排顺序补在后面。
+
+        Args:
+            query: 用户查询
+            top_n: 粗排阶段检索的切片数量
+            top_m: 最多精排的候选工具数量
+            top_k: 最终返回的工具数量
+            latency_budget_ms: 本次调用的延迟预算（毫秒），None表示不限
+            search_method: 向量检索方式，见search_tools
+            ef_runtime: HNSW检索时的候选列表大小
+            retrieval_mode: 切片检索方式，见search_tools
+            search_filter: 过滤条件，见search_tools
+            nprobe: IVF检索扫描的簇数量，见search_tools
+
+        Returns:
+            检索结果，包含Top K工具和实际走过的级联路径
+        """
+        start = time.perf_counter()
+        self.sync_catalog()
+        with tracer.span("search_tools_adaptive", retrieval_mode=retrieval_mode) as span:
+            # 决定级联路径：最相似切片的余弦相似度只在执行了向量检索时可用
+            _, top_similarity, coarse_results = self._retrieve(
+                query, top_n, max(top_m, top_k), search_method, ef_runtime, retrieval_mode, span,
+                search_filter=search_filter, nprobe=nprobe
+            )
+            remaining_budget_ms = None
+            if latency_budget_ms is not None:
+                remaining_budget_ms = latency_budget_ms - (time.perf_counter() - start) * 1000.0
+            path, num_rerank, budget_limited = self.cascade_policy.plan(
+                coarse_results, top_m, top_similarity, remaining_budget_ms, self.reranker.pair_latency_ms
+            )
+
+            # 只读取需要精排和返回的候选
+            candidate_uuids = self.coarse_ranker.get_top_candidates(coarse_results, max(num_rerank, top_k))
+            with tracer.span("fetch_tools"):
+                candidate_tools = self.redis_service.get_tools_by_uuids(candidate_uuids)
+
+            final_tools = candidate_tools[:top_k]
+            if path != SKIP_RERANK:
+                with tracer.span("rerank", candidates=num_rerank):
+                    rerank_results = self.reranker.rerank_tools(query, candidate_tools[:num_rerank])
+                    reranked = self.reranker.get_top_k_tools(rerank_results, top_k)
+                final_tools = (reranked + candidate_tools[num_rerank:])[:top_k]
+
+            span.set_attribute("path", path)
+            span.set_attribute("reranked", num_rerank)
+            span.set_attribute("budget_limited", budget_limited)
+
+        return CascadeResult(
+            tools=final_tools,
+            path=path,
+            reranked=num_rerank,
+            budget_limited=budget_limited,
+            elapsed_ms=(time.perf_counter() - start) * 1000.0
+        )
     
+    def search_tools_batch(self, queries: List[str], top_n: int = 100, top_m: int = 20, top_k: int = 5,
+                           retrieval_mode: str = "hybrid", search_filter: Optional[SearchFilter] = None,
+                           nprobe: Optional[int] = None) -> List[List[Tool]]:
+        """
+        批量搜索工具：一组查询按接口批次向量化、与切片矩阵做一次矩阵-矩阵乘法、
+        候选工具的并集只读取一次，所有 (查询, 工具) 对一起分批精排
+
+        Args:
+            queries: 查询列表
+            top_n: 粗排阶段检索的切片数量
+            top_m: 粗排后保留的候选工具数量
+            top_k: 最终返回的工具数量
+            retrieval_mode: 切片检索方式，见search_tools
+            search_filter: 所有查询共用的过滤条件，见search_tools
+            nprobe: IVF检索每个查询扫描的簇数量，None表示精确检索
+
+        Returns:
+            每个查询的Top K工具列表，与输入顺序一致
+        """
+        if not queries:
+            return []
+
+        self.sync_catalog()
+        with tracer.span("search_tools_batch", queries=len(queries), retrieval_mode=retrieval_mode):
+            # 1. 词法检索，只有仍需向量检索的查询参与向量化
+            with tracer.span("lexical_search"):
+                lexical_index = self.get_lexical_index(retrieval_mode)
+                lexical_stages = [
+                    run_lexical_stage(lexical_index, query, top_n, retrieval_mode, self.lexical_confidence, search_filter)
+                    for query in queries
+                ]
+            embed_positions = [i for i, (_, needs_vector) in enumerate(lexical_stages) if needs_vector]
+
+            # 2. 查询向量化：按接口允许的最大批次并发请求，重复的查询只请求一次
+            query_embeddings = {}
+            if embed_positions:
+                with tracer.span("embed_query"):
+                    embeddings = self.embedding_service.embed_matrix([queries[i] for i in embed_positions])
+                query_embeddings = dict(zip(embed_positions, embeddings))
+
+            # 3. 向量检索、融合和粗排
+            candidate_uuid_lists = self.coarse_rank_many(
+                lexical_stages, query_embeddings, top_n, top_m, search_filter, nprobe
+            )
+
+            # 4. 所有查询候选工具的并集只读取一次
+            with tracer.span("fetch_tools"):
+                union_uuids = list(dict.fromkeys(uuid for uuids in candidate_uuid_lists for uuid in uuids))
+                tools_by_uuid = {tool.uuid: tool for tool in self.redis_service.get_tools_by_uuids(union_uuids)}
+                candidate_lists = [
+                    [tools_by_uuid[uuid] for uuid in uuids if uuid in tools_by_uuid]
+                    for uuids in candidate_uuid_lists
+                ]
+
+            # 5. 所有 (查询, 工具) 对一次精排
+            with tracer.span("rerank", candidates=sum(len(tools) for tools in candidate_lists)):
+                rerank_results = self.reranker.rerank_many(queries, candidate_lists)
+
+        return [self.reranker.get_top_k_tools(results, top_k) for results in rerank_results]
+
+    def coarse_rank_many(self, lexical_stages: List[Tuple[Optional[List[Dict[str, Any]]], bool]],
+                         query_embeddings: Dict[int, Any], top_n: int, top_m: int,
+                         search_filter: Optional[SearchFilter] = None,
+                         nprobe: Optional[int] = None) -> List[List[str]]:
+        """
+        一组查询的向量检索、融合和粗排，向量检索通过一次矩阵-矩阵乘法完成
+
+        Args:
+            lexical_stages: 每个查询的run_lexical_stage结果
+            query_embeddings: 查询序号 -> 查询向量，只包含需要向量检索的查询
+            top_n: 粗排阶段检索的切片数量
+            top_m: 粗排后保留的候选工具数量
+            search_filter: 所有查询共用的过滤条件，应与词法检索使用的一致
+            nprobe: IVF检索每个查询扫描的簇数量，None表示精确检索
+
+        Returns:
+            每个查询的候选工具UUID列表，与lexical_stages顺序一致
+        """
+        hits_of = {}
+        if query_embeddings:
+            positions = list(query_embeddings)
+            with tracer.span("vector_search", queries=len(positions)):
+                store, hits = self.redis_service.search_slice_rows_many(
+                    [query_embeddings[i] for i in positions], top_n, search_filter, nprobe
+                )
+            hits_of = dict(zip(positions, hits))
+
+        candidate_lists = []
+        with tracer.span("coarse_rank"):
+            for i, (lexical_results, _) in enumerate(lexical_stages):
+                if i in hits_of:
+                    rows, scores = hits_of[i]
+                    coarse_results, _ = self.coarse_ranker.rank_store_hits(
+                        store, rows, scores, lexical_results, top_n, top_m
+                    )
+                else:
+                    coarse_results = self.coarse_ranker.rank_tools(lexical_results[:top_n], top_m)
+                candidate_lists.append(self.coarse_ranker.get_top_candidates(coarse_results, top_m))
+        return candidate_lists
+
+    def _resolve_nprobe(self, search_method: str, nprobe: Optional[int]) -> Optional[int]:
+        """只有'ivf'检索方式使用nprobe，未指定时取默认值"""
+        if search_method != "ivf":
+            return None
+        return nprobe or self.redis_service.ivf_nprobe
+
+    def invalidate_results(self):
+        """工具库变化后清空查询结果缓存，并记录新的工具库版本号，避免下次版本检查再清空一次"""
+        if self.result_cache.enabled:
+            self.result_cache.sync_version(self.redis_service.read_catalog_version())
+            self.result_cache.clear()
+
+    def get_lexical_index(self, retrieval_mode: str) -> Optional[LexicalIndex]:
+        """纯向量检索不需要词法索引，避免无谓地构建"""
+        return None if retrieval_mode == "vector" else self.lexical_index
+
     def clear_all_data(self):
         """清空所有数据"""
         self.redis_service.clear_all_data()
-        print("所有数据已清空")
+        if self._lexical_index is not None:
+            self._lexical_index.clear()
+        self.invalidate_results()
+        logger.info("所有数据已清空")
     
+    def export_metrics(self) -> str:
+        """导出Prometheus文本格式的指标：各阶段耗时、扫描切片数、候选工具数、接口调用和缓存命中"""
+        return metrics.render_prometheus()
+
     def get_system_stats(self) -> Dict[str, Any]:
         """获取系统统计信息"""
         try:
             index_info = self.redis_service.index.info()
-            return {
+            stats = {
                 "index_name": index_info.get("index_name"),
                 "num_docs": index_info.get("num_docs", 0),
-                "vector_space_size": index_info.get("vector_space_size", 0)
+                "vector_space_size": index_info.get("vector_space_size", 0),
+                "embedding_cache": self.embedding_service.get_cache_stats(),
+                "tool_cache": self.redis_service.tool_cache.stats(),
+                "result_cache": self.result_cache.stats()
             }
+            store = self.redis_service.slice_store
+            if store is not None:
+                stats["slice_store"] = {
+                    "slices": len(store),
+                    "precision": store.precision,
+                    "memory_bytes": store.nbytes,
+                    "namespaces": {namespace: len(store.partition(namespace)) for namespace in store.namespaces},
+                    "ivf_lists": {namespace: store.partition(namespace).ivf_lists for namespace in store.namespaces},
+                    "ivf_drift": {namespace: store.partition(namespace).ivf_drift for namespace in store.namespaces}
+                }
+            return stats
         except:
             return {"error": "无法获取索引信息"}
 
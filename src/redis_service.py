@@ -2,24 +2,56 @@
 Redis存储服务
 """
 import os
+import bisect
 import json
-from typing import List, Dict, Any, Optional
+import logging
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple, Union, Iterable, Set
+import numpy as np
 import redis
-from redisvl.schema import IndexSchema
-from redisvl.index import SearchIndex
-from redisvl.query import VectorQuery
 from dotenv import load_dotenv
 
-from .models import Tool, ToolSlice
+from .models import Tool, ToolSlice, SliceBatch, SearchFilter, DEFAULT_NAMESPACE
+from .slice_store import SliceStore, PartitionedSliceStore
+from .slice_snapshot import SliceSnapshot
+from .clients import get_connection_pool
+from .tool_cache import ToolCache, CATALOG_VERSION_KEY
+from .telemetry import SLICES_SCANNED, CANDIDATES_FETCHED
 
 # 加载环境变量
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# 最多记录的本进程写入版本号；长时间没有版本检查时（例如只做索引的进程）清空，派生数据在下次检查时保守地重建
+_MAX_OWN_CATALOG_VERSIONS = 100000
+
 
 class RedisService:
     """Redis存储和检索服务"""
     
-    def __init__(self):
+    def __init__(self, batch_size: Optional[int] = None,
+                 connection_pool: Optional[redis.ConnectionPool] = None,
+                 precision: Optional[str] = None, rescore_factor: Optional[int] = None,
+                 snapshot_dir: Optional[str] = None, tool_cache: Optional[ToolCache] = None,
+                 ivf_lists: Optional[int] = None, ivf_nprobe: Optional[int] = None,
+                 ivf_max_drift: Optional[float] = None):
+        """
+        初始化Redis服务
+
+        Args:
+            batch_size: 批量读写时每个pipeline/MGET的命令数量，默认读取环境变量REDIS_BATCH_SIZE
+            connection_pool: 连接池，默认使用进程内共享的连接池
+            precision: 进程内切片向量的存储精度（float32/float16/int8），默认读取环境变量SLICE_STORE_PRECISION
+            rescore_factor: 量化检索的候选倍数，默认读取环境变量SLICE_RESCORE_FACTOR
+            snapshot_dir: 切片向量快照目录，默认读取环境变量SLICE_SNAPSHOT_DIR，为空时不使用快照
+            tool_cache: 已解析工具缓存，默认按环境变量TOOL_CACHE_SIZE和TOOL_CACHE_CHECK_SECONDS创建
+            ivf_lists: 每个命名空间分区IVF索引的簇数量，0表示不使用IVF，默认读取环境变量SLICE_IVF_LISTS
+            ivf_nprobe: IVF检索默认扫描的簇数量，默认读取环境变量SLICE_IVF_NPROBE
+            ivf_max_drift: 训练以来变化的切片占比超过该值时，在重新加载或写快照时重新训练IVF，
+                默认读取环境变量SLICE_IVF_MAX_DRIFT（0.2）
+        """
         # Redis连接配置
         self.redis_host = os.getenv("REDIS_HOST")
         self.redis_port = int(os.getenv("REDIS_PORT", 6379))
@@ -31,20 +63,59 @@ class RedisService:
         else:
             self.redis_url = f"redis://{self.redis_host}:{self.redis_port}"
         
-        # 初始化Redis客户端
-        self.redis_client = redis.Redis(
-            host=self.redis_host,
-            port=self.redis_port,
-            password=self.redis_password,
-            decode_responses=True
-        )
+        # 批量读写的分块大小
+        self.batch_size = batch_size or int(os.getenv("REDIS_BATCH_SIZE", 500))
+
+        # 初始化Redis客户端，连接在首次执行命令时才建立
+        # 切片向量以float32字节存储，因此连接不做解码，文本字段在读取处自行解码
+        self.connection_pool = connection_pool or get_connection_pool()
+        self.redis_client = redis.Redis(connection_pool=self.connection_pool)
         
-        # 初始化向量索引
-        self.index = None
-        self._init_vector_index()
+        # 向量索引在首次使用时初始化
+        self.vector_dims = 1024
+        self._index = None
+
+        # 进程内切片向量存储，按命名空间分区，首次检索时从Redis加载
+        self.precision = precision or os.getenv("SLICE_STORE_PRECISION", "float32")
+        self.rescore_factor = rescore_factor or int(os.getenv("SLICE_RESCORE_FACTOR", 4))
+        self.slice_store: Optional[PartitionedSliceStore] = None
+
+        # IVF倒排索引：从Redis加载切片后训练，写入快照；检索方式为'ivf'时按nprobe只扫描部分簇
+        self.ivf_lists = ivf_lists if ivf_lists is not None else int(os.getenv("SLICE_IVF_LISTS", 0))
+        self.ivf_nprobe = ivf_nprobe or int(os.getenv("SLICE_IVF_NPROBE", 8))
+        self.ivf_max_drift = ivf_max_drift if ivf_max_drift is not None else float(os.getenv("SLICE_IVF_MAX_DRIFT", 0.2))
+
+        # 切片向量快照：工作进程直接映射快照文件，无需从Redis逐条加载
+        snapshot_dir = snapshot_dir or os.getenv("SLICE_SNAPSHOT_DIR")
+        self.snapshot = SliceSnapshot(snapshot_dir) if snapshot_dir else None
+        self.embedding_model = os.getenv("EMBEDDING_MODEL")
+
+        # 已解析工具缓存，通过工具库版本号与其他进程的写入保持一致
+        self.tool_cache = tool_cache or ToolCache(
+            max_entries=int(os.getenv("TOOL_CACHE_SIZE", 10000)),
+            version_check_interval=float(os.getenv("TOOL_CACHE_CHECK_SECONDS", 1.0))
+        )
+
+        # 切片向量存储等进程内派生数据按同样的间隔检查工具库版本号（见catalog_changed）；
+        # 本进程写入时INCR得到的版本号已同步应用到这些数据，检查时不算作变化
+        self._own_catalog_versions: List[int] = []  # 升序
+        self._catalog_lock = threading.Lock()
+        # 本进程写入同步到进程内存储与加载、替换存储互斥：加载期间完成的写入在替换后应用到新存储，不会丢失
+        self._store_lock = threading.RLock()
+        self._last_catalog_check = float("-inf")
     
+    @property
+    def index(self):
+        """redisvl向量索引，首次访问时创建并检查索引是否存在"""
+        if self._index is None:
+            self._init_vector_index()
+        return self._index
+
     def _init_vector_index(self):
         """初始化向量索引"""
+        from redisvl.schema import IndexSchema
+        from redisvl.index import SearchIndex
+
         schema = IndexSchema.from_dict({
             "index": {
                 "name": "tool_slices_index",
@@ -57,7 +128,7 @@ class RedisService:
                     "attrs": {
                         "algorithm": "hnsw",
                         "datatype": "float32",
-                        "dims": 1024,
+                        "dims": self.vector_dims,
                         "distance_metric": "cosine",
                         "m_hnsw": 16,
                         "ef_construction": 200
@@ -74,17 +145,76 @@ class RedisService:
                 {
                     "name": "slice_type",
                     "type": "text"
+                },
+                {
+                    "name": "namespace",
+                    "type": "tag"
+                },
+                {
+                    "name": "tags",
+                    "type": "tag",
+                    "attrs": {"separator": ","}
                 }
             ]
         })
         
-        self.index = SearchIndex(schema, redis_url=self.redis_url)
+        # 与普通读写共用同一个连接池
+        index = SearchIndex(schema, redis_client=self.redis_client)
         
         # 检查索引是否存在，如果不存在则创建
-        try:
-            self.index.info()
-        except:
-            self.index.create()
+        if not index.exists():
+            index.create()
+        else:
+            # 升级前创建的索引没有过滤字段，旧切片也没有namespace字段：补写后按新schema重建索引（保留数据）
+            missing = {"namespace", "tags"} - self._indexed_fields(index.info())
+            if missing:
+                backfilled = self._backfill_slice_namespaces()
+                logger.warning("向量索引缺少字段 %s，已为 %d 个切片补写默认命名空间，重建索引",
+                               sorted(missing), backfilled)
+                index.create(overwrite=True, drop=False)
+        self._index = index
+
+    @staticmethod
+    def _indexed_fields(info: Dict[str, Any]) -> Set[str]:
+        """
+        从FT.INFO的结果中取出已索引的字段名
+
+        Args:
+            info: SearchIndex.info()的结果
+
+        Returns:
+            字段名集合
+        """
+        fields = set()
+        for attribute in info.get("attributes", []):
+            properties = dict(zip(attribute[::2], attribute[1::2]))
+            name = properties.get("attribute") or properties.get("identifier")
+            if name is not None:
+                fields.add(name.decode() if isinstance(name, bytes) else str(name))
+        return fields
+
+    def _backfill_slice_namespaces(self) -> int:
+        """
+        为没有namespace字段的切片写入默认命名空间，与进程内存储加载时的处理一致
+
+        Returns:
+            补写的切片数量
+        """
+        keys = list(self.redis_client.scan_iter(match="tool_slices:*", count=self.batch_size))
+        backfilled = 0
+        for start in range(0, len(keys), self.batch_size):
+            batch_keys = keys[start:start + self.batch_size]
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in batch_keys:
+                pipe.hexists(key, "namespace")
+            missing = [key for key, exists in zip(batch_keys, pipe.execute()) if not exists]
+            if missing:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for key in missing:
+                    pipe.hset(key, "namespace", DEFAULT_NAMESPACE)
+                pipe.execute()
+                backfilled += len(missing)
+        return backfilled
     
     def store_tool(self, tool: Tool):
         """
@@ -93,8 +223,24 @@ class RedisService:
         Args:
             tool: 工具对象
         """
-        key = f"tool:{tool.uuid}"
-        self.redis_client.set(key, tool.to_json())
+        self.store_tools([tool])
+
+    def store_tools(self, tools: List[Tool]):
+        """
+        批量存储完整工具信息，按batch_size分块通过pipeline写入
+
+        Args:
+            tools: 工具列表
+        """
+        for start in range(0, len(tools), self.batch_size):
+            batch_tools = tools[start:start + self.batch_size]
+            pipe = self.redis_client.pipeline(transaction=False)
+            for tool in batch_tools:
+                pipe.set(f"tool:{tool.uuid}", tool.to_json())
+            # 与写入同一次往返递增工具库版本号，其他进程据此失效缓存
+            pipe.incr(CATALOG_VERSION_KEY)
+            version = pipe.execute()[-1]
+            self._record_catalog_write(version, (tool.uuid for tool in batch_tools))
     
     def get_tool(self, uuid: str) -> Optional[Tool]:
         """
@@ -106,113 +252,685 @@ class RedisService:
         Returns:
             工具对象或None
         """
-        key = f"tool:{uuid}"
-        tool_json = self.redis_client.get(key)
-        if tool_json:
-            tool_data = json.loads(tool_json)
-            return Tool.from_dict(tool_data, uuid)
-        return None
+        tools = self.get_tools_by_uuids([uuid])
+        return tools[0] if tools else None
     
-    def store_tool_slices(self, slices: List[ToolSlice]):
+    def store_tool_slices(self, slices: Union[SliceBatch, List[ToolSlice]]):
         """
         存储工具切片到向量数据库
 
         Args:
-            slices: 切片列表（已包含向量）
+            slices: 切片批次（已包含向量），也接受ToolSlice列表
         """
-        # 逐个存储切片
-        for i, slice_obj in enumerate(slices):
-            # 生成唯一的key
-            key = f"tool_slices:{i}"
+        if not isinstance(slices, SliceBatch):
+            slices = SliceBatch.from_slices(slices, self.vector_dims)
+        keys = slices.keys
 
-            # 存储切片数据：只需要向量、UUID和切片类型
-            slice_data = {
-                "embedding": json.dumps(slice_obj.embedding),  # 向量序列化为JSON字符串
-                "uuid": slice_obj.uuid
-            }
+        # 按batch_size分块，每块一次pipeline往返
+        for start in range(0, len(slices), self.batch_size):
+            pipe = self.redis_client.pipeline(transaction=False)
+            for i in range(start, min(start + self.batch_size, len(slices))):
+                # key由工具UUID和切片位置决定，重复写入同一切片时原地覆盖
+                # 存储切片数据：向量、UUID、位置，以及可选的切片类型和文本
+                slice_data = {
+                    "embedding": slices.embedding_bytes(i),  # 矩阵行的float32字节视图，不复制；HNSW索引可直接读取
+                    "uuid": slices.uuids[i],
+                    "position": slices.positions[i],
+                    # 命名空间和标签写入索引的TAG字段，HNSW检索时作为预过滤条件
+                    "namespace": slices.namespaces[i],
+                    "tags": ",".join(slices.tags[i])
+                }
 
-            # 可选：存储切片类型
-            if slice_obj.slice_type:
-                slice_data["slice_type"] = slice_obj.slice_type
+                # 可选：存储切片类型
+                if slices.slice_types[i]:
+                    slice_data["slice_type"] = slices.slice_types[i]
 
-            self.redis_client.hset(key, mapping=slice_data)
-    
-    def search_similar_slices(self, query_embedding: List[float], num_results: int = 100) -> List[Dict[str, Any]]:
+                # 切片文本写入索引schema中的content文本字段
+                if slices.contents[i]:
+                    slice_data["content"] = slices.contents[i]
+
+                pipe.hset(keys[i], mapping=slice_data)
+
+                # 记录切片内容哈希，供增量更新时比对
+                if slices.content_hashes[i]:
+                    pipe.hset(f"slice_hashes:{slices.uuids[i]}", slices.positions[i], slices.content_hashes[i])
+            if start + self.batch_size >= len(slices):
+                # 最后一块与写入同一次往返递增工具库版本号，其他进程据此重新加载切片
+                pipe.incr(CATALOG_VERSION_KEY)
+            results = pipe.execute()
+
+        if len(slices) == 0:
+            return
+        # 同步更新进程内向量存储（未加载时由首次检索统一加载）
+        with self._store_lock:
+            if self.slice_store is not None:
+                self.slice_store.upsert(keys, slices.uuids, slices.slice_types, slices.embeddings,
+                                        slices.namespaces, slices.tags)
+            self._record_catalog_write(results[-1])
+
+    def get_slice_hashes(self, uuid: str) -> Dict[int, str]:
         """
-        搜索相似的切片 - 简化版本，使用余弦相似度
+        获取工具已存储切片的内容哈希
+
+        Args:
+            uuid: 工具UUID
+
+        Returns:
+            切片位置到内容哈希的映射
+        """
+        return self.get_slice_hashes_many([uuid])[uuid]
+
+    def get_slice_hashes_many(self, uuids: List[str]) -> Dict[str, Dict[int, str]]:
+        """
+        批量获取多个工具已存储切片的内容哈希
+
+        Args:
+            uuids: 工具UUID列表
+
+        Returns:
+            工具UUID到 {切片位置: 内容哈希} 的映射
+        """
+        result = {}
+        for start in range(0, len(uuids), self.batch_size):
+            batch_uuids = uuids[start:start + self.batch_size]
+            pipe = self.redis_client.pipeline(transaction=False)
+            for uuid in batch_uuids:
+                pipe.hgetall(f"slice_hashes:{uuid}")
+            for uuid, hashes in zip(batch_uuids, pipe.execute()):
+                result[uuid] = {int(position): content_hash.decode() for position, content_hash in hashes.items()}
+        return result
+
+    def delete_tool_slices(self, uuid: str, positions: List[int]):
+        """
+        删除工具指定位置的切片
+
+        Args:
+            uuid: 工具UUID
+            positions: 切片位置列表
+        """
+        self.delete_slices({uuid: positions})
+
+    def delete_slices(self, positions_by_uuid: Dict[str, List[int]]):
+        """
+        批量删除多个工具指定位置的切片
+
+        Args:
+            positions_by_uuid: 工具UUID到切片位置列表的映射
+        """
+        keys = []
+        pipe = self.redis_client.pipeline(transaction=False)
+        for uuid, positions in positions_by_uuid.items():
+            if not positions:
+                continue
+            uuid_keys = [f"tool_slices:{uuid}:{position}" for position in positions]
+            pipe.delete(*uuid_keys)
+            pipe.hdel(f"slice_hashes:{uuid}", *positions)
+            keys.extend(uuid_keys)
+
+            if len(pipe) >= self.batch_size:
+                pipe.execute()
+                pipe = self.redis_client.pipeline(transaction=False)
+        if not keys:
+            return
+        pipe.incr(CATALOG_VERSION_KEY)
+        version = pipe.execute()[-1]
+
+        with self._store_lock:
+            if self.slice_store is not None:
+                self.slice_store.remove(keys)
+            self._record_catalog_write(version)
+
+    def tool_exists(self, uuid: str) -> bool:
+        """判断工具是否已存储"""
+        return bool(self.redis_client.exists(f"tool:{uuid}"))
+
+    def delete_tool(self, uuid: str) -> bool:
+        """
+        删除工具及其全部切片
+
+        Args:
+            uuid: 工具UUID
+
+        Returns:
+            工具是否存在
+        """
+        return self.delete_tools([uuid]) == 1
+
+    def delete_tools(self, uuids: List[str]) -> int:
+        """
+        批量删除工具及其全部切片
+
+        Args:
+            uuids: 工具UUID列表
+
+        Returns:
+            实际删除的工具数量
+        """
+        hashes_by_uuid = self.get_slice_hashes_many(uuids)
+        self.delete_slices({uuid: list(hashes) for uuid, hashes in hashes_by_uuid.items()})
+
+        deleted = 0
+        for start in range(0, len(uuids), self.batch_size):
+            batch_uuids = uuids[start:start + self.batch_size]
+            pipe = self.redis_client.pipeline(transaction=False)
+            for uuid in batch_uuids:
+                pipe.delete(f"slice_hashes:{uuid}")
+                pipe.delete(f"tool:{uuid}")
+            pipe.incr(CATALOG_VERSION_KEY)
+            # 结果依次为 slice_hashes 删除数、tool 删除数，最后是新版本号
+            results = pipe.execute()
+            deleted += sum(results[1:-1:2])
+            self._record_catalog_write(results[-1], batch_uuids)
+        return deleted
+
+    def _load_slice_store(self, previous: Optional[PartitionedSliceStore] = None) -> PartitionedSliceStore:
+        """
+        从Redis加载全部切片，按命名空间分区构建进程内向量存储
+
+        沿用previous各分区的IVF簇中心，只为尚未训练或漂移超过ivf_max_drift的分区训练。
+
+        Args:
+            previous: 之前的存储，None表示首次加载
+
+        Returns:
+            切片向量存储，catalog_version为开始读取前的工具库版本号
+        """
+        version = self.read_catalog_version()
+        store = PartitionedSliceStore(
+            dimensions=self.vector_dims,
+            precision=self.precision,
+            rescore_factor=self.rescore_factor,
+            vector_loader=self.get_slice_embeddings
+        )
+        keys = list(self.redis_client.scan_iter(match="tool_slices:*", count=self.batch_size))
+        vector_bytes = self.vector_dims * np.dtype(np.float32).itemsize
+
+        for start in range(0, len(keys), self.batch_size):
+            batch_keys = keys[start:start + self.batch_size]
+
+            # 只读取需要的字段，不读取切片文本
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in batch_keys:
+                pipe.hmget(key, "embedding", "uuid", "slice_type", "namespace", "tags")
+            batch_data = pipe.execute()
+
+            valid_keys, uuids, slice_types, embeddings, namespaces, tags = [], [], [], [], [], []
+            for key, (embedding, uuid, slice_type, namespace, tag_data) in zip(batch_keys, batch_data):
+                # 跳过缺少字段或向量长度不符的切片
+                if embedding is None or len(embedding) != vector_bytes or uuid is None:
+                    continue
+                valid_keys.append(key.decode())
+                uuids.append(uuid.decode())
+                slice_types.append(slice_type.decode() if slice_type else None)
+                embeddings.append(np.frombuffer(embedding, dtype=np.float32))
+                # 没有命名空间字段的切片属于默认命名空间
+                namespaces.append(namespace.decode() if namespace else DEFAULT_NAMESPACE)
+                tags.append([tag for tag in tag_data.decode().split(",") if tag] if tag_data else [])
+
+            store.upsert(valid_keys, uuids, slice_types, np.asarray(embeddings, dtype=np.float32), namespaces, tags)
+
+        if self.ivf_lists > 0:
+            if previous is not None:
+                store.adopt_ivf(previous)
+            store.train_ivf(self.ivf_lists, max_drift=self.ivf_max_drift)
+        store.catalog_version = version
+        return store
+
+    def get_slice_embeddings(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        批量读取切片的float32原始向量
+
+        Args:
+            keys: 切片key列表
+
+        Returns:
+            向量列表，与输入顺序一致，不存在的切片为None
+        """
+        embeddings = []
+        for start in range(0, len(keys), self.batch_size):
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in keys[start:start + self.batch_size]:
+                pipe.hget(key, "embedding")
+            embeddings.extend(
+                np.frombuffer(value, dtype=np.float32) if value else None
+                for value in pipe.execute()
+            )
+        return embeddings
+
+    def _open_snapshot(self, version: Optional[str] = None) -> Optional[PartitionedSliceStore]:
+        """以内存映射方式打开切片快照，未配置或不可用时返回None"""
+        if self.snapshot is None:
+            return None
+        return self.snapshot.load(
+            self.embedding_model,
+            self.vector_dims,
+            self.precision,
+            rescore_factor=self.rescore_factor,
+            vector_loader=self.get_slice_embeddings,
+            version=version
+        )
+
+    def get_slice_store(self) -> PartitionedSliceStore:
+        """获取进程内切片向量存储，首次调用时优先映射快照，没有可用快照时从Redis加载"""
+        store = self.slice_store
+        if store is None:
+            with self._store_lock:
+                if self.slice_store is None:
+                    self.slice_store = self._open_snapshot() or self._load_slice_store()
+                store = self.slice_store
+        return store
+
+    def write_slice_snapshot(self, rebuild: bool = False) -> Optional[str]:
+        """
+        把进程内的切片向量存储写成新的快照版本
+
+        本进程的写入已同步应用到进程内存储，默认直接导出，不重新读取Redis。
+        快照记录存储对应的工具库版本号，其他进程据此判断是否切换。
+
+        Args:
+            rebuild: 为True时先以Redis中的切片为准重建存储（例如其他进程也写入过切片），并在本进程切换到新存储
+
+        Returns:
+            新快照版本号，未配置快照目录时返回None
+        """
+        if self.snapshot is None:
+            return None
+        with self._store_lock:
+            # 未加载过存储时写入没有同步到进程内，同样以Redis为准加载
+            if rebuild or self.slice_store is None:
+                self.slice_store = self._load_slice_store(previous=self.slice_store)
+            self.retrain_ivf(force=False)
+            store = self.slice_store
+            # 两次检查之间只有本进程的写入时，存储已包含到当前版本为止的全部切片
+            catalog_version = self.read_catalog_version()
+            if not self.catalog_changed(store.catalog_version, catalog_version):
+                store.catalog_version = catalog_version
+            version = self.snapshot.write(store, self.embedding_model)
+        store.snapshot_version = version
+        return version
+
+    def refresh_slice_store(self) -> bool:
+        """
+        检查是否有新的快照版本，有则映射新快照并原子替换进程内存储
+
+        Returns:
+            是否切换到了新版本
+        """
+        if self.snapshot is None:
+            return False
+        version = self.snapshot.current_version()
+        current = self.slice_store
+        if version is None or (current is not None and current.snapshot_version == version):
+            return False
+        # 本进程已从Redis加载到不旧于快照的工具库版本时不切换，避免回退到较旧的数据
+        if current is not None and current.catalog_version is not None:
+            try:
+                snapshot_catalog = self.snapshot.read_manifest(version).get("catalog_version")
+            except FileNotFoundError:
+                return False
+            if snapshot_catalog is None or snapshot_catalog <= current.catalog_version:
+                return False
+
+        store = self._open_snapshot(version)
+        if store is None:
+            return False
+        with self._store_lock:
+            # 快照不包含本进程之后的写入时不切换，这些写入只应用在了当前存储上
+            if store.catalog_version is not None:
+                with self._catalog_lock:
+                    if self._own_catalog_versions and self._own_catalog_versions[-1] > store.catalog_version:
+                        return False
+            # 单次属性赋值，正在进行的检索继续使用旧存储
+            self.slice_store = store
+        logger.info("切换到切片快照 %s", version)
+        return True
+
+    def retrain_ivf(self, force: bool = True) -> int:
+        """
+        在存储的副本上训练IVF，完成后替换进程内存储，正在进行的检索不受行号变化影响
+
+        Args:
+            force: 为True时重新训练所有分区；否则只训练尚未训练或漂移超过ivf_max_drift的分区
+
+        Returns:
+            训练了的分区数量
+        """
+        if self.ivf_lists <= 0:
+            return 0
+        max_drift = None if force else self.ivf_max_drift
+        with self._store_lock:
+            store = self.get_slice_store()
+            if not store.stale_ivf_partitions(self.ivf_lists, max_drift):
+                return 0
+            trained_store = store.copy()
+            trained = trained_store.train_ivf(self.ivf_lists, max_drift=max_drift)
+            self.slice_store = trained_store
+        logger.info("重新训练了 %d 个分区的IVF索引", trained)
+        return trained
+
+    def sync_slice_store(self, version: int) -> bool:
+        """
+        其他进程修改了工具库时从Redis重新加载切片存储，否则把存储记录的版本号前进到version
+
+        Args:
+            version: 刚读取的工具库版本号，见read_catalog_version
+
+        Returns:
+            是否重新加载
+        """
+        with self._store_lock:
+            store = self.slice_store
+            if store is None:
+                return False
+            if not self.catalog_changed(store.catalog_version, version):
+                store.catalog_version = version
+                return False
+            # 单次属性赋值，正在进行的检索继续使用旧存储
+            self.slice_store = self._load_slice_store(previous=store)
+        logger.info("工具库版本 %s -> %d，重新加载切片存储", store.catalog_version, version)
+        return True
+
+    def search_similar_slices(self, query_embedding: List[float], num_results: int = 100,
+                              method: str = "brute_force", ef_runtime: Optional[int] = None,
+                              search_filter: Optional[SearchFilter] = None,
+                              nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        搜索相似的切片
 
         Args:
             query_embedding: 查询向量
             num_results: 返回结果数量
+            method: 检索方式，'brute_force'为进程内精确检索，'ivf'为进程内IVF近似检索（分区未训练IVF时为精确检索），
+                'hnsw'为Redis服务端近似检索
+            ef_runtime: HNSW检索时的候选列表大小，越大召回越高、延迟越大，默认使用索引配置
+            search_filter: 过滤条件，默认只检索默认命名空间；在计算相似度之前生效
+            nprobe: IVF检索扫描的簇数量，越大召回越高、延迟越大，默认为ivf_nprobe
 
         Returns:
             搜索结果列表
         """
-        import numpy as np
+        search_filter = search_filter or SearchFilter()
+        if method in ("brute_force", "ivf"):
+            nprobe = (nprobe or self.ivf_nprobe) if method == "ivf" else None
+            store = self.get_slice_store().partition(search_filter.namespace)
+            SLICES_SCANNED.inc(self._scanned(store, nprobe), method=method)
+            return store.search(query_embedding, num_results, search_filter, nprobe)
+        if method == "hnsw":
+            return self._search_hnsw(query_embedding, num_results, ef_runtime, search_filter)
+        raise ValueError(f"不支持的检索方式: {method}")
 
-        # 获取所有切片
-        keys = self.redis_client.keys("tool_slices:*")
-        results = []
+    @staticmethod
+    def _scanned(store: SliceStore, nprobe: Optional[int]) -> int:
+        """估算一次检索计算相似度的切片数：IVF按探查的簇占比折算"""
+        if nprobe is None or store.ivf_lists == 0:
+            return len(store)
+        return len(store) * min(nprobe, store.ivf_lists) // store.ivf_lists
 
-        query_vec = np.array(query_embedding)
+    def search_slice_rows(self, query_embedding: List[float], num_results: int = 100,
+                          search_filter: Optional[SearchFilter] = None,
+                          nprobe: Optional[int] = None) -> Tuple[SliceStore, np.ndarray, np.ndarray]:
+        """
+        进程内检索，只返回行号和得分，供粗排直接在数组上聚合
 
-        for key in keys:
-            slice_data = self.redis_client.hgetall(key)
-            if slice_data:
-                try:
-                    # 反序列化向量
-                    embedding = json.loads(slice_data['embedding'])
-                    slice_vec = np.array(embedding)
+        Args:
+            query_embedding: 查询向量
+            num_results: 返回结果数量
+            search_filter: 过滤条件，默认只检索默认命名空间
+            nprobe: IVF检索扫描的簇数量，None表示精确检索
 
-                    # 计算余弦相似度
-                    cosine_sim = np.dot(query_vec, slice_vec) / (np.linalg.norm(query_vec) * np.linalg.norm(slice_vec))
+        Returns:
+            (命名空间分区, 行号数组, 得分数组)。行号只对同时返回的分区有效，存储可能随后被快照切换替换
+        """
+        search_filter = search_filter or SearchFilter()
+        store = self.get_slice_store().partition(search_filter.namespace)
+        SLICES_SCANNED.inc(self._scanned(store, nprobe), method="brute_force" if nprobe is None else "ivf")
+        rows, scores = store.search_rows(query_embedding, num_results, search_filter, nprobe)
+        return store, rows, scores
 
-                    result = {
-                        'uuid': slice_data['uuid'],
-                        'score': float(cosine_sim)
-                    }
+    def search_slice_rows_many(self, query_embeddings: List[List[float]], num_results: int = 100,
+                               search_filter: Optional[SearchFilter] = None, nprobe: Optional[int] = None
+                               ) -> Tuple[SliceStore, List[Tuple[np.ndarray, np.ndarray]]]:
+        """
+        进程内批量检索，多个查询与切片矩阵做一次矩阵-矩阵乘法
 
-                    # 可选：添加切片类型
-                    if 'slice_type' in slice_data:
-                        result['slice_type'] = slice_data['slice_type']
+        Args:
+            query_embeddings: 查询向量列表
+            num_results: 每个查询返回的结果数量
+            search_filter: 所有查询共用的过滤条件，默认只检索默认命名空间
+            nprobe: IVF检索每个查询扫描的簇数量，None表示精确检索
 
-                    results.append(result)
-                except:
-                    continue
+        Returns:
+            (命名空间分区, 每个查询的 (行号数组, 得分数组))，行号只对同时返回的分区有效
+        """
+        search_filter = search_filter or SearchFilter()
+        store = self.get_slice_store().partition(search_filter.namespace)
+        SLICES_SCANNED.inc(self._scanned(store, nprobe) * len(query_embeddings),
+                           method="brute_force" if nprobe is None else "ivf")
+        return store, store.search_rows_many(query_embeddings, num_results, search_filter, nprobe)
+
+    @staticmethod
+    def _hnsw_filter(search_filter: SearchFilter):
+        """把过滤条件转换为redisvl过滤表达式，RediSearch在KNN之前应用"""
+        from redisvl.query.filter import Tag, Text
+
+        expression = Tag("namespace") == search_filter.namespace
+        if search_filter.tags is not None:
+            # TAG字段与列表比较表示带有其中任一标签
+            expression = expression & (Tag("tags") == list(search_filter.tags))
+        if search_filter.slice_types is not None:
+            type_expression = None
+            for slice_type in search_filter.slice_types:
+                condition = Text("slice_type") == slice_type
+                type_expression = condition if type_expression is None else type_expression | condition
+            if type_expression is not None:
+                expression = expression & type_expression
+        return expression
+
+    def _search_hnsw(self, query_embedding: List[float], num_results: int, ef_runtime: Optional[int],
+                     search_filter: SearchFilter) -> List[Dict[str, Any]]:
+        """
+        通过Redis HNSW索引进行KNN检索，只返回UUID、切片类型和距离
 
-        # 按相似度得分降序排序
-        results.sort(key=lambda x: x['score'], reverse=True)
+        Args:
+            query_embedding: 查询向量
+            num_results: 返回结果数量
+            ef_runtime: HNSW检索时的候选列表大小
+            search_filter: 过滤条件
+
+        Returns:
+            搜索结果列表
+        """
+        from redisvl.query import VectorQuery
 
-        return results[:num_results]
+        query = VectorQuery(
+            vector=np.asarray(query_embedding, dtype=np.float32).tobytes(),
+            vector_field_name="embedding",
+            return_fields=["uuid", "slice_type"],
+            filter_expression=self._hnsw_filter(search_filter),
+            num_results=num_results,
+            ef_runtime=ef_runtime
+        )
+
+        results = []
+        for doc in self.index.query(query):
+            # 余弦距离 = 1 - 余弦相似度
+            distance = float(doc['vector_distance'])
+            result = {
+                'uuid': doc['uuid'],
+                'score': 1.0 - distance,
+                'distance': distance,
+                'key': doc['id']
+            }
+            if doc.get('slice_type'):
+                result['slice_type'] = doc['slice_type']
+            results.append(result)
+
+        return results
     
+    def get_catalog_version(self) -> Optional[bytes]:
+        """读取工具库版本号，每次写入或删除工具、切片时递增，尚未写入过时为None"""
+        return self.redis_client.get(CATALOG_VERSION_KEY)
+
+    def needs_catalog_check(self) -> bool:
+        """距上次读取工具库版本号是否已超过工具缓存的版本检查间隔（TOOL_CACHE_CHECK_SECONDS）"""
+        interval = self.tool_cache.version_check_interval
+        return interval is not None and time.monotonic() - self._last_catalog_check >= interval
+
+    def read_catalog_version(self) -> int:
+        """
+        读取工具库版本号并记录检查时间
+
+        Returns:
+            版本号，尚未写入过时为0
+        """
+        self._last_catalog_check = time.monotonic()
+        version = self.get_catalog_version()
+        return int(version) if version is not None else 0
+
+    def _record_catalog_write(self, version: int, uuids: Iterable[str] = ()):
+        """
+        记录本进程写入后INCR得到的工具库版本号，并失效工具缓存中对应的条目
+
+        调用方应先把写入应用到进程内的切片存储，再调用本方法。
+        """
+        self.tool_cache.advance_version(version, uuids)
+        with self._catalog_lock:
+            if len(self._own_catalog_versions) >= _MAX_OWN_CATALOG_VERSIONS:
+                self._own_catalog_versions.clear()
+            version = int(version)
+            position = bisect.bisect_left(self._own_catalog_versions, version)
+            if position == len(self._own_catalog_versions) or self._own_catalog_versions[position] != version:
+                self._own_catalog_versions.insert(position, version)
+
+    def catalog_changed(self, known: Optional[int], version: int) -> bool:
+        """
+        判断基于工具库版本known构建的进程内数据到version时是否过期
+
+        两个版本之间只有本进程的写入时不算过期，这些写入已同步应用到进程内数据。
+        版本号由INCR产生、互不重复，只需比较区间内本进程写入的数量与区间长度，耗时与写入次数无关。
+
+        Args:
+            known: 构建数据前读取的版本号，None表示未知（例如旧格式的快照）
+            version: 当前版本号
+
+        Returns:
+            是否有其他进程的写入
+        """
+        if known is None or version < known:
+            return True
+        with self._catalog_lock:
+            own = self._own_catalog_versions
+            own_writes = bisect.bisect_right(own, version) - bisect.bisect_right(own, known)
+        return own_writes < version - known
+
+    def forget_catalog_writes(self, version: int):
+        """进程内数据都已同步到version后，丢弃不再需要的本进程写入版本号"""
+        with self._catalog_lock:
+            del self._own_catalog_versions[:bisect.bisect_right(self._own_catalog_versions, version)]
+
     def get_tools_by_uuids(self, uuids: List[str]) -> List[Tool]:
         """
         根据UUID列表批量获取工具
+
+        先查进程内工具缓存，只有未命中的工具按batch_size分块使用MGET读取并解析。
         
         Args:
             uuids: UUID列表
             
         Returns:
-            工具列表
+            工具列表，顺序与输入一致，不存在的工具被跳过
+        """
+        cache = self.tool_cache
+        if cache.needs_version_check():
+            cache.sync_version(self.get_catalog_version())
+        generation = cache.generation
+        found = cache.get_many(uuids)
+
+        missing = list(dict.fromkeys(uuid for uuid in uuids if uuid not in found))
+        fetched = []
+        for start in range(0, len(missing), self.batch_size):
+            batch_uuids = missing[start:start + self.batch_size]
+            tool_jsons = self.redis_client.mget([f"tool:{uuid}" for uuid in batch_uuids])
+            for uuid, tool_json in zip(batch_uuids, tool_jsons):
+                if tool_json:
+                    fetched.append(Tool.from_dict(json.loads(tool_json), uuid))
+        if fetched:
+            cache.put_many(fetched, generation)
+            found.update((tool.uuid, tool) for tool in fetched)
+
+        tools = [found[uuid] for uuid in uuids if uuid in found]
+        CANDIDATES_FETCHED.inc(len(tools))
+        return tools
+
+    def read_tools(self, uuids: List[str]) -> List[Tool]:
+        """
+        按batch_size分块使用MGET直接读取并解析工具，不经过工具缓存，也不计入候选工具指标
+
+        用于写入路径读取工具的旧版本，例如比对命名空间和标签是否变化。
+
+        Args:
+            uuids: UUID列表
+
+        Returns:
+            工具列表，顺序与输入一致，不存在的工具被跳过
         """
         tools = []
-        for uuid in uuids:
-            tool = self.get_tool(uuid)
-            if tool:
-                tools.append(tool)
+        for start in range(0, len(uuids), self.batch_size):
+            batch_uuids = uuids[start:start + self.batch_size]
+            tool_jsons = self.redis_client.mget([f"tool:{uuid}" for uuid in batch_uuids])
+            tools.extend(
+                Tool.from_dict(json.loads(tool_json), uuid)
+                for uuid, tool_json in zip(batch_uuids, tool_jsons)
+                if tool_json
+            )
         return tools
+
+    def get_all_tool_jsons(self) -> Dict[str, bytes]:
+        """
+        使用SCAN和分块MGET读取全部工具的原始JSON
+
+        Returns:
+            UUID -> 工具JSON字节
+        """
+        keys = list(self.redis_client.scan_iter(match="tool:*", count=self.batch_size))
+        tool_jsons = {}
+        for start in range(0, len(keys), self.batch_size):
+            batch_keys = keys[start:start + self.batch_size]
+            for key, tool_json in zip(batch_keys, self.redis_client.mget(batch_keys)):
+                if tool_json:
+                    tool_jsons[key.decode()[len("tool:"):]] = tool_json
+        return tool_jsons
+
+    def _delete_by_pattern(self, pattern: str):
+        """使用SCAN分块删除匹配的key，避免KEYS阻塞Redis"""
+        batch = []
+        for key in self.redis_client.scan_iter(match=pattern, count=self.batch_size):
+            batch.append(key)
+            if len(batch) >= self.batch_size:
+                self.redis_client.delete(*batch)
+                batch = []
+        if batch:
+            self.redis_client.delete(*batch)
     
     def clear_all_data(self):
         """清空所有数据（用于测试）"""
         # 删除所有工具数据
-        tool_keys = self.redis_client.keys("tool:*")
-        if tool_keys:
-            self.redis_client.delete(*tool_keys)
+        self._delete_by_pattern("tool:*")
 
         # 删除所有切片数据
-        slice_keys = self.redis_client.keys("tool_slices:*")
-        if slice_keys:
-            self.redis_client.delete(*slice_keys)
+        self._delete_by_pattern("tool_slices:*")
+
+        # 删除切片内容哈希
+        self._delete_by_pattern("slice_hashes:*")
+
+        # 递增工具库版本号，其他进程的工具缓存和切片存储随之失效
+        version = self.redis_client.incr(CATALOG_VERSION_KEY)
+        self.tool_cache.clear()
+
+        with self._store_lock:
+            if self.slice_store is not None:
+                self.slice_store.clear()
+            self._record_catalog_write(version)
 
         # 删除向量索引
         try:
@@ -1,28 +1,261 @@
 """
 精排服务
 """
-from typing import List
-from llama_index.postprocessor.flag_embedding_reranker import FlagEmbeddingReranker
-from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Optional
+
+import numpy as np
 
 from .models import Tool, SearchResult
+from .telemetry import CACHE_HITS, CACHE_MISSES
+
+# 送入交叉编码器的工具文档格式
+DOCUMENT_FORMATS = ("compact", "json")
 
 
 class RerankerService:
     """精排服务 - 使用BAAI/bge-reranker-large模型"""
 
-    def __init__(self, top_n: int = 10):
+    def __init__(self, top_n: int = 10, batch_size: int = 32, cache_size: int = 10000,
+                 initial_pair_latency_ms: float = 20.0, document_format: Optional[str] = None,
+                 max_length: int = 512, token_cache_size: int = 20000):
         """
         初始化精排服务
 
         Args:
             top_n: 精排后返回的结果数量
+            batch_size: 交叉编码器每次前向处理的 (查询, 工具) 对数量
+            cache_size: 得分缓存的最大条目数，0表示不缓存
+            initial_pair_latency_ms: 尚未实际打分前，每个 (查询, 工具) 对的估计耗时（毫秒）
+            document_format: 工具文档格式，'compact'为名称、描述和每个参数各一行，'json'为Tool.to_json()，
+                             默认读取环境变量RERANK_DOCUMENT_FORMAT，否则为'compact'
+            max_length: 每个 (查询, 工具) 对的最大token数，超出时截断较长的一侧
+            token_cache_size: 工具文档token缓存的最大条目数，0表示不缓存
+        """
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.model_name = "BAAI/bge-reranker-large"
+
+        # 格式标识同时写入工具对象上的渲染缓存，切换格式不会复用其他格式的渲染结果
+        self.document_format = document_format or os.getenv("RERANK_DOCUMENT_FORMAT", "compact")
+        if self.document_format not in DOCUMENT_FORMATS:
+            raise ValueError(f"不支持的文档格式: {self.document_format}，可选 {DOCUMENT_FORMATS}")
+
+        # 模型在首次打分或warmup时加载，仅做索引的进程不会加载模型
+        self._reranker = None
+        self._model_lock = threading.Lock()
+        # score_pairs前向所用的设备，加载模型时确定
+        self._device = None
+
+        # (查询哈希, 工具UUID, 工具版本) -> 得分
+        self.cache_size = cache_size
+        self._score_cache: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # 文档 -> 不含特殊token的token id，工具文档只分词一次
+        self.token_cache_size = token_cache_size
+        self._token_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._token_lock = threading.Lock()
+
+        # 每个 (查询, 工具) 对的打分耗时，指数滑动平均，供延迟预算估算
+        self.pair_latency_ms = initial_pair_latency_ms
+
+    @property
+    def reranker(self):
+        """交叉编码器模型，首次访问时导入llama_index/FlagEmbedding并加载"""
+        if self._reranker is None:
+            with self._model_lock:
+                if self._reranker is None:
+                    from llama_index.postprocessor.flag_embedding_reranker import FlagEmbeddingReranker
+
+                    reranker = FlagEmbeddingReranker(
+                        top_n=self.top_n,
+                        model=self.model_name,
+                        use_fp16=False
+                    )
+                    self._device = self._place_model(reranker._model)
+                    self._reranker = reranker
+        return self._reranker
+
+    @staticmethod
+    def _place_model(flag_reranker) -> str:
+        """
+        把模型移到FlagReranker选定的第一个设备并切换到推理模式
+
+        score_pairs直接调用模型前向，不经过FlagReranker.compute_score，需要自行完成这两步，只在加载时做一次。
+
+        Returns:
+            模型所在的设备
+        """
+        devices = getattr(flag_reranker, "target_devices", None)
+        device = devices[0] if devices else "cpu"
+        flag_reranker.model.to(device)
+        flag_reranker.model.eval()
+        return device
+
+    def warmup(self):
+        """预先加载模型并完成一次前向，避免首个请求承担加载开销"""
+        self.score_pairs([("warmup", "warmup")])
+
+    @staticmethod
+    def _hash_text(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _render_document(self, tool: Tool) -> str:
+        """
+        生成送入交叉编码器的工具文档
+
+        'compact'格式不含JSON的缩进、引号和字段名，参数多的工具也较少被截断；
+        名称和描述在最前，超出max_length时先截掉靠后的参数。
+        """
+        if self.document_format == "json":
+            return tool.to_json()
+        lines = [f"{tool.ToolName}: {tool.ToolDescription}"]
+        lines.extend(f"{arg.ArgName}: {arg.ArgDescription}" for arg in tool.Args)
+        return "\n".join(lines)
+
+    def document_for(self, tool: Tool) -> Tuple[str, str]:
+        """
+        获取工具文档及其哈希，渲染结果保存在工具对象上
+
+        工具缓存中的Tool对象被多次查询复用，热门工具只渲染和哈希一次。
+        缓存的工具对象视为不可变，更新工具会产生新的对象。
+
+        Args:
+            tool: 工具对象
+
+        Returns:
+            (文档, 文档哈希)
+        """
+        rendered = tool.rendered
+        if rendered is None or rendered[0] != self.document_format:
+            document = self._render_document(tool)
+            rendered = (self.document_format, document, self._hash_text(document))
+            tool.rendered = rendered
+        return rendered[1], rendered[2]
+
+    def prepare_documents(self, tools: List[Tool]):
+        """
+        预先渲染工具文档并分词，写入token缓存
+
+        模型尚未加载时跳过：仅做索引的进程不加载模型，工具在首次精排时分词。
+
+        Args:
+            tools: 工具列表
+        """
+        if self._reranker is None or not tools or self.token_cache_size <= 0:
+            return
+        self._document_ids([self.document_for(tool)[0] for tool in tools])
+
+    def _encode(self, texts: List[str]) -> List[np.ndarray]:
+        """批量分词，不添加特殊token"""
+        tokenizer = self.reranker._model.tokenizer
+        encoded = tokenizer(texts, add_special_tokens=False, truncation=True, max_length=self.max_length)
+        return [np.asarray(ids, dtype=np.int32) for ids in encoded["input_ids"]]
+
+    def _document_ids(self, documents: List[str]) -> List[np.ndarray]:
+        """
+        获取文档的token id，未命中token缓存的文档一起分词
+
+        Args:
+            documents: 文档列表，可以重复
+
+        Returns:
+            token id列表，与输入顺序一致
+        """
+        found: Dict[str, np.ndarray] = {}
+        with self._token_lock:
+            for document in documents:
+                ids = self._token_cache.get(document)
+                if ids is not None:
+                    self._token_cache.move_to_end(document)
+                    found[document] = ids
+
+        missing = [document for document in dict.fromkeys(documents) if document not in found]
+        if missing:
+            encoded = self._encode(missing)
+            found.update(zip(missing, encoded))
+            if self.token_cache_size > 0:
+                with self._token_lock:
+                    self._token_cache.update(zip(missing, encoded))
+                    while len(self._token_cache) > self.token_cache_size:
+                        self._token_cache.popitem(last=False)
+        return [found[document] for document in documents]
+
+    def _build_input(self, query_ids: np.ndarray, document_ids: np.ndarray) -> List[int]:
+        """拼接查询和文档并加上特殊token，超出max_length时先截断较长的一侧（同tokenizer的longest_first）"""
+        tokenizer = self.reranker._model.tokenizer
+        budget = self.max_length - tokenizer.num_special_tokens_to_add(pair=True)
+        if len(query_ids) + len(document_ids) > budget:
+            query_length = min(len(query_ids), max(budget - len(document_ids), budget // 2))
+            query_ids = query_ids[:query_length]
+            document_ids = document_ids[:budget - query_length]
+        return tokenizer.build_inputs_with_special_tokens(query_ids.tolist(), document_ids.tolist())
+
+    def score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """
+        直接用交叉编码器对 (查询, 文档) 对打分
+
+        每个不同的查询只分词一次，文档的token id取自token缓存；
+        输入按长度排序后按batch_size分批前向，每批只补齐到批内最长的输入，减少padding。
+
+        Args:
+            pairs: (查询, 文档) 列表
+
+        Returns:
+            得分列表，与输入顺序一致
+        """
+        if not pairs:
+            return []
+
+        import torch
+
+        flag_reranker = self.reranker._model
+        start = time.perf_counter()
+        queries = list(dict.fromkeys(query for query, _ in pairs))
+        query_ids = dict(zip(queries, self._encode(queries)))
+        document_ids = self._document_ids([document for _, document in pairs])
+        inputs = [self._build_input(query_ids[query], ids) for (query, _), ids in zip(pairs, document_ids)]
+
+        model = flag_reranker.model
+        device = self._device
+        order = sorted(range(len(inputs)), key=lambda i: len(inputs[i]))
+        scores = [0.0] * len(inputs)
+        for offset in range(0, len(order), self.batch_size):
+            batch = order[offset:offset + self.batch_size]
+            features = flag_reranker.tokenizer.pad(
+                {"input_ids": [inputs[i] for i in batch]}, padding=True, return_tensors="pt"
+            ).to(device)
+            with torch.no_grad():
+                logits = model(**features, return_dict=True).logits.view(-1).float()
+            for i, score in zip(batch, logits.tolist()):
+                scores[i] = score
+
+        self._observe_latency((time.perf_counter() - start) * 1000.0, len(pairs))
+        return scores
+
+    def _observe_latency(self, elapsed_ms: float, num_pairs: int, alpha: float = 0.2):
+        """记录一次模型打分的耗时，更新单对耗时的滑动平均"""
+        self.pair_latency_ms += alpha * (elapsed_ms / num_pairs - self.pair_latency_ms)
+
+    def estimate_latency_ms(self, num_pairs: int) -> float:
+        """
+        估计对num_pairs个 (查询, 工具) 对打分的耗时
+
+        Args:
+            num_pairs: 待打分的对数
+
+        Returns:
+            估计耗时（毫秒）
         """
-        self.reranker = FlagEmbeddingReranker(
-            top_n=top_n,
-            model="BAAI/bge-reranker-large",
-            use_fp16=False
-        )
+        return num_pairs * self.pair_latency_ms
 
     def rerank_tools(self, query: str, candidate_tools: List[Tool]) -> List[SearchResult]:
         """
@@ -33,43 +266,88 @@ class RerankerService:
             candidate_tools: 候选工具列表
 
         Returns:
-            精排后的搜索结果列表
+            精排后的搜索结果列表，最多top_n条
         """
         if not candidate_tools:
             return []
 
-        # 准备文档内容 - 使用工具的完整JSON内容
-        documents = [tool.to_json() for tool in candidate_tools]
-
-        # 创建节点
-        nodes = [NodeWithScore(node=TextNode(text=doc)) for doc in documents]
-
-        # 创建查询包
-        query_bundle = QueryBundle(query_str=query)
-
-        # 执行精排
-        ranked_nodes = self.reranker._postprocess_nodes(nodes, query_bundle)
-
-        # 构建搜索结果
-        search_results = []
-        for rank, node_with_score in enumerate(ranked_nodes):
-            # 找到对应的工具
-            tool_json = node_with_score.node.get_content()
-            tool = None
-            for candidate_tool in candidate_tools:
-                if candidate_tool.to_json() == tool_json:
-                    tool = candidate_tool
-                    break
-
-            if tool:
-                search_result = SearchResult(
-                    tool=tool,
-                    score=node_with_score.score if node_with_score.score else 0.0,
-                    rank=rank + 1
-                )
-                search_results.append(search_result)
-
-        return search_results
+        return self.rerank_many([query], [candidate_tools])[0][:self.top_n]
+
+    def rerank_many(self, queries: List[str], candidate_lists: List[List[Tool]]) -> List[List[SearchResult]]:
+        """
+        对多个查询的候选工具一起精排
+
+        所有查询的 (查询, 工具) 对合并后按batch_size分批打分，命中得分缓存的对不再经过模型。
+        工具通过下标与得分对应，不需要比对序列化后的文本。
+
+        Args:
+            queries: 查询列表
+            candidate_lists: 每个查询对应的候选工具列表
+
+        Returns:
+            每个查询的精排结果列表，与输入顺序一致
+        """
+        # 1. 展开为 (查询序号, 工具) 对，并计算缓存key
+        pair_keys = []
+        pair_docs = []
+        for query, candidate_tools in zip(queries, candidate_lists):
+            query_hash = self._hash_text(query)
+            for tool in candidate_tools:
+                document, version = self.document_for(tool)
+                pair_keys.append((query_hash, tool.uuid, version))
+                pair_docs.append((query, document))
+
+        # 2. 查询得分缓存
+        scores: List[float] = [0.0] * len(pair_keys)
+        missing = []
+        with self._cache_lock:
+            for i, key in enumerate(pair_keys):
+                score = self._score_cache.get(key) if self.cache_size > 0 else None
+                if score is None:
+                    missing.append(i)
+                else:
+                    self._score_cache.move_to_end(key)
+                    scores[i] = score
+            self.cache_hits += len(pair_keys) - len(missing)
+            self.cache_misses += len(missing)
+        CACHE_HITS.inc(len(pair_keys) - len(missing), cache="rerank")
+        CACHE_MISSES.inc(len(missing), cache="rerank")
+
+        # 3. 未命中的对交给交叉编码器批量打分
+        if missing:
+            missing_scores = self.score_pairs([pair_docs[i] for i in missing])
+            with self._cache_lock:
+                for i, score in zip(missing, missing_scores):
+                    scores[i] = score
+                    if self.cache_size > 0:
+                        self._score_cache[pair_keys[i]] = score
+                while len(self._score_cache) > self.cache_size:
+                    self._score_cache.popitem(last=False)
+
+        # 4. 按查询切分并排序
+        all_results = []
+        offset = 0
+        for candidate_tools in candidate_lists:
+            tool_scores = scores[offset:offset + len(candidate_tools)]
+            offset += len(candidate_tools)
+
+            order = sorted(range(len(candidate_tools)), key=lambda i: tool_scores[i], reverse=True)
+            all_results.append([
+                SearchResult(tool=candidate_tools[i], score=tool_scores[i], rank=rank + 1)
+                for rank, i in enumerate(order)
+            ])
+
+        return all_results
+
+    def get_cache_stats(self) -> Dict[str, int]:
+        """获取得分缓存统计"""
+        with self._cache_lock:
+            return {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "entries": len(self._score_cache),
+                "token_entries": len(self._token_cache)
+            }
 
     def get_top_k_tools(self, search_results: List[SearchResult], top_k: int) -> List[Tool]:
         """
@@ -0,0 +1,264 @@
+"""
+查询结果缓存
+"""
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from .models import Tool
+from .telemetry import CACHE_HITS, CACHE_MISSES
+
+
+def normalize_query(query: str) -> str:
+    """
+    规范化查询文本，作为精确匹配层的key
+
+    NFKC统一全角/半角字符，忽略大小写，连续空白合并为一个空格。
+
+    Args:
+        query: 原始查询
+
+    Returns:
+        规范化后的查询
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+@dataclass(slots=True)
+class _Entry:
+    """缓存条目"""
+    tools: List[Tool]
+    expires_at: float
+    slot: Optional[int] = None  # 查询向量在向量矩阵中的行，未缓存向量时为None
+
+
+class QueryResultCache:
+    """
+    检索结果缓存，位于粗排和精排之前
+
+    两层查找：
+    - 精确层：按 (规范化查询, 检索参数) 查找
+    - 语义层：新查询的向量与已缓存查询向量的余弦相似度达到similarity_threshold时，直接复用其Top K结果，
+      已缓存的查询向量放在一个预分配的矩阵中，一次矩阵-向量乘法完成查找
+
+    条目按LRU淘汰，超过ttl_seconds过期；工具库变化时整体失效，
+    跨进程的一致性与工具缓存一样依靠工具库版本号（见tool_cache.CATALOG_VERSION_KEY）。
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 300.0,
+                 similarity_threshold: Optional[float] = None, version_check_interval: Optional[float] = 1.0):
+        """
+        初始化查询结果缓存
+
+        Args:
+            max_entries: 最多缓存的查询数量，0表示不缓存
+            ttl_seconds: 条目的存活时间（秒）
+            similarity_threshold: 语义层命中所需的最低余弦相似度，None表示不启用语义层；
+                合适的阈值取决于向量模型，需要按所用模型单独调整
+            version_check_interval: 两次工具库版本检查的最短间隔（秒），None表示从不检查
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version_check_interval = version_check_interval
+
+        self._entries: "OrderedDict[Tuple[str, Tuple[Any, ...]], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._last_check = float("-inf")
+        # 每次清空时递增，用于丢弃清空前开始计算的结果
+        self.generation = 0
+
+        # 语义层：每个槽位一行查询向量，以及该槽位的检索参数分组和过期时间（空槽位为-inf）
+        self._vectors: Optional[np.ndarray] = None
+        self._slot_groups = np.full(max_entries, -1, dtype=np.int64)
+        self._slot_expires = np.full(max_entries, -np.inf)
+        self._slot_keys: List[Optional[Tuple[str, Tuple[Any, ...]]]] = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._group_of: Dict[Tuple[Any, ...], int] = {}
+
+        # 命中统计
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        """是否启用缓存"""
+        return self.max_entries > 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        """是否启用语义层"""
+        return self.enabled and self.similarity_threshold is not None
+
+    def needs_version_check(self) -> bool:
+        """距上次版本检查是否已超过version_check_interval"""
+        if not self.enabled or self.version_check_interval is None:
+            return False
+        return time.monotonic() - self._last_check >= self.version_check_interval
+
+    def sync_version(self, version: Optional[int]):
+        """
+        记录工具库版本号，版本变化时清空缓存
+
+        Args:
+            version: 工具库版本号，见RedisService.read_catalog_version
+        """
+        with self._lock:
+            self._last_check = time.monotonic()
+            if version != self._version:
+                self._version = version
+                self._clear_locked()
+
+    def get(self, query: str, params: Tuple[Any, ...]) -> Optional[List[Tool]]:
+        """
+        精确层查找
+
+        Args:
+            query: 查询
+            params: 影响结果的检索参数，例如 (top_n, top_m, top_k, 检索方式)
+
+        Returns:
+            缓存的Top K工具列表，未命中时返回None
+        """
+        if not self.enabled:
+            return None
+        key = (normalize_query(query), params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove_locked(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+        if entry is None:
+            return None
+        CACHE_HITS.inc(cache="query_exact")
+        return list(entry.tools)
+
+    def get_similar(self, query_embedding: Any, params: Tuple[Any, ...]) -> Optional[List[Tool]]:
+        """
+        语义层查找：返回检索参数相同、查询向量最相似且相似度达到阈值的缓存结果
+
+        Args:
+            query_embedding: 查询向量
+            params: 检索参数，与get一致
+
+        Returns:
+            缓存的Top K工具列表，未命中时返回None
+        """
+        if not self.semantic_enabled:
+            return None
+        query_vector = self._normalize(query_embedding)
+        with self._lock:
+            group = self._group_of.get(params)
+            if group is None or self._vectors is None or self._vectors.shape[1] != len(query_vector):
+                return None
+            valid = (self._slot_groups == group) & (self._slot_expires > time.monotonic())
+            if not valid.any():
+                return None
+            similarities = np.where(valid, self._vectors @ query_vector, -np.inf)
+            slot = int(np.argmax(similarities))
+            if similarities[slot] < self.similarity_threshold:
+                return None
+            key = self._slot_keys[slot]
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            self.semantic_hits += 1
+        CACHE_HITS.inc(cache="query_semantic")
+        return list(entry.tools)
+
+    def record_miss(self):
+        """记录一次两层都未命中的查询"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.misses += 1
+        CACHE_MISSES.inc(cache="query")
+
+    def put(self, query: str, params: Tuple[Any, ...], tools: List[Tool], generation: int,
+            query_embedding: Optional[Any] = None):
+        """
+        写入检索结果
+
+        Args:
+            query: 查询
+            params: 检索参数，与get一致
+            tools: Top K工具列表
+            generation: 开始检索前的generation；期间缓存被清空过时丢弃这次结果，避免写回基于旧工具库的结果
+            query_embedding: 查询向量，提供时同时写入语义层
+        """
+        if not self.enabled:
+            return
+        key = (normalize_query(query), params)
+        query_vector = None
+        if query_embedding is not None and self.semantic_enabled:
+            query_vector = self._normalize(query_embedding)
+        expires_at = time.monotonic() + self.ttl_seconds
+
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove_locked(key)
+            while len(self._entries) >= self.max_entries:
+                self._remove_locked(next(iter(self._entries)))
+
+            entry = _Entry(tools=list(tools), expires_at=expires_at)
+            if query_vector is not None:
+                if self._vectors is None or self._vectors.shape[1] != len(query_vector):
+                    # 向量维度变化（例如更换了向量化模型）时，旧槽位全部作废
+                    for old_key in [k for k, e in self._entries.items() if e.slot is not None]:
+                        self._remove_locked(old_key)
+                    self._vectors = np.zeros((self.max_entries, len(query_vector)), dtype=np.float32)
+                slot = self._free_slots.pop()
+                self._vectors[slot] = query_vector
+                self._slot_groups[slot] = self._group_of.setdefault(params, len(self._group_of))
+                self._slot_expires[slot] = expires_at
+                self._slot_keys[slot] = key
+                entry.slot = slot
+            self._entries[key] = entry
+
+    @staticmethod
+    def _normalize(embedding: Any) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _remove_locked(self, key: Tuple[str, Tuple[Any, ...]]):
+        entry = self._entries.pop(key)
+        if entry.slot is not None:
+            self._slot_groups[entry.slot] = -1
+            self._slot_expires[entry.slot] = -np.inf
+            self._slot_keys[entry.slot] = None
+            self._free_slots.append(entry.slot)
+
+    def _clear_locked(self):
+        for key in list(self._entries):
+            self._remove_locked(key)
+        self._group_of.clear()
+        self.generation += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._clear_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries)
+            }
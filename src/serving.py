@@ -0,0 +1,576 @@
+"""
+多进程检索服务
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from .models import Tool, SearchFilter
+from .slice_store import SliceStore, PartitionedSliceStore
+from .coarse_ranker import CoarseRanker
+from .redis_service import RedisService
+from .tool_cache import ToolCache
+from .reranker import RerankerService
+from .lexical_index import LexicalIndex, run_lexical_stage
+from .embedding_service import AsyncEmbeddingService
+from .clients import get_embedding_service
+
+logger = logging.getLogger(__name__)
+
+# 共享数组描述：(共享内存名称, 形状, dtype)
+ArraySpec = Tuple[str, Tuple[int, ...], str]
+
+
+def _attach_block(name: str) -> shared_memory.SharedMemory:
+    """连接已有的共享内存块；Python 3.13+ 不再交给resource_tracker管理，由创建方负责释放"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedIndex:
+    """
+    放在共享内存中的只读检索数据
+
+    包括每个命名空间分区的切片向量矩阵（及int8缩放系数、IVF索引）、每行的切片key/工具UUID/切片类型/标签，
+    以及按UUID排序的全部工具JSON。父进程创建一次，工作进程通过handle连接，不复制数据。
+    第i个命名空间的数组名以"p{i}."为前缀。
+    """
+
+    def __init__(self, blocks: Dict[str, shared_memory.SharedMemory], specs: Dict[str, ArraySpec],
+                 dimensions: int, precision: str, namespaces: List[str], owner: bool):
+        self._blocks = blocks
+        self.specs = specs
+        self.dimensions = dimensions
+        self.precision = precision
+        self.namespaces = namespaces
+        self.owner = owner
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name, (_, shape, dtype) in specs.items():
+            array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+            array.flags.writeable = False
+            self.arrays[name] = array
+        # 共享数据不可变，缓存无需版本检查；每个工作进程各自持有
+        self.tool_cache = ToolCache(max_entries=int(os.getenv("TOOL_CACHE_SIZE", 10000)),
+                                    version_check_interval=None)
+
+    @classmethod
+    def create(cls, store: PartitionedSliceStore, tool_jsons: Dict[str, bytes]) -> "SharedIndex":
+        """
+        把切片存储和工具JSON复制到新的共享内存块
+
+        Args:
+            store: 按命名空间分区的切片向量存储
+            tool_jsons: UUID -> 工具JSON字节
+
+        Returns:
+            共享索引（创建方）
+        """
+        uuids = sorted(tool_jsons)
+        documents = [tool_jsons[uuid] for uuid in uuids]
+        offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(document) for document in documents])
+
+        arrays = {
+            "tool_uuids": np.array(uuids, dtype=str),
+            "tool_offsets": offsets,
+            "tool_data": np.frombuffer(b"".join(documents), dtype=np.uint8)
+        }
+        exported = store.export()
+        namespaces = sorted(exported)
+        for i, namespace in enumerate(namespaces):
+            data = exported[namespace]
+            arrays[f"p{i}.matrix"] = data["matrix"]
+            arrays[f"p{i}.keys"] = np.array(data["keys"], dtype=str)
+            arrays[f"p{i}.uuids"] = np.array(data["uuids"], dtype=str)
+            arrays[f"p{i}.slice_types"] = np.array(data["slice_types"], dtype=str)
+            arrays[f"p{i}.tags"] = np.array(data["tags"], dtype=str)
+            if data["scales"] is not None:
+                arrays[f"p{i}.scales"] = data["scales"]
+            if data["ivf"] is not None:
+                arrays[f"p{i}.ivf_centroids"], arrays[f"p{i}.ivf_offsets"], arrays[f"p{i}.ivf_list_ids"] = data["ivf"]
+
+        blocks, specs = {}, {}
+        try:
+            for name, array in arrays.items():
+                # 共享内存块大小不能为0
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                blocks[name] = block
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                specs[name] = (block.name, array.shape, array.dtype.str)
+        except Exception:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+            raise
+
+        return cls(blocks, specs, store.dimensions, store.precision, namespaces, owner=True)
+
+    @property
+    def name(self) -> str:
+        """共享索引的标识，取工具UUID数组所在共享内存块的名称，每次create都不同"""
+        return self.specs["tool_uuids"][0]
+
+    @property
+    def handle(self) -> Dict[str, Any]:
+        """可跨进程传递的连接信息"""
+        return {"name": self.name, "specs": self.specs, "dimensions": self.dimensions, "precision": self.precision,
+                "namespaces": self.namespaces}
+
+    @classmethod
+    def attach(cls, handle: Dict[str, Any]) -> "SharedIndex":
+        """
+        通过handle连接父进程创建的共享索引
+
+        Args:
+            handle: SharedIndex.handle
+
+        Returns:
+            共享索引（只读视图）
+        """
+        blocks = {name: _attach_block(spec[0]) for name, spec in handle["specs"].items()}
+        return cls(blocks, handle["specs"], handle["dimensions"], handle["precision"], handle["namespaces"],
+                   owner=False)
+
+    def slice_store(self, rescore_factor: int = 4, vector_loader=None) -> PartitionedSliceStore:
+        """基于共享数组构建分区切片存储，检索时直接读取共享内存"""
+        arrays = self.arrays
+        partitions = {}
+        for i, namespace in enumerate(self.namespaces):
+            ivf = None
+            if f"p{i}.ivf_centroids" in arrays:
+                ivf = (arrays[f"p{i}.ivf_centroids"], arrays[f"p{i}.ivf_offsets"], arrays[f"p{i}.ivf_list_ids"])
+            partitions[namespace] = SliceStore.from_arrays(
+                arrays[f"p{i}.matrix"], arrays[f"p{i}.keys"], arrays[f"p{i}.uuids"], arrays[f"p{i}.slice_types"],
+                scales=arrays.get(f"p{i}.scales"), precision=self.precision,
+                rescore_factor=rescore_factor, vector_loader=vector_loader, tags=arrays[f"p{i}.tags"], ivf=ivf
+            )
+        return PartitionedSliceStore(dimensions=self.dimensions, precision=self.precision,
+                                     rescore_factor=rescore_factor, vector_loader=vector_loader,
+                                     partitions=partitions)
+
+    def get_tools_by_uuids(self, uuids: List[str]) -> List[Tool]:
+        """
+        从共享内存读取工具，解析结果保存在进程内工具缓存
+
+        Args:
+            uuids: UUID列表
+
+        Returns:
+            工具列表，顺序与输入一致，不存在的工具被跳过
+        """
+        tool_uuids = self.arrays["tool_uuids"]
+        offsets = self.arrays["tool_offsets"]
+        data = self.arrays["tool_data"]
+        if not uuids or len(tool_uuids) == 0:
+            return []
+
+        generation = self.tool_cache.generation
+        found = self.tool_cache.get_many(uuids)
+        missing = list(dict.fromkeys(uuid for uuid in uuids if uuid not in found))
+        if missing:
+            fetched = []
+            positions = np.searchsorted(tool_uuids, missing)
+            for uuid, position in zip(missing, positions):
+                if position < len(tool_uuids) and tool_uuids[position] == uuid:
+                    document = data[offsets[position]:offsets[position + 1]].tobytes()
+                    fetched.append(Tool.from_dict(json.loads(document), uuid))
+            self.tool_cache.put_many(fetched, generation)
+            found.update((tool.uuid, tool) for tool in fetched)
+        return [found[uuid] for uuid in uuids if uuid in found]
+
+    def close(self):
+        """断开共享内存；创建方同时释放共享内存块"""
+        self.arrays.clear()
+        for block in self._blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                # 仍有视图引用共享内存（例如尚未释放的SliceStore），交给进程退出时回收
+                pass
+            if self.owner:
+                block.unlink()
+        self._blocks.clear()
+
+
+def _limit_threads(num_threads: int):
+    """限制当前进程BLAS/OpenMP/torch的线程数，避免多个工作进程争抢CPU"""
+    for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[name] = str(num_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(num_threads)
+    except ImportError:
+        pass
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+
+# 工作进程内的状态，由初始化函数设置
+_worker: Dict[str, Any] = {}
+
+
+def _attach_index(handle: Dict[str, Any]) -> bool:
+    """
+    让工作进程使用handle对应的共享索引
+
+    父进程替换了共享索引时连接新索引并断开旧索引，旧共享内存块由父进程在没有请求使用后释放。
+
+    Returns:
+        是否连接了新索引
+    """
+    if _worker.get("index_name") == handle["name"]:
+        return False
+    previous = _worker.get("index")
+    # 先释放基于旧共享数组的切片存储，旧索引才能断开
+    _worker.pop("store", None)
+    _worker["index"] = SharedIndex.attach(handle)
+    _worker["index_name"] = handle["name"]
+    if previous is not None:
+        previous.close()
+    return True
+
+
+def _init_search_worker(handle: Dict[str, Any], rescore_factor: int, num_threads: int):
+    """检索工作进程初始化：连接共享索引"""
+    _limit_threads(num_threads)
+    vector_loader = None
+    if handle["precision"] != "float32":
+        # 量化存储需要从Redis读取原始向量重新打分
+        vector_loader = RedisService().get_slice_embeddings
+    _worker["rescore_factor"] = rescore_factor
+    _worker["vector_loader"] = vector_loader
+    _worker["coarse_ranker"] = CoarseRanker()
+    _attach_index(handle)
+    _worker["store"] = _worker["index"].slice_store(rescore_factor, vector_loader)
+
+
+def _search_candidates(handle: Dict[str, Any],
+                       queries: List[Tuple[Optional[List[float]], Optional[List[Dict[str, Any]]]]],
+                       top_n: int, top_m: int, search_filter: SearchFilter,
+                       nprobe: Optional[int] = None) -> List[List[str]]:
+    """
+    向量检索、与词法结果融合并粗排，返回每个查询的候选工具UUID
+
+    handle为父进程提交任务时的共享索引，与当前连接的不同时先切换；
+    queries中每项为 (查询向量, 词法检索结果)，查询向量为None时只使用词法结果；
+    向量检索只扫描search_filter命名空间的分区，nprobe不为None时按IVF只扫描部分簇
+    """
+    if _attach_index(handle):
+        _worker["store"] = _worker["index"].slice_store(_worker["rescore_factor"], _worker["vector_loader"])
+    store = _worker["store"].partition(search_filter.namespace)
+    coarse_ranker = _worker["coarse_ranker"]
+    candidate_lists = []
+    # 本进程分到的查询一次矩阵-矩阵乘法完成向量检索
+    positions = [i for i, (query_embedding, _) in enumerate(queries) if query_embedding is not None]
+    hits = store.search_rows_many([queries[i][0] for i in positions], top_n, search_filter, nprobe) if positions else []
+    hits_of = dict(zip(positions, hits))
+    for i, (_, lexical_results) in enumerate(queries):
+        if i in hits_of:
+            rows, scores = hits_of[i]
+            coarse_results, _ = coarse_ranker.rank_store_hits(store, rows, scores, lexical_results, top_n, top_m)
+        else:
+            coarse_results = coarse_ranker.rank_tools(lexical_results[:top_n], top_m)
+        candidate_lists.append(coarse_ranker.get_top_candidates(coarse_results, top_m))
+    return candidate_lists
+
+
+def _init_rerank_worker(handle: Dict[str, Any], top_n: int, num_threads: int):
+    """精排工作进程初始化：连接共享索引并加载交叉编码器"""
+    _limit_threads(num_threads)
+    _attach_index(handle)
+    _worker["reranker"] = RerankerService(top_n=top_n)
+    _worker["reranker"].warmup()
+
+
+def _rerank(handle: Dict[str, Any], queries: List[str], candidate_lists: List[List[str]],
+            top_k: int) -> List[List[str]]:
+    """对候选工具精排，返回每个查询的Top K工具UUID；handle见_search_candidates"""
+    _attach_index(handle)
+    index = _worker["index"]
+    reranker = _worker["reranker"]
+    tool_lists = [index.get_tools_by_uuids(uuids) for uuids in candidate_lists]
+    results = reranker.rerank_many(queries, tool_lists)
+    return [[tool.uuid for tool in reranker.get_top_k_tools(result, top_k)] for result in results]
+
+
+def _split(items: List[Any], parts: int) -> List[List[Any]]:
+    """把列表尽量均匀地切成至多parts段，保持原有顺序"""
+    parts = max(1, min(parts, len(items)))
+    size, extra = divmod(len(items), parts)
+    chunks, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+class ProcessSearchService:
+    """
+    多进程检索服务
+
+    父进程把切片向量矩阵和全部工具JSON放入共享内存，
+    检索进程池负责向量检索和粗排，精排进程池各自加载一份交叉编码器并固定线程数。
+    查询向量化在父进程中异步完成，进程之间只传递查询向量和工具UUID。
+    接口与AsyncRAGSystem一致，可直接交给QueryBatcher使用。
+
+    与单进程检索一样按TOOL_CACHE_CHECK_SECONDS的间隔检查工具库版本号，工具库变化时创建新的共享索引，
+    之后提交的任务带上新索引的handle，工作进程据此切换；旧共享内存块在使用它的请求都结束后释放。
+    """
+
+    def __init__(self, redis_service: Optional[RedisService] = None, search_workers: Optional[int] = None,
+                 rerank_workers: Optional[int] = None, rerank_threads: Optional[int] = None,
+                 rerank_top_n: int = 10, lexical_confidence: float = 0.9):
+        """
+        初始化多进程检索服务
+
+        Args:
+            redis_service: Redis存储服务，用于加载切片和工具
+            search_workers: 检索进程数，默认读取环境变量SEARCH_WORKERS，否则为CPU核数
+            rerank_workers: 精排进程数，默认读取环境变量RERANK_WORKERS，否则为1
+            rerank_threads: 每个精排进程的线程数，默认读取环境变量RERANK_THREADS，否则平分CPU核数
+            rerank_top_n: 精排返回的最大结果数量
+            lexical_confidence: 'auto'检索方式下跳过查询向量化所需的最低词法置信度
+        """
+        cpu_count = os.cpu_count() or 1
+        self.redis_service = redis_service or RedisService()
+        self.search_workers = search_workers or int(os.getenv("SEARCH_WORKERS", 0)) or cpu_count
+        self.rerank_workers = rerank_workers or int(os.getenv("RERANK_WORKERS", 1))
+        self.rerank_threads = rerank_threads or int(os.getenv("RERANK_THREADS", 0)) or \
+            max(1, cpu_count // self.rerank_workers)
+        self.rerank_top_n = rerank_top_n
+        self.lexical_confidence = lexical_confidence
+        self.lexical_index: Optional[LexicalIndex] = None
+
+        self.embedding_service = AsyncEmbeddingService.from_service(get_embedding_service())
+        self.index: Optional[SharedIndex] = None
+        self.index_version: Optional[int] = None  # 创建共享索引前读取的工具库版本号
+        self._search_pool: Optional[ProcessPoolExecutor] = None
+        self._rerank_pool: Optional[ProcessPoolExecutor] = None
+        # 正在被请求使用的共享索引 -> 请求数；已被替换的索引在请求数归零后释放
+        self._index_users: Dict[SharedIndex, int] = {}
+        self._retired: List[SharedIndex] = []
+        self._refresh_lock = asyncio.Lock()
+
+    def _build_index(self) -> Tuple[SharedIndex, LexicalIndex, int]:
+        """
+        读取工具库版本号，再把切片存储和全部工具复制到新的共享索引
+
+        Returns:
+            (共享索引, 词法索引, 读取到的工具库版本号)
+        """
+        redis_service = self.redis_service
+        version = redis_service.read_catalog_version()
+        # 其他进程修改过工具库时重新加载切片存储，本进程的写入已应用在进程内存储上
+        redis_service.sync_slice_store(version)
+        store = redis_service.get_slice_store()
+        tool_jsons = redis_service.get_all_tool_jsons()
+        index = SharedIndex.create(store, tool_jsons)
+        # 词法检索在父进程完成，结果随查询发给检索进程融合
+        lexical_index = LexicalIndex()
+        lexical_index.add_tools(Tool.from_dict(json.loads(tool_json), uuid) for uuid, tool_json in tool_jsons.items())
+        logger.info("共享索引已创建：%d 个切片，%d 个工具，工具库版本 %d", len(store), len(tool_jsons), version)
+        return index, lexical_index, version
+
+    def start(self):
+        """加载切片和工具到共享内存并启动两个进程池，阻塞到精排模型加载完成"""
+        self.index, self.lexical_index, self.index_version = self._build_index()
+
+        try:
+            self._start_pools()
+        except Exception:
+            self.shutdown()
+            raise
+
+    def _start_pools(self):
+        # 使用spawn启动，避免复制父进程中的线程和连接
+        context = multiprocessing.get_context("spawn")
+        self._search_pool = ProcessPoolExecutor(
+            max_workers=self.search_workers,
+            mp_context=context,
+            initializer=_init_search_worker,
+            initargs=(self.index.handle, self.redis_service.rescore_factor, 1)
+        )
+        self._rerank_pool = ProcessPoolExecutor(
+            max_workers=self.rerank_workers,
+            mp_context=context,
+            initializer=_init_rerank_worker,
+            initargs=(self.index.handle, self.rerank_top_n, self.rerank_threads)
+        )
+
+        # 提前拉起进程并完成初始化，首个请求不承担模型加载开销
+        handle = self.index.handle
+        for future in [self._search_pool.submit(_search_candidates, handle, [], 0, 0, SearchFilter())
+                       for _ in range(self.search_workers)]:
+            future.result()
+        for future in [self._rerank_pool.submit(_rerank, handle, [], [], 0) for _ in range(self.rerank_workers)]:
+            future.result()
+
+    def _index_changed(self) -> bool:
+        """读取工具库版本号，判断共享索引是否已过期"""
+        # 共享索引创建后不再修改，本进程自己的写入也没有应用到共享索引上，版本号不同即过期
+        return self.redis_service.read_catalog_version() != self.index_version
+
+    async def refresh_index(self) -> bool:
+        """
+        工具库版本号变化时创建新的共享索引并替换当前索引
+
+        新索引在后台线程中创建，替换在事件循环中完成：之后开始的请求使用新索引，
+        正在进行的请求继续使用旧索引，旧共享内存块在这些请求结束后释放。
+        另一个请求正在刷新时直接返回。
+
+        Returns:
+            是否替换了共享索引
+        """
+        if self.index is None or self._refresh_lock.locked():
+            return False
+        async with self._refresh_lock:
+            if not await asyncio.to_thread(self._index_changed):
+                return False
+            index, lexical_index, version = await asyncio.to_thread(self._build_index)
+            previous = self.index
+            self.index, self.lexical_index, self.index_version = index, lexical_index, version
+            self.redis_service.forget_catalog_writes(version)
+            self._retired.append(previous)
+            self._release_retired()
+        logger.info("工具库版本变为 %d，已切换共享索引", version)
+        return True
+
+    def _release_retired(self):
+        """释放已被替换、且没有请求在使用的共享索引"""
+        still_used = []
+        for index in self._retired:
+            if self._index_users.get(index):
+                still_used.append(index)
+            else:
+                index.close()
+        self._retired = still_used
+
+    async def search_tools(self, query: str, top_n: int = 100, top_m: int = 20, top_k: int = 5,
+                           retrieval_mode: str = "hybrid", search_filter: Optional[SearchFilter] = None,
+                           nprobe: Optional[int] = None) -> List[Tool]:
+        """
+        搜索单个查询
+
+        Args:
+            query: 用户查询
+            top_n: 粗排阶段检索的切片数量
+            top_m: 粗排后保留的候选工具数量
+            top_k: 最终返回的工具数量
+            retrieval_mode: 切片检索方式，见RAGSystem.search_tools
+            search_filter: 过滤条件，见RAGSystem.search_tools
+            nprobe: IVF检索扫描的簇数量，None表示精确检索
+
+        Returns:
+            Top K工具列表
+        """
+        results = await self.search_tools_many([query], top_n, top_m, top_k, retrieval_mode, search_filter, nprobe)
+        return results[0]
+
+    async def search_tools_many(self, queries: List[str], top_n: int = 100, top_m: int = 20,
+                                top_k: int = 5, retrieval_mode: str = "hybrid",
+                                search_filter: Optional[SearchFilter] = None,
+                                nprobe: Optional[int] = None) -> List[List[Tool]]:
+        """
+        一组查询一次向量化，再分散到检索进程和精排进程并行处理
+
+        Args:
+            queries: 查询列表
+            top_n: 粗排阶段检索的切片数量
+            top_m: 粗排后保留的候选工具数量
+            top_k: 最终返回的工具数量
+            retrieval_mode: 切片检索方式，见RAGSystem.search_tools
+            search_filter: 所有查询共用的过滤条件，见RAGSystem.search_tools
+            nprobe: IVF检索每个查询扫描的簇数量，None表示精确检索
+
+        Returns:
+            每个查询的Top K工具列表，与输入顺序一致
+        """
+        if not queries:
+            return []
+        search_filter = search_filter or SearchFilter()
+        if self.redis_service.needs_catalog_check():
+            await self.refresh_index()
+
+        # 整个请求使用同一份共享索引和词法索引，期间替换索引不影响本请求
+        index, lexical_index = self.index, self.lexical_index
+        self._index_users[index] = self._index_users.get(index, 0) + 1
+        try:
+            return await self._search_index(index, lexical_index, queries, top_n, top_m, top_k, retrieval_mode,
+                                            search_filter, nprobe)
+        finally:
+            self._index_users[index] -= 1
+            if not self._index_users[index]:
+                del self._index_users[index]
+                if index in self._retired:
+                    self._release_retired()
+
+    async def _search_index(self, index: SharedIndex, lexical_index: LexicalIndex, queries: List[str],
+                            top_n: int, top_m: int, top_k: int, retrieval_mode: str,
+                            search_filter: SearchFilter, nprobe: Optional[int]) -> List[List[Tool]]:
+        """在给定的共享索引上检索，参数见search_tools_many"""
+        handle = index.handle
+
+        # 1. 词法检索，只有仍需向量检索的查询参与向量化
+        lexical_index = None if retrieval_mode == "vector" else lexical_index
+        lexical_stages = [
+            run_lexical_stage(lexical_index, query, top_n, retrieval_mode, self.lexical_confidence, search_filter)
+            for query in queries
+        ]
+        embed_positions = [i for i, (_, needs_vector) in enumerate(lexical_stages) if needs_vector]
+        query_embeddings = {}
+        if embed_positions:
+            embeddings = await self.embedding_service.get_embeddings([queries[i] for i in embed_positions])
+            query_embeddings = dict(zip(embed_positions, embeddings))
+        search_inputs = [
+            (query_embeddings.get(i), lexical_results) for i, (lexical_results, _) in enumerate(lexical_stages)
+        ]
+
+        # 2. 向量检索、融合和粗排分散到各检索进程
+        candidate_chunks = await asyncio.gather(*(
+            asyncio.wrap_future(self._search_pool.submit(
+                _search_candidates, handle, chunk, top_n, top_m, search_filter, nprobe
+            ))
+            for chunk in _split(search_inputs, self.search_workers)
+        ))
+        candidate_lists = [uuids for chunk in candidate_chunks for uuids in chunk]
+
+        # 3. 精排分散到各精排进程
+        query_chunks = _split(list(zip(queries, candidate_lists)), self.rerank_workers)
+        ranked_chunks = await asyncio.gather(*(
+            asyncio.wrap_future(self._rerank_pool.submit(
+                _rerank, handle, [query for query, _ in chunk], [uuids for _, uuids in chunk], top_k
+            ))
+            for chunk in query_chunks
+        ))
+
+        return [index.get_tools_by_uuids(uuids) for chunk in ranked_chunks for uuids in chunk]
+
+    def shutdown(self):
+        """关闭进程池并释放共享内存"""
+        for pool in (self._search_pool, self._rerank_pool):
+            if pool is not None:
+                pool.shutdown()
+        self._search_pool = self._rerank_pool = None
+        for index in self._retired:
+            index.close()
+        self._retired = []
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+    async def close(self):
+        """关闭进程池并释放共享内存"""
+        await asyncio.to_thread(self.shutdown)
@@ -0,0 +1,227 @@
+"""
+切片向量快照
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import List, Dict, Any, Optional, Callable
+
+import numpy as np
+
+from .slice_store import SliceStore, PartitionedSliceStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+SNAPSHOT_FORMAT = 2
+
+
+class SliceSnapshot:
+    """
+    切片向量存储的磁盘快照
+
+    每个版本是directory下的一个子目录，其中每个命名空间分区一个子目录，包含：
+    matrix.npy（按行归一化的向量矩阵）、scales.npy（仅int8）、keys.npy、uuids.npy、slice_types.npy、tags.npy，
+    以及训练了IVF的分区的ivf_centroids.npy、ivf_offsets.npy、ivf_list_ids.npy；
+    版本目录下的manifest.json记录模型、维度、精度、对应的工具库版本号，以及各分区的命名空间、切片数和校验和。
+    CURRENT文件保存当前版本号，新版本写完整个目录后通过rename替换CURRENT，读取方不会看到写了一半的快照。
+
+    读取时用np.load(mmap_mode="r")映射文件，启动耗时与切片数量无关，
+    同一台机器上的多个工作进程共享操作系统的页缓存。
+    """
+
+    def __init__(self, directory: str, keep: int = 2):
+        """
+        初始化快照目录
+
+        Args:
+            directory: 快照根目录
+            keep: 保留的历史版本数量（含当前版本）
+        """
+        self.directory = directory
+        self.keep = max(int(keep), 1)
+
+    @staticmethod
+    def _checksum(arrays: List[np.ndarray]) -> str:
+        """计算数组内容的sha256"""
+        digest = hashlib.sha256()
+        for array in arrays:
+            digest.update(np.ascontiguousarray(array).data)
+        return digest.hexdigest()
+
+    def current_version(self) -> Optional[str]:
+        """
+        读取当前版本号
+
+        Returns:
+            版本号，尚无快照时为None
+        """
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def read_manifest(self, version: str) -> Dict[str, Any]:
+        """读取指定版本的manifest"""
+        with open(os.path.join(self.directory, version, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write(self, store: PartitionedSliceStore, model: Optional[str]) -> str:
+        """
+        把切片存储写成新版本并切换为当前版本
+
+        Args:
+            store: 按命名空间分区的切片存储
+            model: 生成向量的模型名称，读取时用于校验
+
+        Returns:
+            新版本号
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        version = f"{time.time_ns():020d}"
+
+        # 先写入临时目录，完成后整体rename，保证版本目录要么完整要么不存在
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            partitions = []
+            # 命名空间可能包含任意字符，分区目录按序号命名
+            for number, (namespace, data) in enumerate(sorted(store.export().items())):
+                directory = f"p{number}"
+                partition_dir = os.path.join(tmp_dir, directory)
+                os.mkdir(partition_dir)
+                arrays = {
+                    "matrix": data["matrix"],
+                    "keys": np.array(data["keys"], dtype=str),
+                    "uuids": np.array(data["uuids"], dtype=str),
+                    "slice_types": np.array(data["slice_types"], dtype=str),
+                    "tags": np.array(data["tags"], dtype=str)
+                }
+                if data["scales"] is not None:
+                    arrays["scales"] = data["scales"]
+                if data["ivf"] is not None:
+                    arrays["ivf_centroids"], arrays["ivf_offsets"], arrays["ivf_list_ids"] = data["ivf"]
+                for name, array in arrays.items():
+                    np.save(os.path.join(partition_dir, f"{name}.npy"), array, allow_pickle=False)
+
+                partitions.append({
+                    "namespace": namespace,
+                    "directory": directory,
+                    "count": len(data["keys"]),
+                    "ivf": data["ivf"] is not None,
+                    "ivf_rows": list(data["ivf_rows"]),
+                    "checksum": self._checksum(
+                        [data["matrix"]] + ([data["scales"]] if data["scales"] is not None else [])
+                    )
+                })
+
+            manifest = {
+                "format": SNAPSHOT_FORMAT,
+                "version": version,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "model": model,
+                "dimensions": store.dimensions,
+                "precision": store.precision,
+                "catalog_version": store.catalog_version,
+                "count": sum(partition["count"] for partition in partitions),
+                "partitions": partitions
+            }
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+            os.rename(tmp_dir, os.path.join(self.directory, version))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        # 原子替换CURRENT指针
+        fd, tmp_current = tempfile.mkstemp(prefix=".tmp-", dir=self.directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_current, os.path.join(self.directory, CURRENT_FILE))
+
+        self._prune(version)
+        logger.info("写入切片快照 %s，共 %d 个切片", version, manifest["count"])
+        return version
+
+    def _prune(self, current: str):
+        """删除超出保留数量的旧版本；已映射旧文件的进程在Linux上仍可继续读取"""
+        versions = sorted(
+            name for name in os.listdir(self.directory)
+            if name.isdigit() and os.path.isdir(os.path.join(self.directory, name))
+        )
+        for version in versions[:-self.keep]:
+            if version != current:
+                shutil.rmtree(os.path.join(self.directory, version), ignore_errors=True)
+
+    def load(self, model: Optional[str], dimensions: int, precision: str, rescore_factor: int = 4,
+             vector_loader: Optional[Callable[[List[str]], List[Optional[np.ndarray]]]] = None,
+             version: Optional[str] = None, verify: bool = False) -> Optional[PartitionedSliceStore]:
+        """
+        以内存映射方式打开快照
+
+        Args:
+            model: 期望的向量模型名称
+            dimensions: 期望的向量维度
+            precision: 期望的存储精度
+            rescore_factor: 量化模式下候选数量相对num_results的倍数
+            vector_loader: 按切片key批量读取float32原始向量的函数
+            version: 要打开的版本，默认为当前版本
+            verify: 是否校验矩阵的sha256（需要读取整个矩阵）
+
+        Returns:
+            按命名空间分区的切片存储；快照不存在或与期望的格式、模型、维度、精度不一致时返回None
+        """
+        version = version or self.current_version()
+        if version is None:
+            return None
+
+        try:
+            manifest = self.read_manifest(version)
+        except FileNotFoundError:
+            logger.warning("切片快照 %s 不存在", version)
+            return None
+
+        expected = {"format": SNAPSHOT_FORMAT, "model": model, "dimensions": dimensions, "precision": precision}
+        for field, value in expected.items():
+            if manifest.get(field) != value:
+                logger.warning("切片快照 %s 的%s为%r，期望%r，忽略该快照", version, field, manifest.get(field), value)
+                return None
+
+        partitions = {}
+        for partition in manifest["partitions"]:
+            partition_dir = os.path.join(self.directory, version, partition["directory"])
+
+            def open_array(name: str) -> np.ndarray:
+                return np.load(os.path.join(partition_dir, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+
+            matrix = open_array("matrix")
+            scales = open_array("scales") if precision == "int8" else None
+            if verify:
+                checksum = self._checksum([matrix] + ([scales] if scales is not None else []))
+                if checksum != partition["checksum"]:
+                    logger.warning("切片快照 %s 的分区 %s 校验和不一致，忽略该快照", version, partition["namespace"])
+                    return None
+
+            ivf = None
+            if partition.get("ivf"):
+                ivf = (open_array("ivf_centroids"), open_array("ivf_offsets"), open_array("ivf_list_ids"))
+            ivf_rows = tuple(partition["ivf_rows"]) if "ivf_rows" in partition else None
+            partitions[partition["namespace"]] = SliceStore.from_arrays(
+                matrix, open_array("keys"), open_array("uuids"), open_array("slice_types"),
+                scales=scales, precision=precision, rescore_factor=rescore_factor, vector_loader=vector_loader,
+                tags=open_array("tags"), ivf=ivf, ivf_rows=ivf_rows
+            )
+
+        store = PartitionedSliceStore(
+            dimensions=dimensions, precision=precision, rescore_factor=rescore_factor,
+            vector_loader=vector_loader, partitions=partitions
+        )
+        store.snapshot_version = version
+        store.catalog_version = manifest.get("catalog_version")
+        return store
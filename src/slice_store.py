@@ -0,0 +1,1257 @@
+"""
+进程内切片向量存储
+"""
+import threading
+from typing import List, Dict, Any, Optional, Sequence, Callable, Tuple, Set
+
+import numpy as np
+
+from .models import SearchFilter
+
+# 支持的存储精度
+PRECISIONS = ("float32", "float16", "int8")
+
+# 量化矩阵逐块转换后参与乘法，限制临时内存
+_SCORE_CHUNK_ROWS = 256
+
+# 按过滤结果取出float32行时每块的行数，限制拷贝的临时内存
+_GATHER_CHUNK_ROWS = 8192
+
+# 批量检索时一次计算的得分矩阵元素数上限（查询数 x 切片数），约256MB
+_BATCH_SCORE_ELEMENTS = 1 << 26
+
+# IVF训练时每个簇最多使用的样本数
+_IVF_TRAIN_ROWS_PER_LIST = 64
+
+# 分区训练IVF时每个簇平均至少包含的切片数，切片更少时减少簇的数量
+_IVF_MIN_LIST_ROWS = 32
+
+
+class SliceStore:
+    """
+    进程内切片向量存储
+
+    所有切片向量保存在一块连续的、按行归一化的矩阵中，
+    并用并行数组记录每一行对应的切片key、工具UUID和切片类型。
+    检索时只需一次矩阵-向量乘法，再用argpartition取Top N。
+    另外为每行维护整数工具ID和切片类型编码，粗排可以直接在行号数组上按工具聚合，不必为每个切片构造字典。
+    按标签或切片类型过滤时，先在这两个数组上筛出满足条件的行，只有这些行参与相似度计算。
+
+    矩阵可以用float16或int8存储以节省内存（分别为float32的1/2和约1/4）：
+    int8模式下每行按自身最大绝对值缩放，查询向量同样量化，点积按int32累加。
+    量化模式先在压缩向量上取 num_results * rescore_factor 条候选，
+    再通过vector_loader读取这些切片的float32原始向量重新打分，最终的Top N与精确检索基本一致。
+
+    可选的IVF倒排索引（train_ivf）把切片按k-means簇在矩阵中连续存放，
+    检索时只计算与查询最相似的nprobe个簇内的切片，扫描量约为 nprobe / 簇数。
+    之后写入的切片分配到已有的簇，ivf_drift记录训练以来变化的行数占比，供判断是否需要重新训练。
+    """
+
+    def __init__(self, dimensions: int = 1024, initial_capacity: int = 1024,
+                 precision: str = "float32", rescore_factor: int = 4,
+                 vector_loader: Optional[Callable[[List[str]], List[Optional[np.ndarray]]]] = None):
+        """
+        初始化切片存储
+
+        Args:
+            dimensions: 向量维度
+            initial_capacity: 初始预分配的行数
+            precision: 存储精度，'float32'、'float16'或'int8'
+            rescore_factor: 量化模式下候选数量相对num_results的倍数
+            vector_loader: 按切片key批量读取float32原始向量的函数，读取不到的位置返回None；
+                为None时量化模式直接返回近似得分
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"不支持的存储精度: {precision}")
+
+        self.dimensions = dimensions
+        self.precision = precision
+        self.rescore_factor = max(int(rescore_factor), 1)
+        self.vector_loader = vector_loader
+        capacity = max(int(initial_capacity), 1)
+        self._matrix = np.zeros((capacity, dimensions), dtype=precision)
+        # int8模式下每行的缩放系数：原始值 ≈ 码值 * scale
+        self._scales = np.zeros(capacity, dtype=np.float32) if precision == "int8" else None
+        self._keys = np.empty(capacity, dtype=object)
+        self._uuids = np.empty(capacity, dtype=object)
+        self._slice_types = np.empty(capacity, dtype=object)
+        # 每行的整数工具ID和切片类型编码，分别是tool_uuids和slice_type_names的下标
+        self._tool_ids = np.zeros(capacity, dtype=np.int32)
+        self._type_codes = np.zeros(capacity, dtype=np.int8)
+        self.tool_uuids: List[str] = []
+        self.slice_type_names: List[Optional[str]] = [None]
+        self._tool_id_of: Dict[str, int] = {}
+        self._type_code_of: Dict[Optional[str], int] = {None: 0}
+        # 每个工具的标签（下标为工具ID），以及标签 -> 工具ID集合的倒排
+        self._tool_tags: List[Tuple[str, ...]] = []
+        self._tools_with_tag: Dict[str, Set[int]] = {}
+        # from_arrays构建时每行的标签（逗号分隔），用于延迟生成_tool_tags
+        self._row_tags: Optional[np.ndarray] = None
+        self._row_of: Optional[Dict[str, int]] = {}
+        self._writable = True
+        self._size = 0
+        self._lock = threading.Lock()
+        # IVF倒排索引：归一化的簇中心、每行所属的簇，以及训练时按簇重排后各簇连续块的起止行号
+        self.ivf_centroids: Optional[np.ndarray] = None
+        self._list_ids: Optional[np.ndarray] = None
+        self._list_offsets: Optional[np.ndarray] = None
+        # 不在所属簇连续块内的行（训练后新增的行、删除时被移动的行）及其按簇分组的边界，写入后延迟重建
+        self._misplaced: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        # 训练（或建立）IVF时的行数，以及此后插入、覆盖和删除的行数
+        self.ivf_trained_rows = 0
+        self.ivf_changed_rows = 0
+        # 从磁盘快照打开时记录快照版本
+        self.snapshot_version: Optional[str] = None
+
+    @classmethod
+    def from_arrays(cls, matrix: np.ndarray, keys: np.ndarray, uuids: np.ndarray, slice_types: np.ndarray,
+                    scales: Optional[np.ndarray] = None, precision: str = "float32", rescore_factor: int = 4,
+                    vector_loader: Optional[Callable[[List[str]], List[Optional[np.ndarray]]]] = None,
+                    tags: Optional[np.ndarray] = None,
+                    ivf: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+                    ivf_rows: Optional[Tuple[int, int]] = None) -> "SliceStore":
+        """
+        直接使用已有数组构建存储，例如内存映射的快照文件
+
+        数组不会被复制，检索直接读取；首次写入时才复制为进程私有的可写数组。
+
+        Args:
+            matrix: 已按行归一化（并按precision量化）的向量矩阵
+            keys: 每行的切片key
+            uuids: 每行的工具UUID
+            slice_types: 每行的切片类型，空字符串表示无类型
+            scales: int8模式下每行的缩放系数
+            precision: 存储精度
+            rescore_factor: 量化模式下候选数量相对num_results的倍数
+            vector_loader: 按切片key批量读取float32原始向量的函数
+            tags: 每行所属工具的标签，逗号分隔，None表示均无标签
+            ivf: 已训练的IVF索引 (簇中心, 各簇连续块的起止行号, 每行所属的簇)，见export
+            ivf_rows: (训练时的行数, 训练以来变化的行数)，默认视为刚训练完成
+
+        Returns:
+            切片存储
+        """
+        store = cls(dimensions=matrix.shape[1], initial_capacity=1, precision=precision,
+                    rescore_factor=rescore_factor, vector_loader=vector_loader)
+        store._matrix = matrix
+        store._scales = scales
+        store._keys = keys
+        store._uuids = uuids
+        store._slice_types = slice_types
+        store._row_tags = tags
+        store._size = len(keys)
+        if ivf is not None:
+            store.ivf_centroids, store._list_offsets, store._list_ids = ivf
+            store.ivf_trained_rows, store.ivf_changed_rows = ivf_rows or (len(keys), 0)
+        # key -> 行号的索引和整数工具ID都延迟到首次使用时再建立，打开快照的耗时与切片数量无关
+        store._row_of = None
+        store._tool_ids = None
+        store._type_codes = None
+        store._writable = False
+        return store
+
+    def __len__(self) -> int:
+        return self._size
+
+    def keys(self) -> List[str]:
+        """全部切片的key"""
+        with self._lock:
+            return [str(key) for key in self._keys[:self._size]]
+
+    def _ensure_row_index(self):
+        """建立key -> 行号的索引，调用方持有锁"""
+        if self._row_of is None:
+            self._row_of = {str(key): row for row, key in enumerate(self._keys[:self._size])}
+
+    def _ensure_ids(self):
+        """
+        为from_arrays构建的存储生成每行的整数工具ID和切片类型编码，调用方持有锁
+
+        用np.unique一次完成编码，不逐行查字典。
+        """
+        if self._tool_ids is not None:
+            return
+
+        size = self._size
+        tool_uuids, first_rows, tool_ids = np.unique(
+            np.asarray(self._uuids[:size], dtype=str), return_index=True, return_inverse=True
+        )
+        type_names, type_codes = np.unique(np.asarray(self._slice_types[:size], dtype=str), return_inverse=True)
+
+        self.tool_uuids = [str(uuid) for uuid in tool_uuids]
+        self._tool_id_of = {uuid: tool_id for tool_id, uuid in enumerate(self.tool_uuids)}
+        # 编码0固定表示无类型；空字符串排序后总在最前
+        names = [str(name) for name in type_names]
+        if names and names[0] == "":
+            names = names[1:]
+        else:
+            type_codes = type_codes + 1
+        self.slice_type_names = [None] + names
+        self._type_code_of = {name: code for code, name in enumerate(self.slice_type_names)}
+
+        # 标签属于工具，取每个工具第一行记录的标签
+        self._tool_tags = []
+        self._tools_with_tag = {}
+        for tool_id, row in enumerate(first_rows):
+            tags = ()
+            if self._row_tags is not None:
+                tags = tuple(tag for tag in str(self._row_tags[row]).split(",") if tag)
+            self._tool_tags.append(tags)
+            for tag in tags:
+                self._tools_with_tag.setdefault(tag, set()).add(tool_id)
+
+        # _tool_ids最后赋值，未持锁的读取方看到它时其余字段都已就绪
+        self._type_codes = type_codes.astype(np.int8).reshape(size)
+        self._tool_ids = tool_ids.astype(np.int32).reshape(size)
+
+    def _tool_id(self, uuid: str) -> int:
+        """取工具UUID的整数ID，不存在时分配新ID，调用方持有锁"""
+        tool_id = self._tool_id_of.get(uuid)
+        if tool_id is None:
+            tool_id = self._tool_id_of[uuid] = len(self.tool_uuids)
+            self.tool_uuids.append(uuid)
+            self._tool_tags.append(())
+        return tool_id
+
+    def _set_tool_tags(self, tool_id: int, tags: Sequence[str]):
+        """更新工具的标签及倒排，调用方持有锁"""
+        tags = tuple(tags)
+        old_tags = self._tool_tags[tool_id]
+        if tags == old_tags:
+            return
+        for tag in old_tags:
+            self._tools_with_tag[tag].discard(tool_id)
+        for tag in tags:
+            self._tools_with_tag.setdefault(tag, set()).add(tool_id)
+        self._tool_tags[tool_id] = tags
+
+    def _type_code(self, slice_type: Optional[str]) -> int:
+        """取切片类型的编码，不存在时分配新编码，调用方持有锁"""
+        slice_type = slice_type or None
+        code = self._type_code_of.get(slice_type)
+        if code is None:
+            code = self._type_code_of[slice_type] = len(self.slice_type_names)
+            self.slice_type_names.append(slice_type)
+        return code
+
+    def _ensure_writable(self):
+        """由from_arrays构建的存储在首次写入前复制为可写数组，并建立key索引"""
+        if self._writable:
+            return
+
+        self._ensure_ids()
+        size = self._size
+        capacity = max(size, 1)
+        matrix = np.zeros((capacity, self.dimensions), dtype=self._matrix.dtype)
+        matrix[:size] = self._matrix[:size]
+        if self._scales is not None:
+            scales = np.zeros(capacity, dtype=np.float32)
+            scales[:size] = self._scales[:size]
+            self._scales = scales
+
+        keys = np.empty(capacity, dtype=object)
+        keys[:size] = [str(key) for key in self._keys[:size]]
+        uuids = np.empty(capacity, dtype=object)
+        uuids[:size] = [str(uuid) for uuid in self._uuids[:size]]
+        slice_types = np.empty(capacity, dtype=object)
+        slice_types[:size] = [str(slice_type) or None for slice_type in self._slice_types[:size]]
+        tool_ids = np.zeros(capacity, dtype=np.int32)
+        tool_ids[:size] = self._tool_ids[:size]
+        type_codes = np.zeros(capacity, dtype=np.int8)
+        type_codes[:size] = self._type_codes[:size]
+        if self._list_ids is not None:
+            list_ids = np.zeros(capacity, dtype=np.int32)
+            list_ids[:size] = self._list_ids[:size]
+            self._list_ids = list_ids
+            self._list_offsets = np.array(self._list_offsets)
+            self.ivf_centroids = np.array(self.ivf_centroids)
+
+        self._matrix, self._keys, self._uuids, self._slice_types = matrix, keys, uuids, slice_types
+        self._tool_ids, self._type_codes = tool_ids, type_codes
+        self._ensure_row_index()
+        self._writable = True
+
+    def export(self) -> Dict[str, Any]:
+        """
+        导出存储内容的副本，用于写入快照
+
+        Returns:
+            包含matrix、scales、keys、uuids、slice_types、tags、ivf、ivf_rows的字典，keys~tags为字符串列表；
+            ivf为 (簇中心, 各簇连续块的起止行号, 每行所属的簇)，未训练IVF时为None；
+            ivf_rows为 (训练时的行数, 训练以来变化的行数)
+        """
+        with self._lock:
+            self._ensure_ids()
+            size = self._size
+            tool_tags = [",".join(tags) for tags in self._tool_tags]
+            ivf = None
+            if self.ivf_centroids is not None:
+                ivf = (np.array(self.ivf_centroids), np.array(self._list_offsets), np.array(self._list_ids[:size]))
+            return {
+                "matrix": np.array(self._matrix[:size]),
+                "scales": np.array(self._scales[:size]) if self._scales is not None else None,
+                "keys": [str(key) for key in self._keys[:size]],
+                "uuids": [str(uuid) for uuid in self._uuids[:size]],
+                "slice_types": [str(slice_type) if slice_type else "" for slice_type in self._slice_types[:size]],
+                "tags": [tool_tags[tool_id] for tool_id in self._tool_ids[:size]],
+                "ivf": ivf,
+                "ivf_rows": (self.ivf_trained_rows, self.ivf_changed_rows)
+            }
+
+    def copy(self) -> "SliceStore":
+        """
+        复制出一个独立的存储，例如在副本上重新训练IVF，完成后再替换正在检索的存储
+
+        Returns:
+            内容相同的切片存储，首次写入时才转为可写数组
+        """
+        data = self.export()
+        return SliceStore.from_arrays(
+            data["matrix"], np.array(data["keys"], dtype=object), np.array(data["uuids"], dtype=object),
+            np.array(data["slice_types"], dtype=object), scales=data["scales"], precision=self.precision,
+            rescore_factor=self.rescore_factor, vector_loader=self.vector_loader,
+            tags=np.array(data["tags"], dtype=object), ivf=data["ivf"], ivf_rows=data["ivf_rows"]
+        )
+
+    @property
+    def quantized(self) -> bool:
+        """是否以压缩精度存储"""
+        return self.precision != "float32"
+
+    @property
+    def ivf_lists(self) -> int:
+        """IVF簇的数量，未训练时为0"""
+        return 0 if self.ivf_centroids is None else len(self.ivf_centroids)
+
+    @property
+    def ivf_drift(self) -> float:
+        """训练IVF以来变化的行数相对训练时行数的比例，未训练时为0"""
+        if self.ivf_centroids is None:
+            return 0.0
+        return self.ivf_changed_rows / max(self.ivf_trained_rows, 1)
+
+    @property
+    def nbytes(self) -> int:
+        """向量矩阵（含缩放系数）占用的字节数"""
+        size = self._matrix.nbytes
+        if self._scales is not None:
+            size += self._scales.nbytes
+        return size
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """按行L2归一化，零向量保持不变"""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @staticmethod
+    def _quantize_int8(vectors: np.ndarray):
+        """
+        按行对称量化为int8
+
+        Args:
+            vectors: float32矩阵，形状为 (n, dimensions)
+
+        Returns:
+            (int8码值, 每行缩放系数)
+        """
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def _scores(self, query_vec: np.ndarray, size: int, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        计算查询向量与前size行（或指定行）的相似度
+
+        Args:
+            query_vec: 归一化后的float32查询向量
+            size: 参与计算的行数
+            rows: 只计算这些行，None表示前size行全部计算
+
+        Returns:
+            float32相似度数组，与rows一一对应
+        """
+        if self.precision == "float32":
+            if rows is None:
+                return self._matrix[:size] @ query_vec
+            scores = np.empty(len(rows), dtype=np.float32)
+            for start in range(0, len(rows), _GATHER_CHUNK_ROWS):
+                chunk_rows = rows[start:start + _GATHER_CHUNK_ROWS]
+                scores[start:start + len(chunk_rows)] = self._matrix[chunk_rows] @ query_vec
+            return scores
+
+        count = size if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        if self.precision == "int8":
+            query_codes, query_scale = self._quantize_int8(query_vec[None, :])
+            # 每个乘积不超过127*127，维度不超过1040时整行点积小于2^24，
+            # 用float32累加与int32累加结果完全相同，且可以走BLAS；维度更大时使用int32
+            exact_in_float32 = self.dimensions * 127 * 127 < 2 ** 24
+            acc_dtype = np.float32 if exact_in_float32 else np.int32
+            query_acc = query_codes[0].astype(acc_dtype)
+        else:
+            acc_dtype = np.float32
+            query_acc = query_vec
+
+        buffer = np.empty((_SCORE_CHUNK_ROWS, self.dimensions), dtype=acc_dtype)
+        for start in range(0, count, _SCORE_CHUNK_ROWS):
+            block = self._row_block(start, min(start + _SCORE_CHUNK_ROWS, count), rows)
+            chunk = buffer[:len(block)]
+            chunk[...] = block
+            scores[start:start + len(block)] = chunk @ query_acc
+
+        if self.precision == "int8":
+            scores *= (self._scales[:size] if rows is None else self._scales[rows]) * query_scale[0]
+        return scores
+
+    def _row_block(self, start: int, end: int, rows: Optional[np.ndarray]) -> np.ndarray:
+        """取第start~end个参与计算的行：rows为None时是连续切片，否则按行号取出"""
+        return self._matrix[start:end] if rows is None else self._matrix[rows[start:end]]
+
+    def _scores_many(self, query_vecs: np.ndarray, size: int, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        一次矩阵-矩阵乘法计算多个查询向量与前size行（或指定行）的相似度
+
+        Args:
+            query_vecs: 归一化后的float32查询矩阵，形状为 (q, dimensions)
+            size: 参与计算的行数
+            rows: 只计算这些行，None表示前size行全部计算
+
+        Returns:
+            float32相似度矩阵，形状为 (q, 参与计算的行数)
+        """
+        if self.precision == "float32":
+            if rows is None:
+                return query_vecs @ self._matrix[:size].T
+            scores = np.empty((len(query_vecs), len(rows)), dtype=np.float32)
+            for start in range(0, len(rows), _GATHER_CHUNK_ROWS):
+                chunk_rows = rows[start:start + _GATHER_CHUNK_ROWS]
+                scores[:, start:start + len(chunk_rows)] = query_vecs @ self._matrix[chunk_rows].T
+            return scores
+
+        count = size if rows is None else len(rows)
+        scores = np.empty((len(query_vecs), count), dtype=np.float32)
+        if self.precision == "int8":
+            query_codes, query_scales = self._quantize_int8(query_vecs)
+            # 累加精度的取舍与_scores相同
+            exact_in_float32 = self.dimensions * 127 * 127 < 2 ** 24
+            acc_dtype = np.float32 if exact_in_float32 else np.int32
+            query_acc = query_codes.astype(acc_dtype)
+        else:
+            acc_dtype = np.float32
+            query_acc = query_vecs
+
+        buffer = np.empty((_SCORE_CHUNK_ROWS, self.dimensions), dtype=acc_dtype)
+        for start in range(0, count, _SCORE_CHUNK_ROWS):
+            block = self._row_block(start, min(start + _SCORE_CHUNK_ROWS, count), rows)
+            chunk = buffer[:len(block)]
+            chunk[...] = block
+            scores[:, start:start + len(block)] = query_acc @ chunk.T
+
+        if self.precision == "int8":
+            row_scales = self._scales[:size] if rows is None else self._scales[rows]
+            scores *= row_scales[None, :] * query_scales[:, None]
+        return scores
+
+    @staticmethod
+    def _top_rows_many(scores: np.ndarray, k: int) -> np.ndarray:
+        """对得分矩阵的每一行取得分最高的k列，按得分降序排列"""
+        size = scores.shape[1]
+        if k < size:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(size), scores.shape)
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+        return np.take_along_axis(top, order, axis=1)
+
+    @staticmethod
+    def _top_rows(scores: np.ndarray, k: int) -> np.ndarray:
+        """取得分最高的k行，按得分降序排列"""
+        size = len(scores)
+        if k < size:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(size)
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def _load_exact(self, rows: np.ndarray):
+        """
+        读取候选行的float32原始向量
+
+        Args:
+            rows: 候选行号
+
+        Returns:
+            (读取到向量的位置列表, 对应的归一化向量矩阵)
+        """
+        vectors = self.vector_loader([str(self._keys[row]) for row in rows])
+        found = [i for i, vector in enumerate(vectors) if vector is not None and len(vector) == self.dimensions]
+        exact = np.asarray([vectors[i] for i in found], dtype=np.float32).reshape(len(found), self.dimensions)
+        return found, self._normalize(exact)
+
+    def _rescore(self, rows: np.ndarray, approx_scores: np.ndarray, query_vec: np.ndarray) -> np.ndarray:
+        """
+        用float32原始向量重新计算候选行的相似度
+
+        Args:
+            rows: 候选行号
+            approx_scores: 候选行的近似得分
+            query_vec: 归一化后的float32查询向量
+
+        Returns:
+            候选行的得分，读取不到原始向量的行保留近似得分
+        """
+        scores = approx_scores.astype(np.float32)
+        found, exact = self._load_exact(rows)
+        if found:
+            scores[found] = exact @ query_vec
+        return scores
+
+    def _ensure_capacity(self, required: int):
+        """容量不足时按倍数扩容，保证插入的均摊代价为O(1)"""
+        capacity = self._matrix.shape[0]
+        if required <= capacity:
+            return
+
+        new_capacity = max(required, capacity * 2)
+        matrix = np.zeros((new_capacity, self.dimensions), dtype=self._matrix.dtype)
+        matrix[:self._size] = self._matrix[:self._size]
+        if self._scales is not None:
+            scales = np.zeros(new_capacity, dtype=np.float32)
+            scales[:self._size] = self._scales[:self._size]
+            self._scales = scales
+
+        keys = np.empty(new_capacity, dtype=object)
+        keys[:self._size] = self._keys[:self._size]
+        uuids = np.empty(new_capacity, dtype=object)
+        uuids[:self._size] = self._uuids[:self._size]
+        slice_types = np.empty(new_capacity, dtype=object)
+        slice_types[:self._size] = self._slice_types[:self._size]
+        tool_ids = np.zeros(new_capacity, dtype=np.int32)
+        tool_ids[:self._size] = self._tool_ids[:self._size]
+        type_codes = np.zeros(new_capacity, dtype=np.int8)
+        type_codes[:self._size] = self._type_codes[:self._size]
+        if self._list_ids is not None:
+            list_ids = np.zeros(new_capacity, dtype=np.int32)
+            list_ids[:self._size] = self._list_ids[:self._size]
+            self._list_ids = list_ids
+
+        self._matrix, self._keys, self._uuids, self._slice_types = matrix, keys, uuids, slice_types
+        self._tool_ids, self._type_codes = tool_ids, type_codes
+
+    def upsert(self, keys: Sequence[str], uuids: Sequence[str],
+               slice_types: Sequence[Optional[str]], embeddings: Any,
+               tags: Optional[Sequence[Sequence[str]]] = None):
+        """
+        插入或覆盖切片
+
+        Args:
+            keys: 切片在Redis中的key，用于定位已有的行
+            uuids: 切片对应的工具UUID
+            slice_types: 切片类型
+            embeddings: 切片向量，形状为 (n, dimensions)
+            tags: 每个切片所属工具的标签，None表示不修改工具已有的标签
+        """
+        if len(keys) == 0:
+            return
+
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(keys), self.dimensions)
+        vectors = self._normalize(vectors)
+        # 已训练IVF时新切片直接分配到最近的簇，不重新训练
+        centroids = self.ivf_centroids
+        list_ids = self._nearest_lists(vectors, centroids) if centroids is not None else None
+        scales = None
+        if self.precision == "int8":
+            vectors, scales = self._quantize_int8(vectors)
+        elif self.precision == "float16":
+            vectors = vectors.astype(np.float16)
+
+        with self._lock:
+            self._ensure_writable()
+            self._ensure_capacity(self._size + len(keys))
+            for i, (key, uuid, slice_type) in enumerate(zip(keys, uuids, slice_types)):
+                row = self._row_of.get(key)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._row_of[key] = row
+                    self._keys[row] = key
+                self._matrix[row] = vectors[i]
+                if scales is not None:
+                    self._scales[row] = scales[i]
+                self._uuids[row] = uuid
+                self._slice_types[row] = slice_type
+                self._tool_ids[row] = self._tool_id(uuid)
+                self._type_codes[row] = self._type_code(slice_type)
+                if tags is not None:
+                    self._set_tool_tags(self._tool_ids[row], tags[i])
+                if list_ids is not None:
+                    self._list_ids[row] = list_ids[i]
+            if list_ids is not None:
+                self.ivf_changed_rows += len(keys)
+            self._misplaced = None
+
+    def remove(self, keys: Sequence[str]):
+        """
+        删除切片，用最后一行填补空位以保持矩阵连续
+
+        Args:
+            keys: 要删除的切片key
+        """
+        with self._lock:
+            self._ensure_writable()
+            for key in keys:
+                row = self._row_of.pop(key, None)
+                if row is None:
+                    continue
+
+                last = self._size - 1
+                if row != last:
+                    last_key = self._keys[last]
+                    self._matrix[row] = self._matrix[last]
+                    if self._scales is not None:
+                        self._scales[row] = self._scales[last]
+                    self._keys[row] = last_key
+                    self._uuids[row] = self._uuids[last]
+                    self._slice_types[row] = self._slice_types[last]
+                    self._tool_ids[row] = self._tool_ids[last]
+                    self._type_codes[row] = self._type_codes[last]
+                    if self._list_ids is not None:
+                        self._list_ids[row] = self._list_ids[last]
+                    self._row_of[last_key] = row
+
+                self._keys[last] = None
+                self._uuids[last] = None
+                self._slice_types[last] = None
+                self._size = last
+                if self.ivf_centroids is not None:
+                    self.ivf_changed_rows += 1
+            self._misplaced = None
+
+    def clear(self):
+        """清空所有切片"""
+        with self._lock:
+            self._ensure_writable()
+            self._keys[:self._size] = None
+            self._uuids[:self._size] = None
+            self._slice_types[:self._size] = None
+            self._row_of.clear()
+            self.tool_uuids = []
+            self._tool_id_of = {}
+            self.slice_type_names = [None]
+            self._type_code_of = {None: 0}
+            self._tool_tags = []
+            self._tools_with_tag = {}
+            # 保留簇中心，之后写入的切片仍按簇分配
+            if self._list_offsets is not None:
+                self._list_offsets = np.zeros_like(self._list_offsets)
+                self.ivf_changed_rows += self._size
+            self._size = 0
+            self._misplaced = None
+
+    @staticmethod
+    def _nearest_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """分块计算每个向量最相似的簇；向量无需归一化，按行缩放不改变最相似的簇"""
+        list_ids = np.empty(len(vectors), dtype=np.int32)
+        block = max(1, _BATCH_SCORE_ELEMENTS // len(centroids))
+        for start in range(0, len(vectors), block):
+            chunk = np.asarray(vectors[start:start + block], dtype=np.float32)
+            list_ids[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        return list_ids
+
+    def _dequantize(self, rows: np.ndarray) -> np.ndarray:
+        """取指定行的float32向量（量化模式下为近似值）"""
+        vectors = self._matrix[rows].astype(np.float32)
+        if self._scales is not None:
+            vectors *= self._scales[rows][:, None]
+        return vectors
+
+    def _permute(self, order: np.ndarray):
+        """按order重排前size行的全部并行数组并重建key索引，调用方持有锁"""
+        size = self._size
+        self._matrix[:size] = self._matrix[order]
+        if self._scales is not None:
+            self._scales[:size] = self._scales[order]
+        for array in (self._keys, self._uuids, self._slice_types, self._tool_ids, self._type_codes):
+            array[:size] = array[order]
+        self._row_of = None
+        self._ensure_row_index()
+
+    def train_ivf(self, num_lists: int, iterations: int = 10, seed: int = 0):
+        """
+        训练IVF倒排索引
+
+        在抽样的切片向量上做球面k-means（余弦相似度），把全部行分配到最近的簇，
+        再按簇重排矩阵，使每个簇的切片成为一段连续的行。之后写入的切片直接分配到最近的簇，
+        不在所属簇连续块内的行单独记录，检索结果不受影响；ivf_drift较大、簇的分布明显变化后可重新训练。
+        重排会改变行号，应在存储对外提供检索之前调用（或在copy出的副本上调用）。
+
+        Args:
+            num_lists: 簇的数量，常取切片数的平方根附近
+            iterations: k-means迭代次数
+            seed: 抽样和初始化簇中心的随机种子
+        """
+        with self._lock:
+            self._ensure_writable()
+            size = self._size
+            num_lists = min(int(num_lists), size)
+            if num_lists <= 0:
+                return
+
+            rng = np.random.default_rng(seed)
+            sample_size = min(size, num_lists * _IVF_TRAIN_ROWS_PER_LIST)
+            sample = self._normalize(self._dequantize(np.sort(rng.choice(size, sample_size, replace=False))))
+            centroids = sample[rng.choice(sample_size, num_lists, replace=False)]
+            for _ in range(iterations):
+                assignment = self._nearest_lists(sample, centroids)
+                counts = np.bincount(assignment, minlength=num_lists)
+                order = np.argsort(assignment, kind="stable")
+                nonempty = np.flatnonzero(counts)
+                starts = (np.cumsum(counts) - counts)[nonempty]
+                sums = np.zeros_like(centroids)
+                sums[nonempty] = np.add.reduceat(sample[order], starts, axis=0)
+                # 空簇用随机样本重新初始化
+                empty = np.flatnonzero(counts == 0)
+                if len(empty):
+                    sums[empty] = sample[rng.choice(sample_size, len(empty))]
+                centroids = self._normalize(sums)
+            self._assign_ivf(centroids.astype(np.float32))
+
+    def set_ivf(self, centroids: np.ndarray):
+        """
+        使用已有的簇中心建立IVF倒排索引，不做k-means
+
+        用于重新加载切片后沿用之前训练的簇中心：全部行分配到最近的簇并按簇重排。
+        与train_ivf一样会改变行号。
+
+        Args:
+            centroids: 簇中心，形状为 (簇数量, dimensions)
+        """
+        with self._lock:
+            self._ensure_writable()
+            self._assign_ivf(self._normalize(np.asarray(centroids, dtype=np.float32)))
+
+    def _assign_ivf(self, centroids: np.ndarray):
+        """把全部行分配到最近的簇并按簇重排，重置漂移计数，调用方持有锁"""
+        size = self._size
+        num_lists = len(centroids)
+        # 全部行分块分配到最近的簇，量化矩阵按行缩放同样不影响结果
+        list_ids = np.empty(size, dtype=np.int32)
+        for start in range(0, size, _GATHER_CHUNK_ROWS):
+            end = min(start + _GATHER_CHUNK_ROWS, size)
+            list_ids[start:end] = self._nearest_lists(self._matrix[start:end], centroids)
+
+        order = np.argsort(list_ids, kind="stable")
+        self._permute(order)
+        self._list_ids = np.zeros(self._matrix.shape[0], dtype=np.int32)
+        self._list_ids[:size] = list_ids[order]
+        self._list_offsets = np.zeros(num_lists + 1, dtype=np.int64)
+        self._list_offsets[1:] = np.cumsum(np.bincount(list_ids, minlength=num_lists))
+        self.ivf_centroids = centroids
+        self.ivf_trained_rows = size
+        self.ivf_changed_rows = 0
+        self._misplaced = None
+
+    def _ensure_misplaced(self):
+        """找出不在所属簇连续块内的行并按簇分组，调用方持有锁"""
+        if self._misplaced is not None:
+            return
+        size = self._size
+        offsets = self._list_offsets
+        # 每行所在的连续块，训练之后新增的行不在任何块内
+        home = np.full(size, -1, dtype=np.int32)
+        blocked = min(int(offsets[-1]), size)
+        home[:blocked] = np.repeat(np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets))[:blocked]
+        list_ids = self._list_ids[:size]
+        rows = np.flatnonzero(home != list_ids)
+        rows = rows[np.argsort(list_ids[rows], kind="stable")]
+        self._misplaced = (rows, np.searchsorted(list_ids[rows], np.arange(len(offsets))))
+
+    def _probe_lists(self, query_vecs: np.ndarray, nprobe: Optional[int]) -> Optional[np.ndarray]:
+        """
+        每个查询要扫描的簇
+
+        Returns:
+            形状为 (q, nprobe) 的簇编号；未训练IVF、未指定nprobe或nprobe覆盖全部簇时返回None，即精确检索
+        """
+        centroids = self.ivf_centroids
+        if nprobe is None or centroids is None or nprobe >= len(centroids):
+            return None
+        return self._top_rows_many(query_vecs @ centroids.T, max(int(nprobe), 1))
+
+    def _list_rows(self, lists: np.ndarray) -> np.ndarray:
+        """
+        取若干簇的全部行号
+
+        Args:
+            lists: 簇编号
+
+        Returns:
+            升序行号数组：各簇连续块中仍属于该簇的行，加上该簇不在块内的行
+        """
+        with self._lock:
+            self._ensure_misplaced()
+            size = self._size
+            offsets, list_ids = self._list_offsets, self._list_ids
+            misplaced, bounds = self._misplaced
+            parts = []
+            for list_id in lists:
+                start, end = int(offsets[list_id]), min(int(offsets[list_id + 1]), size)
+                if start < end:
+                    block = np.arange(start, end)
+                    parts.append(block[list_ids[start:end] == list_id])
+                parts.append(misplaced[bounds[list_id]:bounds[list_id + 1]])
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def _intersect(candidates: Optional[np.ndarray], rows: np.ndarray) -> np.ndarray:
+        """过滤条件筛出的行与IVF簇内的行取交集，两者均为升序"""
+        return rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+
+    def filter_rows(self, search_filter: Optional[SearchFilter]) -> Optional[np.ndarray]:
+        """
+        按标签和切片类型筛选行，命名空间由调用方选择分区时处理
+
+        只在整数工具ID和切片类型编码上做布尔运算，不读取向量矩阵。
+
+        Args:
+            search_filter: 过滤条件
+
+        Returns:
+            满足条件的行号数组（升序），不需要筛选时返回None
+        """
+        if search_filter is None or not search_filter.restricts_slices:
+            return None
+
+        with self._lock:
+            self._ensure_ids()
+            size = self._size
+            mask = np.ones(size, dtype=bool)
+            if search_filter.slice_types is not None:
+                allowed_types = np.zeros(len(self.slice_type_names), dtype=bool)
+                for slice_type in search_filter.slice_types:
+                    code = self._type_code_of.get(slice_type or None)
+                    if code is not None:
+                        allowed_types[code] = True
+                mask &= allowed_types[self._type_codes[:size]]
+            if search_filter.tags is not None:
+                allowed_tools = np.zeros(len(self.tool_uuids), dtype=bool)
+                for tag in search_filter.tags:
+                    allowed_tools[list(self._tools_with_tag.get(tag, ()))] = True
+                mask &= allowed_tools[self._tool_ids[:size]]
+        return np.flatnonzero(mask)
+
+    def search_rows(self, query_embedding: List[float], num_results: int = 100,
+                    search_filter: Optional[SearchFilter] = None,
+                    nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        检索与查询向量最相似的切片，只返回行号和得分
+
+        Args:
+            query_embedding: 查询向量
+            num_results: 返回结果数量
+            search_filter: 过滤条件，只有满足条件的行参与相似度计算
+            nprobe: 已训练IVF时只扫描最相似的nprobe个簇，None表示精确检索全部行
+
+        Returns:
+            (行号数组, 得分数组)，按余弦相似度降序排列；量化模式且未配置vector_loader时为近似得分
+        """
+        size = self._size
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query_vec)
+        if query_norm > 0:
+            query_vec = query_vec / query_norm
+
+        candidates = self.filter_rows(search_filter)
+        lists = self._probe_lists(query_vec[None, :], nprobe)
+        if lists is not None:
+            candidates = self._intersect(candidates, self._list_rows(lists[0]))
+        count = size if candidates is None else len(candidates)
+        if count == 0 or num_results <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        # 一次矩阵-向量乘法得到全部（或筛选后）余弦相似度
+        scores = self._scores(query_vec, size, candidates)
+
+        # argpartition取Top N，只对这N个结果排序
+        k = min(num_results, count)
+        if self.quantized and self.vector_loader is not None:
+            # 在压缩向量上多取一些候选，再用原始向量重新打分
+            shortlist = self._top_rows(scores, min(k * self.rescore_factor, count))
+            shortlist_rows = shortlist if candidates is None else candidates[shortlist]
+            shortlist_scores = self._rescore(shortlist_rows, scores[shortlist], query_vec)
+            order = self._top_rows(shortlist_scores, k)
+            return shortlist_rows[order], shortlist_scores[order]
+
+        top = self._top_rows(scores, k)
+        return (top if candidates is None else candidates[top]), scores[top]
+
+    def search_rows_many(self, query_embeddings: Sequence[List[float]], num_results: int = 100,
+                         search_filter: Optional[SearchFilter] = None,
+                         nprobe: Optional[int] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        批量检索：多个查询向量与切片矩阵做一次矩阵-矩阵乘法
+
+        查询很多时按_BATCH_SCORE_ELEMENTS分块，限制得分矩阵的内存；
+        量化模式下所有查询的候选行合并去重后只调用一次vector_loader重新打分。
+        使用IVF时各查询探查的簇合并后一起计算，不属于某个查询所探查簇的行对该查询记为-inf。
+
+        Args:
+            query_embeddings: 查询向量列表
+            num_results: 每个查询返回的结果数量
+            search_filter: 过滤条件，所有查询共用，只有满足条件的行参与相似度计算
+            nprobe: 已训练IVF时每个查询只扫描最相似的nprobe个簇，None表示精确检索全部行
+
+        Returns:
+            每个查询的 (行号数组, 得分数组)，与输入顺序一致
+        """
+        num_queries = len(query_embeddings)
+        size = self._size
+        empty = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in range(num_queries)]
+        if num_queries == 0:
+            return empty
+
+        query_vecs = self._normalize(np.asarray(query_embeddings, dtype=np.float32).reshape(num_queries, -1))
+        candidates = self.filter_rows(search_filter)
+        lists = self._probe_lists(query_vecs, nprobe)
+        probed = candidate_lists = None
+        if lists is not None:
+            candidates = self._intersect(candidates, self._list_rows(np.unique(lists)))
+            candidate_lists = self._list_ids[candidates]
+            # probed[i, c] 表示第i个查询是否探查了簇c
+            probed = np.zeros((num_queries, self.ivf_lists), dtype=bool)
+            probed[np.arange(num_queries)[:, None], lists] = True
+        count = size if candidates is None else len(candidates)
+        if count == 0 or num_results <= 0:
+            return empty
+
+        k = min(num_results, count)
+        rescore = self.quantized and self.vector_loader is not None
+        shortlist_k = min(k * self.rescore_factor, count) if rescore else k
+
+        block = max(1, _BATCH_SCORE_ELEMENTS // count)
+        row_blocks, score_blocks = [], []
+        for start in range(0, num_queries, block):
+            scores = self._scores_many(query_vecs[start:start + block], size, candidates)
+            if probed is not None:
+                scores[~probed[start:start + block][:, candidate_lists]] = -np.inf
+            top = self._top_rows_many(scores, shortlist_k)
+            row_blocks.append(top if candidates is None else candidates[top])
+            score_blocks.append(np.take_along_axis(scores, top, axis=1))
+        rows = np.concatenate(row_blocks)
+        scores = np.concatenate(score_blocks)
+        valid = np.isfinite(scores)
+
+        if rescore:
+            # 所有查询的候选行合并后一次读取原始向量
+            unique_rows, inverse = np.unique(rows[valid], return_inverse=True)
+            positions = np.zeros(rows.shape, dtype=np.int64)
+            positions[valid] = inverse
+            found, exact = self._load_exact(unique_rows)
+            if found:
+                exact_scores = np.zeros((num_queries, len(unique_rows)), dtype=np.float32)
+                exact_scores[:, found] = query_vecs @ exact.T
+                has_exact = np.zeros(len(unique_rows), dtype=bool)
+                has_exact[found] = True
+                exact_at = np.take_along_axis(exact_scores, positions, axis=1)
+                scores = np.where(valid & has_exact[positions], exact_at, scores).astype(np.float32)
+            order = self._top_rows_many(scores, k)
+            rows = np.take_along_axis(rows, order, axis=1)
+            scores = np.take_along_axis(scores, order, axis=1)
+            valid = np.isfinite(scores)
+
+        if probed is None:
+            return [(rows[i], scores[i]) for i in range(num_queries)]
+        # 探查的簇内行数不足k的查询去掉-inf的占位结果
+        return [(rows[i][valid[i]], scores[i][valid[i]]) for i in range(num_queries)]
+
+    def rows_for_keys(self, keys: Sequence[str]) -> np.ndarray:
+        """
+        查找切片key对应的行号
+
+        Args:
+            keys: 切片key列表
+
+        Returns:
+            行号数组，不存在的key为-1
+        """
+        with self._lock:
+            self._ensure_row_index()
+            row_of = self._row_of
+            return np.array([row_of.get(key, -1) for key in keys], dtype=np.int64)
+
+    def row_ids(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        取指定行的整数工具ID和切片类型编码
+
+        Args:
+            rows: 行号数组
+
+        Returns:
+            (工具ID数组, 切片类型编码数组)，分别对应tool_uuids和slice_type_names的下标
+        """
+        if self._tool_ids is None:
+            with self._lock:
+                self._ensure_ids()
+        return self._tool_ids[rows], self._type_codes[rows]
+
+    def results_for_rows(self, rows: np.ndarray, scores: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        把行号和得分转换为搜索结果字典
+
+        Args:
+            rows: 行号数组
+            scores: 得分数组
+
+        Returns:
+            搜索结果列表，顺序与rows一致
+        """
+        results = []
+        for row, score in zip(rows, scores):
+            result = {
+                'uuid': str(self._uuids[row]),
+                'score': float(score),
+                'key': str(self._keys[row])
+            }
+            slice_type = self._slice_types[row]
+            if slice_type:
+                result['slice_type'] = str(slice_type)
+            results.append(result)
+
+        return results
+
+    def search(self, query_embedding: List[float], num_results: int = 100,
+               search_filter: Optional[SearchFilter] = None, nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        检索与查询向量最相似的切片
+
+        Args:
+            query_embedding: 查询向量
+            num_results: 返回结果数量
+            search_filter: 过滤条件
+            nprobe: 已训练IVF时只扫描最相似的nprobe个簇，None表示精确检索
+
+        Returns:
+            搜索结果列表，按余弦相似度降序排列；量化模式且未配置vector_loader时为近似得分
+        """
+        rows, scores = self.search_rows(query_embedding, num_results, search_filter, nprobe)
+        return self.results_for_rows(rows, scores)
+
+
+class PartitionedSliceStore:
+    """
+    按命名空间物理分区的切片向量存储
+
+    每个命名空间是一个独立的SliceStore（独立的矩阵和行号），租户的查询只扫描自己分区的向量，
+    检索耗时与该命名空间的切片数量成正比，而不是整个部署的切片总数。
+    """
+
+    def __init__(self, dimensions: int = 1024, precision: str = "float32", rescore_factor: int = 4,
+                 vector_loader: Optional[Callable[[List[str]], List[Optional[np.ndarray]]]] = None,
+                 partitions: Optional[Dict[str, SliceStore]] = None):
+        """
+        初始化分区存储
+
+        Args:
+            dimensions: 向量维度
+            precision: 各分区的存储精度
+            rescore_factor: 量化模式下候选数量相对num_results的倍数
+            vector_loader: 按切片key批量读取float32原始向量的函数
+            partitions: 已有的分区，例如从快照打开的只读分区
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"不支持的存储精度: {precision}")
+        self.dimensions = dimensions
+        self.precision = precision
+        self.rescore_factor = rescore_factor
+        self.vector_loader = vector_loader
+        self.partitions: Dict[str, SliceStore] = dict(partitions or {})
+        # 切片key -> 命名空间，工具更换命名空间时据此从旧分区删除；从已有分区构建时延迟建立
+        self._namespace_of: Optional[Dict[str, str]] = None if partitions else {}
+        self._lock = threading.Lock()
+        # 从磁盘快照打开时记录快照版本
+        self.snapshot_version: Optional[str] = None
+        # 构建时读取的工具库版本号（见RedisService.catalog_changed），None表示未知
+        self.catalog_version: Optional[int] = None
+
+    def __len__(self) -> int:
+        return sum(len(store) for store in self.partitions.values())
+
+    @property
+    def nbytes(self) -> int:
+        """各分区向量矩阵占用的字节数之和"""
+        return sum(store.nbytes for store in self.partitions.values())
+
+    @property
+    def namespaces(self) -> List[str]:
+        """已有切片的命名空间"""
+        return sorted(self.partitions)
+
+    def _new_partition(self, initial_capacity: int = 1024) -> SliceStore:
+        return SliceStore(dimensions=self.dimensions, initial_capacity=initial_capacity, precision=self.precision,
+                          rescore_factor=self.rescore_factor, vector_loader=self.vector_loader)
+
+    def partition(self, namespace: str) -> SliceStore:
+        """
+        取命名空间的分区
+
+        Args:
+            namespace: 命名空间
+
+        Returns:
+            切片存储；命名空间尚无切片时返回一个不登记的空存储，未知命名空间的查询不会占用内存
+        """
+        store = self.partitions.get(namespace)
+        return store if store is not None else self._new_partition(initial_capacity=1)
+
+    def _ensure_namespace_index(self):
+        """建立切片key -> 命名空间的索引，调用方持有锁"""
+        if self._namespace_of is None:
+            self._namespace_of = {
+                str(key): namespace
+                for namespace, store in self.partitions.items()
+                for key in store.keys()
+            }
+
+    def upsert(self, keys: Sequence[str], uuids: Sequence[str], slice_types: Sequence[Optional[str]],
+               embeddings: Any, namespaces: Sequence[str], tags: Optional[Sequence[Sequence[str]]] = None):
+        """
+        插入或覆盖切片，按命名空间写入各自的分区
+
+        Args:
+            keys: 切片在Redis中的key
+            uuids: 切片对应的工具UUID
+            slice_types: 切片类型
+            embeddings: 切片向量，形状为 (n, dimensions)
+            namespaces: 每个切片的命名空间
+            tags: 每个切片所属工具的标签
+        """
+        if len(keys) == 0:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(keys), self.dimensions)
+
+        with self._lock:
+            self._ensure_namespace_index()
+            rows_of_namespace: Dict[str, List[int]] = {}
+            moved: Dict[str, List[str]] = {}
+            for i, (key, namespace) in enumerate(zip(keys, namespaces)):
+                previous = self._namespace_of.get(key)
+                if previous is not None and previous != namespace:
+                    moved.setdefault(previous, []).append(key)
+                self._namespace_of[key] = namespace
+                rows_of_namespace.setdefault(namespace, []).append(i)
+
+            # 更换了命名空间的切片先从旧分区删除
+            for namespace, moved_keys in moved.items():
+                self.partitions[namespace].remove(moved_keys)
+
+            for namespace, rows in rows_of_namespace.items():
+                store = self.partitions.get(namespace)
+                if store is None:
+                    store = self.partitions[namespace] = self._new_partition()
+                store.upsert(
+                    [keys[i] for i in rows], [uuids[i] for i in rows], [slice_types[i] for i in rows],
+                    embeddings[rows], [tags[i] for i in rows] if tags is not None else None
+                )
+
+    def remove(self, keys: Sequence[str]):
+        """
+        删除切片
+
+        Args:
+            keys: 要删除的切片key
+        """
+        with self._lock:
+            self._ensure_namespace_index()
+            keys_of_namespace: Dict[str, List[str]] = {}
+            for key in keys:
+                namespace = self._namespace_of.pop(key, None)
+                if namespace is not None:
+                    keys_of_namespace.setdefault(namespace, []).append(key)
+            for namespace, namespace_keys in keys_of_namespace.items():
+                self.partitions[namespace].remove(namespace_keys)
+
+    def clear(self):
+        """清空所有分区"""
+        with self._lock:
+            self.partitions = {}
+            self._namespace_of = {}
+
+    def train_ivf(self, num_lists: int, iterations: int = 10, max_drift: Optional[float] = None) -> int:
+        """
+        为各分区训练IVF倒排索引
+
+        每个簇平均至少_IVF_MIN_LIST_ROWS个切片，切片较少的分区相应减少簇的数量，不足两个簇的分区保持精确检索。
+
+        Args:
+            num_lists: 每个分区最多的簇数量
+            iterations: k-means迭代次数
+            max_drift: 为None时训练所有分区；否则只训练尚未训练的分区和ivf_drift超过该值的分区
+
+        Returns:
+            训练了的分区数量
+        """
+        namespaces = self.stale_ivf_partitions(num_lists, max_drift)
+        for namespace in namespaces:
+            store = self.partitions[namespace]
+            store.train_ivf(min(int(num_lists), len(store) // _IVF_MIN_LIST_ROWS), iterations)
+        return len(namespaces)
+
+    def stale_ivf_partitions(self, num_lists: int, max_drift: Optional[float] = None) -> List[str]:
+        """
+        需要训练IVF的分区：切片数足够分成至少两个簇，且尚未训练或ivf_drift超过max_drift
+
+        Args:
+            num_lists: 每个分区最多的簇数量
+            max_drift: 漂移阈值，None表示所有分区都需要训练
+
+        Returns:
+            命名空间列表
+        """
+        return [
+            namespace for namespace, store in list(self.partitions.items())
+            if min(int(num_lists), len(store) // _IVF_MIN_LIST_ROWS) >= 2
+            and (max_drift is None or store.ivf_centroids is None or store.ivf_drift > max_drift)
+        ]
+
+    def adopt_ivf(self, previous: "PartitionedSliceStore"):
+        """
+        重新加载切片后沿用之前存储各分区的簇中心，不重新训练
+
+        漂移计数在之前的基础上累加两次加载之间增删的切片数，超过阈值时由train_ivf(max_drift=...)重新训练。
+
+        Args:
+            previous: 之前的存储
+        """
+        for namespace, store in list(self.partitions.items()):
+            old = previous.partitions.get(namespace)
+            if old is None or old.ivf_centroids is None or len(old.ivf_centroids) > len(store):
+                continue
+            old_keys = {str(key) for key in old.keys()}
+            new_keys = set(store.keys())
+            store.set_ivf(old.ivf_centroids)
+            store.ivf_trained_rows = old.ivf_trained_rows
+            store.ivf_changed_rows = old.ivf_changed_rows + len(old_keys ^ new_keys)
+
+    def copy(self) -> "PartitionedSliceStore":
+        """复制出一个独立的分区存储，保留快照版本和工具库版本号"""
+        with self._lock:
+            partitions = {namespace: store.copy() for namespace, store in self.partitions.items()}
+        store = PartitionedSliceStore(
+            dimensions=self.dimensions, precision=self.precision, rescore_factor=self.rescore_factor,
+            vector_loader=self.vector_loader, partitions=partitions
+        )
+        store.snapshot_version = self.snapshot_version
+        store.catalog_version = self.catalog_version
+        return store
+
+    def export(self) -> Dict[str, Dict[str, Any]]:
+        """
+        导出各分区内容的副本，用于写入快照
+
+        Returns:
+            命名空间 -> SliceStore.export()的结果
+        """
+        return {namespace: store.export() for namespace, store in self.partitions.items()}
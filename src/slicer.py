@@ -1,39 +1,57 @@
 """
 工具切片处理器
 """
-from typing import List
+from typing import List, Dict, Tuple, Optional, Iterable
+import hashlib
 import json
-from .models import Tool, ToolSlice
+from .models import Tool, SliceBatch
 from .embedding_service import EmbeddingService
+from .clients import get_embedding_service
 
 
 class ToolSlicer:
     """工具切片处理器"""
 
-    def __init__(self):
-        self.embedding_service = EmbeddingService()
+    def __init__(self, embedding_service: Optional[EmbeddingService] = None):
+        """
+        初始化切片处理器
 
-    def slice_tool(self, tool: Tool) -> List[ToolSlice]:
+        Args:
+            embedding_service: 向量化服务，默认使用进程内共享的向量化服务
         """
-        将工具按概览和参数维度进行切片，并直接生成向量
+        self.embedding_service = embedding_service or get_embedding_service()
+
+    @staticmethod
+    def hash_content(content: str) -> str:
+        """
+        计算切片内容的哈希
+
+        Args:
+            content: 切片内容
+
+        Returns:
+            内容哈希（十六进制字符串）
+        """
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def build_slice_contents(self, tool: Tool) -> List[Tuple[str, str]]:
+        """
+        将工具按概览和参数维度切分为切片内容，不做向量化
 
         Args:
             tool: 工具对象
 
         Returns:
-            切片列表（已包含向量）
+            (切片类型, 切片内容) 列表，列表下标即切片位置
         """
-        # 准备切片内容
-        slice_contents = []
-        slice_types = []
+        contents = []
 
         # 1. 概览切片内容
         overview_content = {
             "ToolName": tool.ToolName,
             "ToolDescription": tool.ToolDescription
         }
-        slice_contents.append(json.dumps(overview_content, ensure_ascii=False))
-        slice_types.append("overview")
+        contents.append(("overview", json.dumps(overview_content, ensure_ascii=False)))
 
         # 2. 参数切片内容
         for arg in tool.Args:
@@ -41,36 +59,59 @@ class ToolSlicer:
                 "ArgName": arg.ArgName,
                 "ArgDescription": arg.ArgDescription
             }
-            slice_contents.append(json.dumps(param_content, ensure_ascii=False))
-            slice_types.append("parameter")
+            contents.append(("parameter", json.dumps(param_content, ensure_ascii=False)))
 
-        # 3. 批量向量化
-        embeddings = self.embedding_service.batch_embed_texts(slice_contents)
+        return contents
 
-        # 4. 创建切片对象
-        slices = []
-        for embedding, slice_type in zip(embeddings, slice_types):
-            slice_obj = ToolSlice(
-                uuid=tool.uuid,
-                embedding=embedding,
-                slice_type=slice_type
-            )
-            slices.append(slice_obj)
+    def slice_tool(self, tool: Tool, positions: Optional[Iterable[int]] = None) -> SliceBatch:
+        """
+        将工具按概览和参数维度进行切片，并直接生成向量
+
+        Args:
+            tool: 工具对象
+            positions: 只对这些位置的切片做向量化，默认全部切片
 
-        return slices
+        Returns:
+            切片批次（已包含向量）
+        """
+        positions_by_uuid = None if positions is None else {tool.uuid: positions}
+        return self.slice_tools([tool], positions_by_uuid)
 
-    def slice_tools(self, tools: List[Tool]) -> List[ToolSlice]:
+    def slice_tools(self, tools: List[Tool],
+                    positions_by_uuid: Optional[Dict[str, Iterable[int]]] = None) -> SliceBatch:
         """
-        批量切片处理
+        批量切片处理：把多个工具的切片打包成满批次后并发向量化
 
         Args:
             tools: 工具列表
+            positions_by_uuid: 每个工具只向量化这些位置的切片，未出现的工具处理全部切片
 
         Returns:
-            所有切片的列表（已包含向量）
+            所有切片组成的批次（已包含向量），按工具和切片位置排列
         """
-        all_slices = []
+        # 1. 收集所有工具待向量化的切片，记录每个切片属于哪个工具、哪个位置
+        pending = []  # (工具, 位置, 切片类型, 切片内容)
         for tool in tools:
-            slices = self.slice_tool(tool)
-            all_slices.extend(slices)
-        return all_slices
+            contents = self.build_slice_contents(tool)
+            if positions_by_uuid is None or tool.uuid not in positions_by_uuid:
+                selected = range(len(contents))
+            else:
+                selected = sorted(set(positions_by_uuid[tool.uuid]))
+            for position in selected:
+                slice_type, content = contents[position]
+                pending.append((tool, position, slice_type, content))
+
+        # 2. 跨工具打包，一次性交给向量化服务分批并发处理，结果直接是一个float32矩阵
+        embeddings = self.embedding_service.embed_matrix([item[3] for item in pending], persist=True)
+
+        # 3. 按收集顺序记录每行向量对应的工具和切片位置
+        return SliceBatch(
+            embeddings=embeddings,
+            uuids=[tool.uuid for tool, _, _, _ in pending],
+            positions=[position for _, position, _, _ in pending],
+            slice_types=[slice_type for _, _, slice_type, _ in pending],
+            content_hashes=[self.hash_content(content) for _, _, _, content in pending],
+            contents=[content for _, _, _, content in pending],
+            namespaces=[tool.namespace for tool, _, _, _ in pending],
+            tags=[list(tool.tags) for tool, _, _, _ in pending]
+        )
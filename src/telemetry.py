@@ -0,0 +1,272 @@
+"""
+耗时追踪与指标导出
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Sequence, Tuple, Iterator
+
+logger = logging.getLogger(__name__)
+
+# 默认的耗时直方图分桶（秒）
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        """
+        计数器加amount
+
+        Args:
+            amount: 增量，必须非负
+            **labels: 标签
+        """
+        if amount < 0:
+            raise ValueError("计数器只能递增")
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        """获取指定标签的当前值"""
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """累积分桶直方图"""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # 标签 -> (各分桶计数, 总和, 总数)
+        self._values: Dict[Tuple[Tuple[str, str], ...], Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        """
+        记录一个观测值
+
+        Args:
+            value: 观测值
+            **labels: 标签
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (("le", _format_value(bound)),)
+                    lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，可导出为Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str = "") -> Counter:
+        """获取或创建计数器"""
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Counter(name, documentation)
+            return metric
+
+    def histogram(self, name: str, documentation: str = "",
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        """获取或创建直方图"""
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Histogram(name, documentation, buckets)
+            return metric
+
+    def render_prometheus(self) -> str:
+        """导出全部指标为Prometheus文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class Span:
+    """一次阶段耗时记录"""
+
+    def __init__(self, name: str, attributes: Dict[str, Any], parent: Optional["Span"]):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns: Optional[int] = None
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None  # 秒
+        # 导出器可在此保存自己的上下文，例如OpenTelemetry span
+        self.context: Dict[str, Any] = {}
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration = time.perf_counter() - self._start
+        self.end_time_ns = time.time_ns()
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("rag4tools_current_span", default=None)
+
+
+class Tracer:
+    """
+    阶段耗时追踪器
+
+    每个span结束时记录到 rag_stage_latency_seconds{stage=...} 直方图，并依次通知已注册的钩子。
+    钩子可以是普通函数（在span结束时以span为参数调用），
+    也可以是带 on_start(span) / on_end(span) 方法的对象，例如OpenTelemetryExporter。
+    """
+
+    def __init__(self, metrics: MetricsRegistry):
+        self.metrics = metrics
+        self.hooks: List[Any] = []
+        self._latency = metrics.histogram("rag_stage_latency_seconds", "各阶段耗时（秒）")
+
+    def add_hook(self, hook: Any):
+        """注册钩子"""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Any):
+        """移除钩子"""
+        self.hooks.remove(hook)
+
+    def _notify(self, method: str, span: Span):
+        for hook in list(self.hooks):
+            callback = getattr(hook, method, None)
+            if callback is None and method == "on_end" and callable(hook):
+                callback = hook
+            if callback is None:
+                continue
+            try:
+                callback(span)
+            except Exception:
+                logger.exception("追踪钩子执行失败")
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """
+        记录一个阶段的耗时
+
+        Args:
+            name: 阶段名称
+            **attributes: 附加属性
+
+        Yields:
+            Span，可在阶段内继续设置属性
+        """
+        span = Span(name, attributes, _current_span.get())
+        token = _current_span.set(span)
+        self._notify("on_start", span)
+        try:
+            yield span
+        except Exception as e:
+            span.set_attribute("error", type(e).__name__)
+            raise
+        finally:
+            span.end()
+            _current_span.reset(token)
+            self._latency.observe(span.duration, stage=name)
+            self._notify("on_end", span)
+
+
+class OpenTelemetryExporter:
+    """把span转发给OpenTelemetry tracer的钩子，需安装opentelemetry-api"""
+
+    def __init__(self, otel_tracer=None):
+        """
+        初始化导出器
+
+        Args:
+            otel_tracer: OpenTelemetry tracer，默认使用全局TracerProvider获取
+        """
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.otel_tracer = otel_tracer or trace.get_tracer("rag4tools")
+
+    def on_start(self, span: Span):
+        parent = span.parent.context.get("otel_span") if span.parent else None
+        context = self._trace.set_span_in_context(parent) if parent is not None else None
+        span.context["otel_span"] = self.otel_tracer.start_span(
+            span.name, context=context, start_time=span.start_time_ns
+        )
+
+    def on_end(self, span: Span):
+        otel_span = span.context.get("otel_span")
+        if otel_span is None:
+            return
+        for key, value in span.attributes.items():
+            if isinstance(value, (str, bool, int, float)):
+                otel_span.set_attribute(key, value)
+        otel_span.end(end_time=span.end_time_ns)
+
+
+# 进程内默认的指标注册表和追踪器
+metrics = MetricsRegistry()
+tracer = Tracer(metrics)
+
+SLICES_SCANNED = metrics.counter("rag_slices_scanned_total", "向量检索扫描的切片数")
+CANDIDATES_FETCHED = metrics.counter("rag_candidates_fetched_total", "从Redis读取的候选工具数")
+EMBEDDING_API_CALLS = metrics.counter("rag_embedding_api_calls_total", "向量化接口请求次数")
+EMBEDDING_API_TEXTS = metrics.counter("rag_embedding_api_texts_total", "发往向量化接口的文本条数")
+CACHE_HITS = metrics.counter("rag_cache_hits_total", "缓存命中次数")
+CACHE_MISSES = metrics.counter("rag_cache_misses_total", "缓存未命中次数")
@@ -0,0 +1,157 @@
+"""
+已解析工具缓存
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Iterable
+
+from .models import Tool
+from .telemetry import CACHE_HITS, CACHE_MISSES
+
+# 工具库版本号的Redis key，每次写入或删除工具时INCR
+CATALOG_VERSION_KEY = "catalog_version"
+
+
+class ToolCache:
+    """
+    进程内已解析工具的LRU缓存
+
+    缓存命中的工具不再读取Redis、不再json.loads和Tool.from_dict；
+    Tool对象被多次查询复用，精排服务渲染的文档也随对象保留（见Tool.rendered）。
+
+    一致性依靠工具库版本号：写入方在修改工具的同一个pipeline中INCR CATALOG_VERSION_KEY，
+    读取方每隔version_check_interval秒读取一次版本号，发现变化即清空缓存。
+    本进程内的写入直接失效对应条目，不必等待下一次版本检查。
+    """
+
+    def __init__(self, max_entries: int = 10000, version_check_interval: Optional[float] = 1.0):
+        """
+        初始化工具缓存
+
+        Args:
+            max_entries: 最多缓存的工具数量，0表示不缓存
+            version_check_interval: 两次版本检查的最短间隔（秒），0表示每次读取都检查，
+                None表示从不检查（数据源不可变时使用，例如共享内存索引）
+        """
+        self.max_entries = max_entries
+        self.version_check_interval = version_check_interval
+        self._tools: "OrderedDict[str, Tool]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Optional[bytes] = None
+        self._last_check = float("-inf")
+        # 每次整体清空时递增，用于丢弃清空前开始读取的结果
+        self.generation = 0
+
+        # 命中统计
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        """是否启用缓存"""
+        return self.max_entries > 0
+
+    def needs_version_check(self) -> bool:
+        """距上次版本检查是否已超过version_check_interval"""
+        if not self.enabled or self.version_check_interval is None:
+            return False
+        return time.monotonic() - self._last_check >= self.version_check_interval
+
+    def sync_version(self, version: Optional[bytes]):
+        """
+        记录从Redis读取到的工具库版本号，版本变化时清空缓存
+
+        Args:
+            version: CATALOG_VERSION_KEY的当前值，尚未写入过时为None
+        """
+        with self._lock:
+            self._last_check = time.monotonic()
+            if version != self._version:
+                self._version = version
+                self._clear_locked()
+
+    def advance_version(self, new_version: int, uuids: Iterable[str]):
+        """
+        本进程写入工具后失效对应条目，并记录INCR返回的新版本号
+
+        若新版本号恰好比已知版本大1，说明期间没有其他写入，其余缓存仍然有效，
+        下次版本检查不会清空整个缓存；否则交给下次版本检查处理。
+
+        Args:
+            new_version: INCR CATALOG_VERSION_KEY 的返回值
+            uuids: 被写入或删除的工具UUID
+        """
+        with self._lock:
+            # 与清空一样递增generation，正在进行的读取不会把旧数据写回
+            self.generation += 1
+            for uuid in uuids:
+                self._tools.pop(uuid, None)
+            known = int(self._version) if self._version is not None else 0
+            if self._last_check != float("-inf") and known + 1 == new_version:
+                self._version = str(new_version).encode()
+
+    def get_many(self, uuids: Iterable[str]) -> Dict[str, Tool]:
+        """
+        批量查询缓存
+
+        Args:
+            uuids: 工具UUID列表
+
+        Returns:
+            命中的 UUID -> 工具
+        """
+        uuids = list(uuids)
+        if not self.enabled:
+            return {}
+
+        found: Dict[str, Tool] = {}
+        with self._lock:
+            for uuid in uuids:
+                tool = self._tools.get(uuid)
+                if tool is not None:
+                    self._tools.move_to_end(uuid)
+                    found[uuid] = tool
+            hits = sum(1 for uuid in uuids if uuid in found)
+            self.hits += hits
+            self.misses += len(uuids) - hits
+        CACHE_HITS.inc(hits, cache="tool")
+        CACHE_MISSES.inc(len(uuids) - hits, cache="tool")
+        return found
+
+    def put_many(self, tools: List[Tool], generation: int):
+        """
+        写入从Redis读取并解析的工具
+
+        Args:
+            tools: 工具列表
+            generation: 开始读取前的generation；期间缓存被清空过时丢弃这批结果，避免写回旧数据
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            for tool in tools:
+                self._tools[tool.uuid] = tool
+                self._tools.move_to_end(tool.uuid)
+            while len(self._tools) > self.max_entries:
+                self._tools.popitem(last=False)
+
+    def _clear_locked(self):
+        self._tools.clear()
+        self.generation += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._clear_locked()
+
+    def stats(self) -> Dict[str, int]:
+        """获取缓存命中统计"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._tools)
+            }
@@ -0,0 +1,47 @@
+"""
+自适应精排级联策略的测试
+"""
+from src.cascade import CascadePolicy, FULL_RERANK, SHRINK_RERANK, SKIP_RERANK
+from src.models import CoarseRankResult
+
+
+def coarse(scores):
+    return [CoarseRankResult(uuid=f"tool-{i}", score=score) for i, score in enumerate(scores)]
+
+
+def rank_ladder(first_rank, count):
+    """每个工具只命中一个切片时RRF聚合的得分：1 / (rank + 1)"""
+    return [1.0 / (rank + 1) for rank in range(first_rank, first_rank + count)]
+
+
+def test_close_top_two_is_fully_reranked():
+    policy = CascadePolicy()
+    results = coarse([0.50, 0.49] + rank_ladder(3, 18))
+
+    assert policy.plan(results, top_m=20) == (FULL_RERANK, 20, False)
+
+
+def test_rank_gap_alone_is_not_a_confident_lead():
+    # 相对差距已有33%，但只是相邻名次之间的固定差距
+    results = coarse(rank_ladder(1, 20))
+
+    policy = CascadePolicy()
+    assert CascadePolicy.coarse_margin(results) < policy.shrink_margin
+    assert policy.plan(results, top_m=20)[0] == FULL_RERANK
+
+
+def test_dominant_top_tool_skips_or_shrinks_rerank():
+    policy = CascadePolicy()
+    # 第一名的四个切片排在前四名
+    dominant = coarse([sum(rank_ladder(1, 4))] + rank_ladder(5, 19))
+    assert policy.plan(dominant, top_m=20) == (SKIP_RERANK, 0, False)
+
+    # 第一名的两个切片排在前两名
+    leading = coarse([sum(rank_ladder(1, 2))] + rank_ladder(3, 19))
+    assert policy.plan(leading, top_m=20) == (SHRINK_RERANK, policy.shrink_candidates, False)
+
+
+def test_few_candidates_are_always_reranked():
+    policy = CascadePolicy()
+    assert policy.plan(coarse([0.9, 0.1]), top_m=20) == (FULL_RERANK, 2, False)
+    assert policy.plan(coarse([0.9]), top_m=20) == (SKIP_RERANK, 0, False)
@@ -0,0 +1,73 @@
+"""
+向量缓存的测试：进程内LRU按字节淘汰，Redis后端按过期时间清除
+"""
+import time
+
+import numpy as np
+import pytest
+
+from src.embedding_cache import EmbeddingCache, RedisEmbeddingBackend
+
+
+def vector(value: float, dimensions: int = 4) -> np.ndarray:
+    return np.full(dimensions, value, dtype=np.float32)
+
+
+@pytest.fixture
+def redis_client():
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis()
+
+
+def test_memory_lru_evicts_least_recently_used():
+    # 每个向量16字节，最多容纳两个
+    cache = EmbeddingCache(max_memory_bytes=32)
+    cache.put_many(["a", "b"], [vector(1), vector(2)])
+    cache.get_many(["a"])
+
+    cache.put_many(["c"], [vector(3)])
+
+    hits = cache.get_many(["a", "b", "c"])
+    assert hits[1] is None
+    assert np.array_equal(hits[0], vector(1)) and np.array_equal(hits[2], vector(3))
+    assert cache.stats()["memory_bytes"] == 32
+
+
+def test_redis_backend_entries_expire(redis_client):
+    backend = RedisEmbeddingBackend(redis_client, ttl_seconds=0.2)
+    cache = EmbeddingCache(backend)
+    cache.put_many(["a"], [vector(1)])
+
+    assert 0 < redis_client.pttl("embedding_cache:a") <= 200
+    # 另一个进程（空的进程内LRU）从Redis读到向量
+    assert np.array_equal(EmbeddingCache(backend).get_many(["a"])[0], vector(1))
+
+    time.sleep(0.3)
+
+    assert redis_client.exists("embedding_cache:a") == 0
+    assert EmbeddingCache(backend).get_many(["a"]) == [None]
+
+
+def test_redis_backend_rewrite_refreshes_expiry(redis_client):
+    backend = RedisEmbeddingBackend(redis_client, ttl_seconds=60)
+    backend.put_many({"a": vector(1).tobytes()})
+    redis_client.pexpire("embedding_cache:a", 10)
+
+    backend.put_many({"a": vector(1).tobytes()})
+
+    assert redis_client.pttl("embedding_cache:a") > 10000
+
+
+def test_only_index_embeddings_are_persisted(redis_client, monkeypatch):
+    from src.embedding_service import EmbeddingService
+
+    service = EmbeddingService(cache=EmbeddingCache(RedisEmbeddingBackend(redis_client)))
+    service.dimensions = 4
+    monkeypatch.setattr(service, "_request_embeddings",
+                        lambda texts: np.stack([vector(len(text)) for text in texts]))
+
+    service.embed_matrix(["slice one", "slice two"], persist=True)
+    service.get_single_embedding("user query")
+    service.embed_matrix(["another query"])
+
+    assert len(redis_client.keys("embedding_cache:*")) == 2
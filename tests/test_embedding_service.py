@@ -0,0 +1,87 @@
+"""
+异步向量化服务的测试：并发上限、共用速率限制器和失败重试
+"""
+import asyncio
+import types
+
+import numpy as np
+
+from src.embedding_service import AsyncEmbeddingService, EmbeddingService, RateLimiter
+
+
+class FakeEmbeddings:
+    """记录同时进行的请求数；前failures次请求抛出异常（模拟429）"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, model, input, dimensions, encoding_format):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if self.failures > 0:
+                self.failures -= 1
+                raise RuntimeError("429 Too Many Requests")
+            return types.SimpleNamespace(data=[
+                types.SimpleNamespace(index=i, embedding=[float(len(text))] * dimensions)
+                for i, text in enumerate(input)
+            ])
+        finally:
+            self.in_flight -= 1
+
+
+def make_service(embeddings: FakeEmbeddings, **kwargs) -> AsyncEmbeddingService:
+    service = AsyncEmbeddingService(retry_backoff=0.0, **kwargs)
+    service.dimensions = 2
+    service._client = types.SimpleNamespace(embeddings=embeddings)
+    return service
+
+
+def test_batches_respect_max_concurrency():
+    embeddings = FakeEmbeddings()
+    service = make_service(embeddings, max_concurrency=2)
+    texts = [f"text {i}" for i in range(100)]
+
+    vectors = asyncio.run(service.get_embeddings(texts, batch_size=10))
+
+    assert embeddings.calls == 10
+    assert embeddings.max_in_flight == 2
+    assert vectors[0] == [6.0, 6.0] and len(vectors) == 100
+
+
+def test_failed_requests_are_retried():
+    embeddings = FakeEmbeddings(failures=3)
+    service = make_service(embeddings, max_concurrency=4)
+
+    vectors = asyncio.run(service.get_embeddings([f"t{i}" for i in range(40)], batch_size=10))
+
+    assert embeddings.calls == 7
+    assert np.array_equal(vectors[0], [2.0, 2.0])
+
+
+def test_from_service_shares_cache_and_rate_limiter():
+    sync_service = EmbeddingService(max_concurrency=3, requests_per_second=50)
+
+    service = AsyncEmbeddingService.from_service(sync_service)
+
+    assert service.cache is sync_service.cache
+    assert service.rate_limiter is sync_service.rate_limiter
+    assert service.max_concurrency == 3
+
+
+def test_rate_limiter_spaces_async_requests():
+    limiter = RateLimiter(requests_per_second=100)
+
+    async def acquire_many():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.gather(*(limiter.acquire_async() for _ in range(6)))
+        return loop.time() - start
+
+    # 6次请求至少间隔5个0.01秒
+    assert asyncio.run(acquire_many()) >= 0.045
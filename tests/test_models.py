@@ -0,0 +1,23 @@
+"""
+数据模型的测试
+"""
+import pytest
+
+from src.models import Tool
+
+TOOL = {"ToolName": "get_stock_price", "ToolDescription": "查询股票价格", "Args": []}
+
+
+def test_tags_string_is_single_tag():
+    assert Tool.from_dict({**TOOL, "Tags": "finance"}).tags == ["finance"]
+
+
+def test_tags_default_to_empty():
+    assert Tool.from_dict(TOOL).tags == []
+    assert Tool.from_dict({**TOOL, "Tags": None}).tags == []
+
+
+@pytest.mark.parametrize("tags", [5, {"category": "finance"}, ["finance", 1]])
+def test_tags_rejects_non_string_lists(tags):
+    with pytest.raises(ValueError):
+        Tool.from_dict({**TOOL, "Tags": tags})
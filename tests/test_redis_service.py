@@ -0,0 +1,86 @@
+"""
+RedisService的测试，使用fakeredis
+"""
+import pytest
+
+from src.redis_service import RedisService
+
+
+@pytest.fixture
+def redis_service():
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis
+
+    connection_class = getattr(fakeredis, "FakeRedisConnection", fakeredis.FakeConnection)
+    pool = redis.ConnectionPool(connection_class=connection_class, server=fakeredis.FakeServer())
+    return RedisService(connection_pool=pool)
+
+
+def test_catalog_changed_ignores_own_writes(redis_service):
+    for version in range(11, 21):
+        redis_service._record_catalog_write(version)
+
+    assert not redis_service.catalog_changed(10, 20)
+    assert not redis_service.catalog_changed(15, 18)
+    # 区间内有不是本进程写入的版本
+    assert redis_service.catalog_changed(9, 20)
+    assert redis_service.catalog_changed(10, 21)
+    assert redis_service.catalog_changed(None, 20)
+    assert redis_service.catalog_changed(21, 20)
+
+
+def test_catalog_changed_with_stale_version_after_many_writes(redis_service):
+    for version in range(2, 200002, 2):
+        redis_service._record_catalog_write(version)
+
+    # 每隔一个版本来自其他进程；区间很长也只做两次二分查找
+    assert redis_service.catalog_changed(0, 200000)
+    assert not redis_service.catalog_changed(199999, 200000)
+
+    redis_service.forget_catalog_writes(199990)
+    assert redis_service._own_catalog_versions == [199992, 199994, 199996, 199998, 200000]
+
+
+class FakeSearchIndex:
+    """记录create调用的SearchIndex替身，FT.INFO返回升级前的schema"""
+
+    created = []
+
+    def __init__(self, schema, redis_client):
+        self.schema = schema
+
+    def exists(self):
+        return True
+
+    def info(self):
+        return {"attributes": [
+            ["identifier", "embedding", "attribute", "embedding", "type", "VECTOR"],
+            ["identifier", "uuid", "attribute", "uuid", "type", "TEXT"],
+            ["identifier", "content", "attribute", "content", "type", "TEXT"],
+            ["identifier", "slice_type", "attribute", "slice_type", "type", "TEXT"],
+        ]}
+
+    def create(self, overwrite=False, drop=False):
+        self.created.append((overwrite, drop))
+
+
+def test_legacy_index_is_rebuilt_and_slices_backfilled(redis_service, monkeypatch):
+    import redisvl.index
+
+    monkeypatch.setattr(redisvl.index, "SearchIndex", FakeSearchIndex)
+    FakeSearchIndex.created = []
+    client = redis_service.redis_client
+    client.hset("tool_slices:a:0", mapping={"uuid": "a", "slice_type": "overview"})
+    client.hset("tool_slices:b:0", mapping={"uuid": "b", "namespace": "acme"})
+
+    redis_service.index
+
+    assert FakeSearchIndex.created == [(True, False)]
+    assert client.hget("tool_slices:a:0", "namespace") == b"default"
+    assert client.hget("tool_slices:b:0", "namespace") == b"acme"
+
+
+def test_hnsw_filter_always_restricts_namespace():
+    from src.models import SearchFilter
+
+    assert "@namespace:{default}" in str(RedisService._hnsw_filter(SearchFilter()))
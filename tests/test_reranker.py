@@ -0,0 +1,144 @@
+"""
+精排服务score_pairs的测试，使用替身分词器和模型，不需要下载bge-reranker
+"""
+import contextlib
+import importlib.util
+import sys
+import types
+
+import pytest
+
+from src.reranker import RerankerService
+
+CLS, PAD, SEP = 0, 1, 2
+
+
+class FakeBatch(dict):
+    """tokenizer.pad的返回值，记录被移到的设备"""
+
+    def to(self, device):
+        self.device = device
+        return self
+
+
+class FakeTokenizer:
+    """按空格分词，每个词一个token id；特殊token与bge-reranker（XLM-R）一样为 <s> A </s></s> B </s>"""
+
+    def __init__(self):
+        self.vocab = {}
+        self.padded_widths = []
+        self.devices = []
+
+    def __call__(self, texts, add_special_tokens, truncation, max_length):
+        assert not add_special_tokens
+        ids = [[self.vocab.setdefault(word, len(self.vocab) + 10) for word in text.split()] for text in texts]
+        return {"input_ids": [row[:max_length] for row in ids]}
+
+    def num_special_tokens_to_add(self, pair):
+        return 4
+
+    def build_inputs_with_special_tokens(self, first, second):
+        return [CLS] + first + [SEP, SEP] + second + [SEP]
+
+    def pad(self, features, padding, return_tensors):
+        width = max(len(row) for row in features["input_ids"])
+        self.padded_widths.append(width)
+        batch = FakeBatch(input_ids=[row + [PAD] * (width - len(row)) for row in features["input_ids"]])
+        self.devices.append(batch)
+        return batch
+
+
+class FakeLogits(list):
+    def view(self, *shape):
+        return self
+
+    def float(self):
+        return self
+
+    def tolist(self):
+        return list(self)
+
+
+class FakeModel:
+    """得分为输入中非特殊、非padding的token数，记录设备和推理模式的切换"""
+
+    def __init__(self):
+        self.moved_to = []
+        self.eval_calls = 0
+        self.input_lengths = []
+
+    def to(self, device):
+        self.moved_to.append(device)
+        return self
+
+    def eval(self):
+        self.eval_calls += 1
+        return self
+
+    def __call__(self, input_ids, return_dict):
+        self.input_lengths.extend(sum(1 for token in row if token != PAD) for row in input_ids)
+        return types.SimpleNamespace(
+            logits=FakeLogits(float(sum(1 for token in row if token > SEP)) for row in input_ids)
+        )
+
+
+class FakeFlagReranker:
+    def __init__(self):
+        self.tokenizer = FakeTokenizer()
+        self.model = FakeModel()
+        self.target_devices = ["cuda:1", "cuda:0"]
+
+
+@pytest.fixture
+def flag_reranker(monkeypatch):
+    """用替身替换llama_index的FlagEmbeddingReranker；未安装torch时提供只含no_grad的torch"""
+    flag = FakeFlagReranker()
+
+    class FakeFlagEmbeddingReranker:
+        def __init__(self, top_n, model, use_fp16):
+            self._model = flag
+
+    module = types.ModuleType("llama_index.postprocessor.flag_embedding_reranker")
+    module.FlagEmbeddingReranker = FakeFlagEmbeddingReranker
+    monkeypatch.setitem(sys.modules, "llama_index", types.ModuleType("llama_index"))
+    monkeypatch.setitem(sys.modules, "llama_index.postprocessor", types.ModuleType("llama_index.postprocessor"))
+    monkeypatch.setitem(sys.modules, "llama_index.postprocessor.flag_embedding_reranker", module)
+    if importlib.util.find_spec("torch") is None:
+        torch = types.ModuleType("torch")
+        torch.no_grad = contextlib.nullcontext
+        monkeypatch.setitem(sys.modules, "torch", torch)
+    return flag
+
+
+def test_model_moved_to_target_device_and_eval_once(flag_reranker):
+    reranker = RerankerService(batch_size=2)
+
+    reranker.score_pairs([("a b", "c d e")])
+    reranker.score_pairs([("f", "g h")])
+
+    assert flag_reranker.model.moved_to == ["cuda:1"]
+    assert flag_reranker.model.eval_calls == 1
+    assert {batch.device for batch in flag_reranker.tokenizer.devices} == {"cuda:1"}
+
+
+def test_scores_keep_input_order_and_batches_pad_to_longest(flag_reranker):
+    reranker = RerankerService(batch_size=2)
+    # 文档长度故意打乱，score_pairs内部按长度排序分批
+    pairs = [("q", " ".join(f"w{i}" for i in range(length))) for length in (5, 1, 7, 3)]
+
+    scores = reranker.score_pairs(pairs)
+
+    assert scores == [6.0, 2.0, 8.0, 4.0]
+    # 排序后每批只补齐到批内最长：(1, 3) 和 (5, 7) 个文档token，各加1个查询token和4个特殊token
+    assert flag_reranker.tokenizer.padded_widths == [8, 12]
+
+
+def test_long_pairs_truncated_to_max_length(flag_reranker):
+    reranker = RerankerService(batch_size=4, max_length=12)
+    long_document = " ".join(f"d{i}" for i in range(20))
+
+    scores = reranker.score_pairs([("q1 q2 q3", long_document), ("q1 q2 q3", "short")])
+
+    # 预算为 12 - 4 = 8 个token：查询完整保留，较长的文档截断为5个token
+    assert scores == [8.0, 4.0]
+    assert max(flag_reranker.model.input_lengths) == 12
@@ -0,0 +1,101 @@
+"""
+多进程检索服务的测试，使用fakeredis，进程池替换为在当前进程内执行任务的执行器
+"""
+import asyncio
+from concurrent.futures import Future
+
+import pytest
+
+from src import serving
+from src.models import Tool
+from src.redis_service import RedisService
+from src.reranker import RerankerService
+from src.serving import ProcessSearchService, SharedIndex
+from src.tool_cache import CATALOG_VERSION_KEY
+
+
+class InlineExecutor:
+    """在当前进程内同步执行任务的ProcessPoolExecutor替身"""
+
+    def __init__(self, max_workers, mp_context, initializer, initargs):
+        initializer(*initargs)
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self):
+        pass
+
+
+class OverlapReranker(RerankerService):
+    """按词重叠打分的精排替身，不加载交叉编码器模型"""
+
+    def warmup(self):
+        pass
+
+    def score_pairs(self, pairs):
+        return [float(len(set(query.lower().split()) & set(document.lower().split()))) for query, document in pairs]
+
+
+@pytest.fixture
+def service(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis
+
+    monkeypatch.setenv("EMBEDDING_API_KEY", "test")
+    monkeypatch.setenv("TOOL_CACHE_CHECK_SECONDS", "0")
+    monkeypatch.setattr(serving, "ProcessPoolExecutor", InlineExecutor)
+    monkeypatch.setattr(serving, "RerankerService", OverlapReranker)
+    monkeypatch.setattr(serving, "_worker", {})
+
+    connection_class = getattr(fakeredis, "FakeRedisConnection", fakeredis.FakeConnection)
+    pool = redis.ConnectionPool(connection_class=connection_class, server=fakeredis.FakeServer())
+    service = ProcessSearchService(redis_service=RedisService(connection_pool=pool), search_workers=1,
+                                   rerank_workers=1, rerank_threads=1)
+    yield service
+    service.shutdown()
+
+
+def search(service, query):
+    tools = asyncio.run(service.search_tools(query, top_k=3, retrieval_mode="lexical"))
+    return [tool.ToolName for tool in tools]
+
+
+def test_search_sees_tools_written_after_start(service):
+    writer = RedisService(connection_pool=service.redis_service.redis_client.connection_pool)
+    weather = Tool("get_weather", "query the weather forecast for a city", [])
+    writer.store_tools([weather])
+    service.start()
+    old_index = service.index
+    assert search(service, "weather forecast") == ["get_weather"]
+
+    # 另一个进程写入新工具并删除旧工具
+    writer.store_tools([Tool("get_stock_price", "query the latest stock price", [])])
+    writer.delete_tools([weather.uuid])
+
+    assert search(service, "stock price") == ["get_stock_price"]
+    assert search(service, "weather forecast") == []
+    assert service.index is not old_index
+    assert serving._worker["index_name"] == service.index.name
+    # 旧共享内存块已释放
+    with pytest.raises(FileNotFoundError):
+        SharedIndex.attach(old_index.handle)
+
+
+def test_retired_index_is_kept_until_requests_finish(service):
+    service.start()
+    old_index = service.index
+    service._index_users[old_index] = 1
+
+    service.redis_service.redis_client.incr(CATALOG_VERSION_KEY)
+    assert asyncio.run(service.refresh_index())
+    assert service._retired == [old_index]
+    SharedIndex.attach(old_index.handle).close()
+
+    service._index_users.clear()
+    service._release_retired()
+    assert service._retired == []
+    with pytest.raises(FileNotFoundError):
+        SharedIndex.attach(old_index.handle)
@@ -0,0 +1,226 @@
+"""
+进程内切片向量存储的测试：命名空间分区、过滤、量化精度和快照
+"""
+import numpy as np
+import pytest
+
+from src.models import SearchFilter
+from src.slice_snapshot import SliceSnapshot
+from src.slice_store import PartitionedSliceStore
+
+DIMENSIONS = 32
+
+
+def make_vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(count, DIMENSIONS)).astype(np.float32)
+
+
+def make_store(count: int = 200, precision: str = "float32", namespaces=("default",),
+               vectors: np.ndarray = None) -> PartitionedSliceStore:
+    """每个工具一个切片，工具按序号轮流属于各命名空间，偶数号工具带finance标签"""
+    vectors = make_vectors(count) if vectors is None else vectors
+    originals = {f"tool_slices:t{i}:0": vectors[i] for i in range(count)}
+    store = PartitionedSliceStore(
+        dimensions=DIMENSIONS, precision=precision,
+        vector_loader=lambda keys: [originals.get(key) for key in keys]
+    )
+    store.upsert(
+        list(originals), [f"t{i}" for i in range(count)],
+        ["overview" if i % 3 else "parameter" for i in range(count)], vectors,
+        [namespaces[i % len(namespaces)] for i in range(count)],
+        [["finance"] if i % 2 == 0 else [] for i in range(count)]
+    )
+    return store
+
+
+def top_keys(store: PartitionedSliceStore, query: np.ndarray, k: int = 10, namespace: str = "default",
+             **filters) -> list:
+    search_filter = SearchFilter(namespace=namespace, **filters)
+    return [result["key"] for result in store.partition(namespace).search(query.tolist(), k, search_filter)]
+
+
+def test_namespaces_are_separate_partitions():
+    store = make_store(namespaces=("acme", "globex"))
+
+    assert store.namespaces == ["acme", "globex"]
+    assert len(store.partition("acme")) == len(store.partition("globex")) == 100
+    results = store.partition("acme").search(make_vectors(1, seed=1)[0].tolist(), 200)
+    assert {int(result["uuid"][1:]) % 2 for result in results} == {0}
+    assert len(store.partition("unknown")) == 0
+
+
+def test_namespace_move_removes_slice_from_old_partition():
+    store = make_store(count=10, namespaces=("acme",))
+    vector = make_vectors(1, seed=2)
+
+    store.upsert(["tool_slices:t3:0"], ["t3"], ["overview"], vector, ["globex"], [["finance"]])
+
+    assert "tool_slices:t3:0" not in store.partition("acme").keys()
+    assert store.partition("globex").keys() == ["tool_slices:t3:0"]
+    assert len(store) == 10
+    # 再删除时从新分区删除
+    store.remove(["tool_slices:t3:0"])
+    assert len(store.partition("globex")) == 0
+    assert len(store) == 9
+
+
+def test_tag_and_slice_type_filters():
+    store = make_store()
+    query = make_vectors(1, seed=3)[0]
+
+    finance = top_keys(store, query, k=200, tags=("finance",))
+    assert len(finance) == 100
+    assert all(int(key.split(":")[1][1:]) % 2 == 0 for key in finance)
+
+    parameter = top_keys(store, query, k=200, slice_types=("parameter",))
+    assert all(int(key.split(":")[1][1:]) % 3 == 0 for key in parameter)
+
+    both = top_keys(store, query, k=200, tags=("finance",), slice_types=("parameter",))
+    assert set(both) == set(finance) & set(parameter)
+
+
+@pytest.mark.parametrize("precision", ["float16", "int8"])
+def test_quantized_top_k_matches_float32(precision):
+    vectors = make_vectors(500)
+    exact = make_store(500, vectors=vectors)
+    quantized = make_store(500, precision=precision, vectors=vectors)
+
+    for query in make_vectors(20, seed=4):
+        assert top_keys(quantized, query) == top_keys(exact, query)
+
+
+@pytest.mark.parametrize("precision", ["float32", "int8"])
+def test_snapshot_round_trip(tmp_path, precision):
+    store = make_store(precision=precision, namespaces=("acme", "default"))
+    store.catalog_version = 7
+    snapshot = SliceSnapshot(str(tmp_path))
+
+    version = snapshot.write(store, "test-model")
+    loaded = snapshot.load("test-model", DIMENSIONS, precision, vector_loader=store.vector_loader, verify=True)
+
+    assert loaded.snapshot_version == version
+    assert loaded.catalog_version == 7
+    assert loaded.namespaces == store.namespaces
+    for query in make_vectors(5, seed=5):
+        for namespace in store.namespaces:
+            assert top_keys(loaded, query, namespace=namespace) == top_keys(store, query, namespace=namespace)
+            assert (top_keys(loaded, query, namespace=namespace, tags=("finance",))
+                    == top_keys(store, query, namespace=namespace, tags=("finance",)))
+    # 模型或精度不一致的快照被忽略
+    assert snapshot.load("other-model", DIMENSIONS, precision) is None
+
+
+def test_snapshot_store_is_writable_after_load(tmp_path):
+    store = make_store(count=20)
+    snapshot = SliceSnapshot(str(tmp_path))
+    snapshot.write(store, "test-model")
+    loaded = snapshot.load("test-model", DIMENSIONS, "float32")
+    vector = make_vectors(1, seed=6)
+
+    loaded.upsert(["tool_slices:new:0"], ["new"], ["overview"], vector, ["default"], [["finance"]])
+    loaded.remove(["tool_slices:t0:0"])
+
+    assert len(loaded) == 20
+    assert top_keys(loaded, vector[0], k=1) == ["tool_slices:new:0"]
+    # 快照文件本身不受影响
+    assert len(snapshot.load("test-model", DIMENSIONS, "float32")) == 20
+
+
+def change_rows(store: PartitionedSliceStore, inserted: int, overwritten: int, removed: int, seed: int):
+    """在默认分区插入新切片、覆盖和删除已有切片"""
+    keys = store.partition("default").keys()
+    new_keys = [f"tool_slices:n{seed}-{i}:0" for i in range(inserted)]
+    changed = new_keys + keys[:overwritten]
+    store.upsert(changed, [key.split(":")[1] for key in changed], ["overview"] * len(changed),
+                 make_vectors(len(changed), seed=seed), ["default"] * len(changed),
+                 [["finance"]] * len(changed))
+    store.remove(keys[overwritten:overwritten + removed])
+
+
+def brute_force_keys(partition, query: np.ndarray, rows: np.ndarray, k: int) -> list:
+    """在给定行上精确计算余弦相似度的Top K"""
+    vectors = np.asarray(partition._matrix[rows], dtype=np.float32)
+    scores = vectors @ (query / np.linalg.norm(query))
+    return [str(partition._keys[rows[i]]) for i in np.argsort(-scores, kind="stable")[:k]]
+
+
+def test_ivf_lists_cover_every_row_after_inserts_and_removes():
+    store = make_store(2000)
+    store.train_ivf(16)
+    change_rows(store, inserted=300, overwritten=100, removed=200, seed=7)
+    partition = store.partition("default")
+
+    rows = partition._list_rows(np.arange(partition.ivf_lists))
+
+    # 全部簇的行恰好是全部行，每行只出现一次，包括训练后新增、覆盖和因删除被移动的行
+    assert np.array_equal(rows, np.arange(len(partition)))
+
+
+def test_ivf_search_equals_brute_force_over_probed_lists():
+    store = make_store(2000)
+    store.train_ivf(16)
+    change_rows(store, inserted=300, overwritten=100, removed=200, seed=8)
+    partition = store.partition("default")
+
+    queries = make_vectors(20, seed=9)
+    batched = partition.search_rows_many(queries.tolist(), 10, nprobe=4)
+    for query, (batch_rows, _) in zip(queries, batched):
+        probed = partition._probe_lists((query / np.linalg.norm(query))[None, :], 4)[0]
+        expected = brute_force_keys(partition, query, partition._list_rows(probed), 10)
+        rows, _ = partition.search_rows(query.tolist(), 10, nprobe=4)
+        assert [str(partition._keys[row]) for row in rows] == expected
+        assert [str(partition._keys[row]) for row in batch_rows] == expected
+        # 扫描全部簇时即为精确检索
+        rows, _ = partition.search_rows(query.tolist(), 10, nprobe=partition.ivf_lists)
+        assert [str(partition._keys[row]) for row in rows] == brute_force_keys(
+            partition, query, np.arange(len(partition)), 10)
+
+
+def test_reload_adopts_centroids_and_retrains_on_drift():
+    vectors = make_vectors(2000)
+    previous = make_store(2000, vectors=vectors)
+    previous.train_ivf(16)
+    partition = previous.partition("default")
+    centroids = np.array(partition.ivf_centroids)
+    change_rows(previous, inserted=100, overwritten=0, removed=0, seed=10)
+    assert partition.ivf_trained_rows == 2000
+    assert partition.ivf_drift == pytest.approx(100 / 2000)
+
+    # 重新加载：Redis中有本进程插入的切片，另一个进程又删除了100个切片
+    reloaded = make_store(2000, vectors=vectors)
+    change_rows(reloaded, inserted=100, overwritten=0, removed=0, seed=10)
+    reloaded.remove([f"tool_slices:t{i}:0" for i in range(100)])
+    reloaded.adopt_ivf(previous)
+    partition = reloaded.partition("default")
+    assert np.allclose(partition.ivf_centroids, centroids)
+    assert partition.ivf_drift == pytest.approx(200 / 2000)
+    assert np.array_equal(partition._list_rows(np.arange(16)), np.arange(len(partition)))
+
+    assert reloaded.train_ivf(16, max_drift=0.2) == 0
+    assert np.allclose(partition.ivf_centroids, centroids)
+
+    change_rows(reloaded, inserted=300, overwritten=0, removed=0, seed=11)
+    assert reloaded.stale_ivf_partitions(16, max_drift=0.2) == ["default"]
+    assert reloaded.train_ivf(16, max_drift=0.2) == 1
+    assert partition.ivf_drift == 0.0
+    assert partition.ivf_trained_rows == len(partition)
+
+
+def test_retrain_on_copy_leaves_original_rows(tmp_path):
+    store = make_store(2000)
+    store.train_ivf(16)
+    change_rows(store, inserted=200, overwritten=0, removed=0, seed=12)
+    keys = store.partition("default").keys()
+
+    copy = store.copy()
+    assert copy.train_ivf(16) == 1
+
+    assert store.partition("default").keys() == keys
+    assert store.partition("default").ivf_changed_rows == 200
+    assert sorted(copy.partition("default").keys()) == sorted(keys)
+
+    # 漂移计数随快照保存
+    snapshot = SliceSnapshot(str(tmp_path))
+    snapshot.write(store, "test-model")
+    loaded = snapshot.load("test-model", DIMENSIONS, "float32").partition("default")
+    assert (loaded.ivf_trained_rows, loaded.ivf_changed_rows) == (2000, 200)